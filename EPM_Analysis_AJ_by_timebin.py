@@ -11,156 +11,324 @@ This script is
 (1) to analyze the time spent (second) and distance travelled (cm) in each arm and center in specific time bin you enter (in second)
 (2) to analyze the time spent (second), distance travelled (cm) and speed (cm/s) in open/closed arms and center for 05 minutes, 10 minutes and 15 minutes (depending on the experimental time)
 (3) to draw the trajectory of each mouse for 05 minutes, 10 minutes and 15 minutes (depending on the experimental time)
+(4) to count the entries, latencies (second), bouts, mean bout durations (second) and transitions between the arms and center for the same periods
 
 *******
 Important information before starting this code
 
-1. In the same working directory, you should have a video file (F835_EPM.avi) and its bonsai file (F835_EPM-bonsai.csv) of each animal and an excel file (EPM_data.xlsx : Should include information with column names; 'Animal no':int, 'Sex':str,'Starting time':int (in sec), 'Group': str) with animal no, sex and the starting time (as second) of video analysis. Please keep the file name as above. 
+1. In the same working directory, you should have a video file (F835_EPM.avi) and its bonsai file (F835_EPM-bonsai.csv) of each animal and an excel file (EPM_data.xlsx : Should include information with column names; 'Animal no':int, 'Sex':str,'Starting time':int (in sec), 'Group': str) with animal no, sex and the starting time (as second) of video analysis. Please keep the file name as above.
+   If several animals are recorded in one video (e.g. Rig1_EPM.avi and Rig1-EPM-bonsai.csv with the columns mouseX_1, mouseY_1, mouseX_2, ...), add the columns 'Video' (Rig1) and 'Arena' (1, 2, ...) to the excel file and click the corners of each arena for its animal. The bonsai file is split into the bonsai file of each animal.
 
-2. In the console, there will be three questions poped up: 
+2. In the console, there will be five questions poped up: 
     
     'Please enter how long one session of the experiment takes (in minutes):   ' --> Please write the experimental time in minutes. Then, press enter key.
     'Please enter the time bin (in second):   '. --> Please write the divisor of experimental time (in second) that you entered. Then, press enter key.
     'Do you want to define 5 regions of EPM (press 1) or 3 regions of EPM (press 2)?   ' --> Press 1 or 2. Then, press enter key.
+    'Do you want to detect the corners of EPM automatically (press 1) or click them (press 2)?   ' --> Press 1 or 2. Then, press enter key.
+    'Do you want to save a profiling report of the analysis (press 1) or not (press 2)?   ' --> Press 1 or 2. Then, press enter key.
 
 3. When the first frame of video pops up, you should click 12 corners of EPM counterclockwise from the top left corner of upper closed arm and enter esc key to close the video.
+   The clicked coordinates are saved in EPM_calibration.json and reused when the same video is analyzed again, so the first frame only pops up for new videos. 
+   If the number of clicks is not 12, the first frame pops up again.
+   If you choose to detect the corners automatically, the first frame only pops up when the EPM is not detected reliably.
 
 4. It is important to click the exact coordinates of center, since the pixel size is calculated based on those coordinates.
 
 5. At the end, you will have an excel file with all the data analyzed and the trajectory of each mouse for 05 minutes, 10 minutes and 15 minutes (depending on the experimental time).
 
-6. If you want to reanalyze, please check whether you have proper column names and remove previous data in excel file.
+6. If you reanalyze, the previous results in the columns of this analysis are replaced. Other columns of the excel file are kept.
+   The results of each animal are cached in the directory result_cache. Only the animals whose bonsai file, coordinates, frame rate, starting time or the questions above changed are analyzed again (and their trajectories drawn).
+
+7. With the profiling report, the wall time, CPU time, peak memory and frames/s of each stage (video, load_csv, rasterize, classify, aggregate, bins, plot, excel) of each animal are saved in EPM_profile.json and summarized in the console.
+   The slowest animal is analyzed once more under cProfile (without drawing its trajectory again) and its statistics are saved in EPM_slowest.prof (python -m pstats EPM_slowest.prof).
+
+8. The first frames of the next videos and the bonsai files of the next mice are loaded in the background while the current mouse is analyzed (useful for cohorts on a network share).
+   How many files are loaded ahead and how much memory they may take are set by PREFETCH_DEPTH and PREFETCH_MEMORY_MB in maze_analysis/prefetch.py.
 *******
 Enjoy the analysis!
 """
 
 # Import packages
 import pandas as pd
-import matplotlib.pyplot as plt
-import cv2 as cv
-from matplotlib.path import Path
-import matplotlib.patches as patches
-from matplotlib import rc
 import numpy as np
+from os import path
+from maze_analysis import rasterize_ROI, classify_frames, step_distance, ZoneCumsum, calculate_speed, load_bonsai, ResultBuilder, write_excel, analysis_windows, frame_index, stream_zone_sums
+from maze_analysis.cohort import cohort_sums
+from maze_analysis.events import zone_events, event_columns, add_events
+from maze_analysis.timestamps import frame_durations
+from maze_analysis.rendering import Renderer, render_windows
+from maze_analysis.mazes import EPM_MAZE, draw_trajectory as draw_maze_trajectory
+from maze_analysis.video import read_video, click_coords
+from maze_analysis.calibration import calibration_path, load_calibration, save_calibration, get_coords, calibrate, report_calibration, check_clicks, video_fingerprint
+from maze_analysis.arenas import animal_videos, video_arenas, split_videos
+from maze_analysis.result_cache import ResultCache, CACHE_DIRECTORY, analysis_key
+from maze_analysis.profiling import Profiler, profile_stage, profile_call
+from maze_analysis.prefetch import prefetch
 
-def onclick(event,x,y,flag,image):
+# Regions of the entries, latencies, bouts and transitions (zone labels: 0, 1 open arms, 2, 3 closed arms, 4 center).
+# Frames off the maze continue the previous region.
+EVENT_REGIONS = [('OA', [0, 1]), ('CA', [2, 3]), ('CT', [4])]
+EVENT_ARMS = [('OA_left', [0]), ('OA_right', [1]), ('CA_up', [2]), ('CA_down', [3]), ('CT', [4])]
+
+def event_zones(analysis_way):
     """
-    Get the coordinates of mouse click (left mouse click) ane return the coordinates as list.
+    Return the regions and the states of the zone events by time bin (1: each arm, 2: open arms, closed arms and center)
     """
-    global coords
-    if event == cv.EVENT_LBUTTONUP:
-        coords.append((x,y))
-        return
+    if analysis_way == 1:
+        return EVENT_ARMS + EVENT_REGIONS[:2], EVENT_ARMS
+    return EVENT_REGIONS, EVENT_REGIONS
 
 def define_ROI(coords):
     """
-    Define the regions of interest from coordinate list.
+    Define the regions of interest from coordinate list (see EPM_MAZE in maze_analysis/mazes.py).
     """
-    open_arm_1 = Path([coords[1],coords[2],coords[3],coords[4]])
-    open_arm_2 = Path([coords[7],coords[8],coords[9],coords[10]])
-    closed_arm_1 = Path([coords[0],coords[1],coords[10],coords[11]])
-    closed_arm_2 = Path([coords[4],coords[5],coords[6],coords[7]])
-    center = Path([coords[1],coords[4],coords[7],coords[10]])
-    coords_list = [open_arm_1, open_arm_2, closed_arm_1, closed_arm_2, center]
-    return coords_list
+    return EPM_MAZE.rois(coords)
         
-def draw_trajectory(bonsai_file, coords_list, animal_no, animal_sex, time, width, height):
+def draw_trajectory(bonsai_file, coords_list, animal_no, animal_sex, time, width, height, renderer=None):
     """
     Draw the trajectory of mouse location depending on experimental time and save this graph.
+    With renderer (see maze_analysis/rendering.py), the graph is drawn in the background while the analysis goes on.
     """   
-    # Plot each point
-    plt.scatter(bonsai_file['mouseX'], bonsai_file['mouseY'], s=0.5)
-    
-    # Draw each ROIs
-    oa_1_patch = patches.PathPatch(coords_list[0],edgecolor='yellow',fill=0, lw=2)
-    oa_2_patch = patches.PathPatch(coords_list[1],edgecolor='orange',fill=0, lw=2)
-    ca_1_patch = patches.PathPatch(coords_list[2],edgecolor='green',fill=0, lw=2)
-    ca_2_patch = patches.PathPatch(coords_list[3],edgecolor='blue',fill=0, lw=2)
-    ct_patch = patches.PathPatch(coords_list[4],edgecolor='red',fill=0, lw=2)
-    
-    plt.gca().add_patch(oa_1_patch)
-    plt.gca().add_patch(oa_2_patch)
-    plt.gca().add_patch(ca_1_patch)
-    plt.gca().add_patch(ca_2_patch)
-    plt.gca().add_patch(ct_patch)
-    
-    # Assign the characteristics of the plot
-    plt.title("%s%s_EPM_%s"%(animal_sex, animal_no, time))
-    plt.xlabel('X')
-    plt.ylabel('Y')
-    plt.xlim(0, width)
-    plt.ylim(0, height)
-    plt. rcParams["figure.figsize"] = (8,6)
-    rc('font', **{'family':'Arial'})
-    plt.axis('off')
-    plt.savefig("%s%s_EPM_%s.jpg"%(animal_sex, animal_no, time), forat = 'jpg')
-    plt.show()
-    return
+    draw_maze_trajectory(EPM_MAZE, bonsai_file, coords_list, "%s%s_EPM_%s"%(animal_sex, animal_no, time), width, height, "%s%s_EPM_%s.jpg"%(animal_sex, animal_no, time), renderer)
 
 def calculate_pixel(coords_list):
     """
     Based on the coordinates of EPM (5cm x 5cm in center), calculate and return the size of pixel
     """
-    x_1, y_1 = coords_list[1]
-    x_2, y_2 = coords_list[4]
-    x_3, y_3 = coords_list[7]
-    x_4, y_4 = coords_list[10]
+    return EPM_MAZE.pixel_size(coords_list)
 
-    p_1 = (25/((x_1-x_2)**2 + (y_1-y_2)**2))**0.5 # size of pixel in centimeter. 25 means 5cmx5cm for center of EPM. 
-    p_2 = (25/((x_3-x_2)**2 + (y_3-y_2)**2))**0.5
-    p_3 = (25/((x_3-x_4)**2 + (y_3-y_4)**2))**0.5
-    p_4 = (25/((x_1-x_4)**2 + (y_1-y_4)**2))**0.5
+def calculate_time(zone_cumsum, a, b, frame_rate, coords_list):
+    """
+    Calculate the time spent in ROIs between frame a and b from the cumulative frame counts (or frame durations, see maze_analysis/timestamps.py) and return the data in list format
+    """
+    return EPM_MAZE.time_spent(zone_cumsum, a, b, frame_rate)[:len(coords_list)]
+
+def calculate_distance(zone_cumsum, a, b, coords_list):
+    """
+    Calculate distance travelled in ROI between frame a and b from the cumulative distances and return a list of [dist in OA_left, dist in OA_right, dist in CA_up, dist in CA_down, dist in center,  Total dist]. Please take the order of elements into account when you add these values in the data set!!
+    Each step is assigned to the ROI of the frame where the step starts.
+    """    
+    return EPM_MAZE.distance(zone_cumsum, a, b)
+
+def create_columns(total_exp_time_min, timebin_in_sec, analysis_way):
+    """
+    Create the column names depending on the time bin and the way of analysis (1: 5 regions, 2: 3 regions)
+    """
+    total_exp_time_sec = total_exp_time_min*60
+    df_columns = ['Timebin']
+    for period in ['05min', '10min', '15min']:
+        df_columns = df_columns + ['Time_OA_%s'%(period), 'Time_CA_%s'%(period), 'Time_CT_%s'%(period)] + event_columns(period, EVENT_REGIONS, EVENT_REGIONS)
+        df_columns = df_columns + ['Dist_OA_%s'%(period), 'Dist_CA_%s'%(period), 'Dist_CT_%s'%(period), 'Dist_Total_%s'%(period), 'Speed_OA_%s'%(period), 'Speed_CA_%s'%(period), 'Speed_CT_%s'%(period), 'Speed_Total_%s'%(period)]
     
-    p = (p_1+p_2+p_3+p_4)/4
-    return p
+    regions, states = event_zones(analysis_way)
+    for i in range(int(total_exp_time_sec/timebin_in_sec)):
+        start = timebin_in_sec * i
+        end = timebin_in_sec * (i+1)
+        period = '%ss_%ss'%(str(start), str(end))   
+        if analysis_way == 2:
+            df_columns = df_columns + ['Time_CT_%s'%(period), 'Time_OA_%s'%(period), 'Time_CA_%s'%(period)] + event_columns(period, regions, states)
+            df_columns = df_columns + ['Dist_CT_%s'%(period), 'Dist_Total_%s'%(period), 'Dist_OA_%s'%(period), 'Dist_CA_%s'%(period)]                       
+        elif analysis_way == 1:     
+            df_columns = df_columns + ['Time_OA_left_%s'%(period), 'Time_OA_right_%s'%(period), 'Time_CA_up_%s'%(period), 'Time_CA_down_%s'%(period), 'Time_CT_%s'%(period), 'Time_OA_%s'%(period), 'Time_CA_%s'%(period)] + event_columns(period, regions, states)
+            df_columns = df_columns + ['Dist_OA_left_%s'%(period), 'Dist_OA_right_%s'%(period), 'Dist_CA_up_%s'%(period), 'Dist_CA_down_%s'%(period), 'Dist_CT_%s'%(period), 'Dist_Total_%s'%(period), 'Dist_OA_%s'%(period), 'Dist_CA_%s'%(period)]        
+    return df_columns
 
-def calculate_time(bonsai_file, frame_rate, coords_list):
+def add_results(results, zone_cumsum, frame_rate, time, total_exp_time_min, timebin_in_sec, coords_list, analysis_way, zone_events=None, timestamps=None):
     """
-    Calculate the time spent in ROIs and return the data in list format
+    Calculate the time spent, the distance travelled and speed in each region by time bin and for 05, 10 and 15 minutes and add them to results as {column name: value}.
+    With zone_events (see maze_analysis/events.py), the entries, latencies, bouts and transitions of the same windows are added too.
+    frame_rate and time can also be arrays with one value per animal (see analyze_cohort), then each value is an array.
+    With timestamps (see maze_analysis/timestamps.py), the frames of the time bins are found in the timestamps of the frames instead of the frame rate.
     """
-    bonsai_file_list = list(zip(bonsai_file['mouseX'], bonsai_file['mouseY']))
-    time_spent=[]    
-    for i in range(len(coords_list)):
-        inside_region = coords_list[i].contains_points(bonsai_file_list)
-        time_inside_region = sum(inside_region)/frame_rate
-        time_spent.append(time_inside_region)        
-    return time_spent
+    total_exp_time_sec = total_exp_time_min*60
+    bin_5min = int(total_exp_time_min/5)
+    regions, states = event_zones(analysis_way)
+    
+    # Calculate the time spent and the distance travelled in each region by specific time bin
+    for i in range(int(total_exp_time_sec/(timebin_in_sec))):
+        start = timebin_in_sec * i
+        end = timebin_in_sec * (i+1)
+        
+        a = frame_index(frame_rate, time + start, timestamps)
+        b = frame_index(frame_rate, time + end, timestamps)
+        df_time_timebin = calculate_time(zone_cumsum, a, b, frame_rate, coords_list)
+        df_dist_timebin = calculate_distance(zone_cumsum, a, b, coords_list)
+        
+        period = '%ss_%ss'%(str(start), str(end))
+        
+        results['Time_CT_%s'%(period)] = df_time_timebin[4]
+        results['Time_OA_%s'%(period)] = df_time_timebin[0] + df_time_timebin[1]
+        results['Time_CA_%s'%(period)] = df_time_timebin[2] + df_time_timebin[3]            
+        if zone_events is not None:
+            add_events(results, zone_events, a, b, frame_rate, period, regions, states)
+
+        results['Dist_CT_%s'%(period)] = df_dist_timebin[4]
+        results['Dist_Total_%s'%(period)] = df_dist_timebin[5]
+        results['Dist_OA_%s'%(period)] = df_dist_timebin[0] + df_dist_timebin[1]
+        results['Dist_CA_%s'%(period)] = df_dist_timebin[2] + df_dist_timebin[3]            
+                        
+        if analysis_way == 1:    
+            results['Time_OA_left_%s'%(period)] = df_time_timebin[0]
+            results['Time_OA_right_%s'%(period)] = df_time_timebin[1]
+            results['Time_CA_up_%s'%(period)] = df_time_timebin[2]
+            results['Time_CA_down_%s'%(period)] = df_time_timebin[3]
+            
+            results['Dist_OA_left_%s'%(period)] = df_dist_timebin[0]
+            results['Dist_OA_right_%s'%(period)] = df_dist_timebin[1]
+            results['Dist_CA_up_%s'%(period)] = df_dist_timebin[2]
+            results['Dist_CA_down_%s'%(period)] = df_dist_timebin[3]
+        
+    # Calculate the values of each mouse for 05, 10 and 15 minutes
+    for i in range(bin_5min):
+        i = i+1
+        a = frame_index(frame_rate, time, timestamps)
+        b = frame_index(frame_rate, time+i*300, timestamps)
+        
+        df_time = calculate_time(zone_cumsum, a, b, frame_rate, coords_list)
+        df_dist = calculate_distance(zone_cumsum, a, b, coords_list)
+        time_str = str('%02d'%(i*5))+'min'
+
+        results['Time_CT_%s'%(time_str)] = df_time[4]
+        results['Time_OA_%s'%(time_str)] = df_time[0] + df_time[1]
+        results['Time_CA_%s'%(time_str)] = df_time[2] + df_time[3]
+        if zone_events is not None:
+            add_events(results, zone_events, a, b, frame_rate, time_str, EVENT_REGIONS, EVENT_REGIONS)
+        
+        results['Dist_CT_%s'%(time_str)] = df_dist[4]
+        results['Dist_Total_%s'%(time_str)] = df_dist[5]
+        results['Dist_OA_%s'%(time_str)] = df_dist[0] + df_dist[1]
+        results['Dist_CA_%s'%(time_str)] = df_dist[2] + df_dist[3]
 
-def calculate_distance(bonsai_file, p, coords_list):
+        results['Speed_CT_%s'%(time_str)] = calculate_speed(df_dist[4], df_time[4])
+        results['Speed_Total_%s'%(time_str)] = calculate_speed(df_dist[5], i*300)
+        results['Speed_OA_%s'%(time_str)] = calculate_speed(df_dist[0] + df_dist[1], df_time[0] + df_time[1])
+        results['Speed_CA_%s'%(time_str)] = calculate_speed(df_dist[2] + df_dist[3], df_time[2] + df_time[3])
+
+def analyze_animal(anim_no, sex, time, coords, frame_rate, width, height, total_exp_time_min, timebin_in_sec, analysis_way, draw=True, chunk_size=None, timestamps=None, renderer=None, profiler=None, bonsai_file=None):
     """
-    Calculate distance travelled in ROI and return a list of [dist in OA_left, dist in OA_right, dist in CA_up, dist in CA_down, dist in center,  Total dist]. Please take the order of elements into account when you add these values in the data set!!
-    """    
-    x = bonsai_file['mouseX']
-    y = bonsai_file['mouseY']
-    Total_dist = []
-    OA_left_dist = []
-    OA_right_dist = []
-    CA_up_dist = []
-    CA_down_dist = []
-    CT_dist = []
+    Analyze the bonsai file of one mouse with the 12 clicked coordinates and return the results as {column name: value}.
+    With draw=True (or 'all'), the trajectory of the mouse is drawn for 05, 10 and 15 minutes, with draw='final' only for the whole session and with draw=False (or 'none') not at all.
+    With renderer (see maze_analysis/rendering.py), the trajectories are drawn by other processes while the analysis goes on.
+    With chunk_size, the bonsai file is streamed in chunks of chunk_size frames with constant memory (for long recordings), a trajectory is drawn from at most TRAJECTORY_POINTS positions (see maze_analysis/streaming.py).
+    With timestamps (TimestampIndex of the bonsai file, see maze_analysis/timestamps.py), the time bins and the time spent follow the real times of the frames (not with chunk_size).
+    With profiler (see maze_analysis/profiling.py), the wall time, CPU time, peak memory and frames of each stage are recorded.
+    With bonsai_file (DataFrame of the bonsai file loaded ahead, see maze_analysis/prefetch.py), the bonsai file is not read again (not with chunk_size).
+    """
+    anim_id = sex + str(anim_no)
+    bin_5min = int(total_exp_time_min/5)
+    results = {}
+    
+    # Calculate the size of pixel (centimeter for EPM)
+    coords_list = define_ROI(coords)
+    p = calculate_pixel(coords)
+    
+    # Label raster of the ROIs to classify the frames
+    bonsai_csv = '%s-EPM-bonsai.csv'%(anim_id)
+    with profile_stage(profiler, 'rasterize', anim_id):
+        label_raster = rasterize_ROI(coords_list, width, height)
+    
+    # Windows (first frame, last frame, name) of the trajectories of the mouse, the positions are kept while streaming
+    draw_windows = [(frame_index(frame_rate, time, timestamps), frame_index(frame_rate, time+(i+1)*300, timestamps), '%02dmin'%((i+1)*5)) for i in render_windows(draw, bin_5min)]
+    
+    if chunk_size is not None and timestamps is not None:
+        raise ValueError('The timestamp index cannot be used when the bonsai file is streamed in chunks')
+    if chunk_size is None:
+        # Open the bonsai file in csv format and classify all frames into the ROIs once
+        if bonsai_file is None:
+            with profile_stage(profiler, 'load_csv', anim_id) as record:
+                bonsai_file = load_bonsai(bonsai_csv)
+                record['frames'] = len(bonsai_file)
+        with profile_stage(profiler, 'classify', anim_id, len(bonsai_file)):
+            zone_labels = classify_frames(label_raster, coords_list, bonsai_file['mouseX'], bonsai_file['mouseY'])
+        
+        # Cumulative sums of frames and distances per ROI, so that every time bin costs one difference
+        with profile_stage(profiler, 'aggregate', anim_id, len(bonsai_file)):
+            dist = step_distance(bonsai_file['mouseX'], bonsai_file['mouseY'], p)
+            durations = None if timestamps is None else frame_durations(timestamps, len(bonsai_file), bonsai_csv)
+            zone_cumsum = ZoneCumsum(zone_labels, dist, len(coords_list), durations)
+            
+            # Runs of the zone labels for the entries, latencies, bouts and transitions (off the maze: previous region)
+            events = zone_events(zone_labels, bonsai_file['mouseX'], bonsai_file['mouseY'], carry_outside=True, durations=durations)
+    else:
+        # Stream the bonsai file in chunks, only the cumulative sums at the edges of the time bins are kept
+        with profile_stage(profiler, 'stream', anim_id) as record:
+            windows = analysis_windows(frame_rate, time, total_exp_time_min, timebin_in_sec)
+            zone_cumsum = stream_zone_sums(bonsai_csv, windows, lambda x, y: classify_frames(label_raster, coords_list, x, y), p, len(coords_list), chunk_size, carry_outside=True, draw_windows=[(a, b) for a, b, time_str in draw_windows])
+            events = zone_cumsum.zone_events()
+            record['frames'] = zone_cumsum.n_frame
+    
+    # Calculate the time spent, the distance travelled, speed and the zone events in each region
+    with profile_stage(profiler, 'bins', anim_id):
+        add_results(results, zone_cumsum, frame_rate, time, total_exp_time_min, timebin_in_sec, coords_list, analysis_way, events, timestamps)
+    
+    # Draw the trajectory of each mouse for 05, 10 and 15 minutes
+    with profile_stage(profiler, 'plot', anim_id):
+        for k, (a, b, time_str) in enumerate(draw_windows):
+            bonsai_file_new = bonsai_file.iloc[a:b] if chunk_size is None else zone_cumsum.trajectory(k)
+            draw_trajectory(bonsai_file_new, coords_list, anim_no, sex, time_str, width, height, renderer)
     
-    for i in bonsai_file.index.values.tolist()[:-2]:
-        a = i
-        b = a+1
-        dist = (((x[a] - x[b])*p)**2+((y[a] - y[b])*p)**2)**0.5
-        Total_dist.append(dist)
+    results['Timebin'] = timebin_in_sec
+    return results
 
-        if coords_list[0].contains_point((x[a], y[a])):
-            OA_left_dist.append(dist)
-        elif coords_list[1].contains_point((x[a], y[a])):
-            OA_right_dist.append(dist)
-        elif coords_list[2].contains_point((x[a], y[a])):
-            CA_up_dist.append(dist)
-        elif coords_list[3].contains_point((x[a], y[a])):
-            CA_down_dist.append(dist)
-        elif coords_list[4].contains_point((x[a], y[a])):
-            CT_dist.append(dist)
-    return [np.nansum(OA_left_dist), np.nansum(OA_right_dist), np.nansum(CA_up_dist), np.nansum(CA_down_dist), np.nansum(CT_dist), np.nansum(Total_dist)]        
+def analyze_cohort(animals, total_exp_time_min, timebin_in_sec, analysis_way, timestamps=None, cohort=None):
+    """
+    Analyze the bonsai files of all mice at once (see maze_analysis/cohort.py) and return the results of each mouse as {column name: value}, like analyze_animal without trajectory.
+    With timestamps (TimestampIndex of each animal), the time bins follow the real times of the frames.
+    With cohort (CohortTracks of the animals, see maze_analysis/store.py), the positions are not read from the bonsai files.
+    animals: list of (animal no, sex, starting time, 12 clicked coordinates, frame rate)
+    """
+    coords_lists = [define_ROI(coords) for no, sex, time, coords, frame_rate in animals]
+    frame_rates = np.array([frame_rate for no, sex, time, coords, frame_rate in animals], dtype=np.float64)
+    times = np.array([time for no, sex, time, coords, frame_rate in animals], dtype=np.int64)
+    
+    # Frames and distances in the ROIs of all mice and all windows
+    zone_sums, events = cohort_sums(['%s%s-EPM-bonsai.csv'%(sex, no) for no, sex, time, coords, frame_rate in animals], coords_lists,
+                                    [calculate_pixel(coords) for no, sex, time, coords, frame_rate in animals], len(coords_lists[0]),
+                                    analysis_windows(frame_rates, times, total_exp_time_min, timebin_in_sec, timestamps), carry_outside=True, timestamps=timestamps, cohort=cohort)
+    
+    cohort_results = {}
+    add_results(cohort_results, zone_sums, frame_rates, times, total_exp_time_min, timebin_in_sec, coords_lists[0], analysis_way, events, timestamps)
+    results = []
+    for k in range(len(animals)):
+        animal_results = {column: float(values[k]) for column, values in cohort_results.items()}
+        animal_results['Timebin'] = timebin_in_sec
+        results.append(animal_results)
+    return results
+
+def live_results(zone_sums, a, b, frame_rate, duration, coords_list, analysis_way):
+    """
+    Calculate the time spent (second), the distance travelled (cm) and speed (cm/s) in each region between frame a and b for the live analysis and return them as {column name without period: value}
+    """
+    df_time = calculate_time(zone_sums, a, b, frame_rate, coords_list)
+    df_dist = calculate_distance(zone_sums, a, b, coords_list)
+    
+    results = {}
+    results['Time_CT'] = df_time[4]
+    results['Time_OA'] = df_time[0] + df_time[1]
+    results['Time_CA'] = df_time[2] + df_time[3]
+    
+    results['Dist_CT'] = df_dist[4]
+    results['Dist_Total'] = df_dist[5]
+    results['Dist_OA'] = df_dist[0] + df_dist[1]
+    results['Dist_CA'] = df_dist[2] + df_dist[3]
+    
+    results['Speed_CT'] = calculate_speed(df_dist[4], df_time[4])
+    results['Speed_Total'] = calculate_speed(df_dist[5], duration)
+    results['Speed_OA'] = calculate_speed(df_dist[0] + df_dist[1], df_time[0] + df_time[1])
+    results['Speed_CA'] = calculate_speed(df_dist[2] + df_dist[3], df_time[2] + df_time[3])
+    
+    if analysis_way == 1:
+        for i, region in enumerate(['OA_left', 'OA_right', 'CA_up', 'CA_down']):
+            results['Time_%s'%(region)] = df_time[i]
+            results['Dist_%s'%(region)] = df_dist[i]
+            results['Speed_%s'%(region)] = calculate_speed(df_dist[i], df_time[i])
+    return results
 
 if __name__ == '__main__':
 
     # Get the address of excel file and open the file
     excel_file="EPM_data.xlsx"
+    directory = path.dirname(path.abspath(excel_file))
     df = pd.read_excel(excel_file, converters={'Animal no':str,'Sex':str,'Starting time':int}, index_col = 'Animal no')
 
     # Get all the animal no, sex and starting time as list formats
@@ -170,137 +338,104 @@ if __name__ == '__main__':
         
     # Ask the time bin in sec and get the value in integer format
     total_exp_time_min = int(input('Please enter how long one session of the experiment takes (in minutes):   '))
-    total_exp_time_sec = total_exp_time_min*60
     timebin_in_sec = int(input('Please enter the time bin in sec:  '))    
     analysis_way = int(input('Do you want to define 5 regions of EPM (press 1) or 3 regions of EPM (press 2)?   '))
         
-    # Create the column names depending on the time bin    
-    df_columns = ['Timebin']
-    bin_5min = int(total_exp_time_min/5)
-    for period in ['05min', '10min', '15min']:
-        df_columns = df_columns + ['Time_OA_%s'%(period), 'Time_CA_%s'%(period), 'Time_CT_%s'%(period), 'Dist_OA_%s'%(period), 'Dist_CA_%s'%(period), 'Dist_CT_%s'%(period), 'Dist_Total_%s'%(period), 'Speed_OA_%s'%(period), 'Speed_CA_%s'%(period), 'Speed_CT_%s'%(period), 'Speed_Total_%s'%(period)]
+    # Cache of the results of each animal (see maze_analysis/result_cache.py)
+    cache = ResultCache(CACHE_DIRECTORY)
     
-    for i in range(int(total_exp_time_sec/timebin_in_sec)):
-        start = timebin_in_sec * i
-        end = timebin_in_sec * (i+1)
-        period = '%ss_%ss'%(str(start), str(end))   
-        if analysis_way == 2:
-            df_columns = df_columns + ['Time_CT_%s'%(period), 'Time_OA_%s'%(period), 'Time_CA_%s'%(period), 'Dist_CT_%s'%(period), 'Dist_Total_%s'%(period), 'Dist_OA_%s'%(period), 'Dist_CA_%s'%(period)]                       
-        elif analysis_way == 1:     
-            df_columns = df_columns + ['Time_OA_left_%s'%(period), 'Time_OA_right_%s'%(period), 'Time_CA_up_%s'%(period), 'Time_CA_down_%s'%(period), 'Time_CT_%s'%(period), 'Time_OA_%s'%(period), 'Time_CA_%s'%(period), 'Dist_OA_left_%s'%(period), 'Dist_OA_right_%s'%(period), 'Dist_CA_up_%s'%(period), 'Dist_CA_down_%s'%(period), 'Dist_CT_%s'%(period), 'Dist_Total_%s'%(period), 'Dist_OA_%s'%(period), 'Dist_CA_%s'%(period)]        
-
-    # Create the new columns with new column names in the dataframe
-    df_add = pd.DataFrame(index = animal_no, columns = df_columns)
-    df_add = df_add.fillna(0)
-    df = pd.concat([df, df_add], axis=1)
+    # Collect the results of all animals in the columns depending on the time bin
+    builder = ResultBuilder(create_columns(total_exp_time_min, timebin_in_sec, analysis_way))
     
-    # Open the video file and its bonsai file of each mouse from excel file
-    for no, sex, time in zip(animal_no, animal_sex, starting_time):
-        anim_no = str(no)
+    # Ask whether the corners of new videos are detected automatically
+    auto_calibration = int(input('Do you want to detect the corners of EPM automatically (press 1) or click them (press 2)?   '))
+    
+    # Ask whether the time and memory of each stage are recorded (see maze_analysis/profiling.py)
+    profiler = Profiler() if int(input('Do you want to save a profiling report of the analysis (press 1) or not (press 2)?   ')) == 1 else None
+    
+    # Load the calibration of the cohort (coordinates clicked in previous analyses)
+    calibration_file = calibration_path('EPM')
+    calibration = load_calibration(calibration_file)
+    
+    # Click 12 corners of EPM on the first image of each new video, the saved coordinates are reused for the others
+    # Several animals can be recorded in one video (columns 'Video' and 'Arena', see maze_analysis/arenas.py), their arenas are clicked on the same frame
+    videos = animal_videos(df)
+    arenas = video_arenas(videos)
+    
+    # The first frames of the next videos are read while the corners of the current one are clicked (see maze_analysis/prefetch.py)
+    video_frames = prefetch(read_video, ["%s_EPM.avi"%(video) for video in dict.fromkeys(videos[sex + str(no)][0] for no, sex in zip(animal_no, animal_sex))])
+    frames = {}
+    video_info = {}
+    for no, sex in zip(animal_no, animal_sex):
         anim_id = sex + str(no)
+        video = videos[anim_id][0]
+        video_file = "%s_EPM.avi"%(video)
+        if video not in frames:
+            with profile_stage(profiler, 'video', anim_id):
+                frames[video] = next(video_frames)[1]
+        img, frame_rate, width, height = frames[video]
+        video_info[no] = (frame_rate, width, height)
         
-        # Read the video file by opencv package
-        video_file="%s_EPM.avi"%(anim_id)
-        vid_cap=cv.VideoCapture(video_file)
-        success, image = vid_cap.read()
-        
-        # Get the frame rate, height and width of a video file
-        frame_rate = vid_cap.get(cv.CAP_PROP_FPS)        
-        height = vid_cap.get(cv.CAP_PROP_FRAME_HEIGHT)
-        width = vid_cap.get(cv.CAP_PROP_FRAME_WIDTH)        
-
-        # Get the first image in img
-        if success == 1:
-            img = image               
-        
-        # Pop the first image from video file up
-        coords = []  
-        cv.namedWindow('Image_%s'%(anim_id), cv.WINDOW_NORMAL)
-        cv.imshow('Image_%s'%(anim_id), img)
-        
-        # Save coordinates of 12 mouse clicks in coods
-        cv.setMouseCallback('Image_%s'%(anim_id), onclick, img)        
+        # An unreadable video can only be used with the saved coordinates of the animal
+        if img is None and (not path.exists(video_file) or not check_clicks('EPM', get_coords(calibration, anim_id, video_fingerprint(video_file)))):
+            raise SystemExit('The first frame of %s cannot be read, so the corners of %s cannot be detected or clicked. Please check the video file.'%(video_file, anim_id))
         
-        # wait for Esc or q key and then exit
-        while True:
-            key = cv.waitKey(1) & 0xFF
-            if key == 27 or key == ord("q"):
-                cv.destroyAllWindows()
-                break             
-        
-        # Calculate the size of pixel (centimeter for EPM)
-        coords_list = define_ROI(coords)
-        p = calculate_pixel(coords)
-        
-        # Open the bonsai file in csv format
-        bonsai_file = pd.read_csv(r'%s-EPM-bonsai.csv'%(anim_id),sep='\s+', engine='python', encoding = "cp949", converters={'mouseX': float,'mouseY': float,'mouseAngle': float,'mouseMajorAxisLength': float, 'mouseMinorAxisLength': float,'mouseArea': float})  
-        
-        # Calculate the time spent and the distance travelled in each region by specific time bin
-        for i in range(int(total_exp_time_sec/(timebin_in_sec))):
-            start = timebin_in_sec * i
-            end = timebin_in_sec * (i+1)
-            
-            a = int(frame_rate * (time + start))
-            b = int(frame_rate * (time + end))
-            bonsai_file_timebin = bonsai_file.iloc[a:b]
-            bonsai_file_timebin.columns = bonsai_file.columns
-            df_time_timebin = calculate_time(bonsai_file_timebin, frame_rate, coords_list)
-            df_dist_timebin = calculate_distance(bonsai_file_timebin, p, coords_list)
-            
-            period = '%ss_%ss'%(str(start), str(end))
-            print(period)
-            
-            df['Time_CT_%s'%(period)][no] = df_time_timebin[4]
-            df['Time_OA_%s'%(period)][no] = df_time_timebin[0] + df_time_timebin[1]
-            df['Time_CA_%s'%(period)][no] = df_time_timebin[2] + df_time_timebin[3]            
+        # The automatic detection only finds one maze per video
+        calibrate('EPM', calibration, anim_id, video_file, img, (width, height), click_coords, calculate_pixel, auto_calibration == 1 and len(arenas[video]) == 1)
+        save_calibration(calibration_file, calibration)
     
-            df['Dist_CT_%s'%(period)][no] = df_dist_timebin[4]
-            df['Dist_Total_%s'%(period)][no] = df_dist_timebin[5]
-            df['Dist_OA_%s'%(period)][no] = df_dist_timebin[0] + df_dist_timebin[1]
-            df['Dist_CA_%s'%(period)][no] = df_dist_timebin[2] + df_dist_timebin[3]            
-                            
-            if analysis_way == 1:    
-                df['Time_OA_left_%s'%(period)][no] = df_time_timebin[0]
-                df['Time_OA_right_%s'%(period)][no] = df_time_timebin[1]
-                df['Time_CA_up_%s'%(period)][no] = df_time_timebin[2]
-                df['Time_CA_down_%s'%(period)][no] = df_time_timebin[3]
-                
-                df['Dist_OA_left_%s'%(period)][no] = df_dist_timebin[0]
-                df['Dist_OA_right_%s'%(period)][no] = df_dist_timebin[1]
-                df['Dist_CA_up_%s'%(period)][no] = df_dist_timebin[2]
-                df['Dist_CA_down_%s'%(period)][no] = df_dist_timebin[3]
-            
-        # Draw the trajectory of each mouse for 05, 10 and 15 minutes
-        for i in range(bin_5min):
-            i = i+1
-            a = int(frame_rate*time)
-            b = int(frame_rate*(time+i*300))
-            print(i)
-            
-            bonsai_file_new = bonsai_file.iloc[a:b]
-            bonsai_file_new.columns = bonsai_file.columns
-            df_time = calculate_time(bonsai_file_new, frame_rate, coords_list)
-            df_dist = calculate_distance(bonsai_file_new, p, coords_list)
-            time_str = str('%02d'%(i*5))+'min'
-
-            df['Time_CT_%s'%(time_str)][no] = df_time[4]
-            df['Time_OA_%s'%(time_str)][no] = df_time[0] + df_time[1]
-            df['Time_CA_%s'%(time_str)][no] = df_time[2] + df_time[3]
-            
-            df['Dist_CT_%s'%(time_str)][no] = df_dist[4]
-            df['Dist_Total_%s'%(time_str)][no] = df_dist[5]
-            df['Dist_OA_%s'%(time_str)][no] = df_dist[0] + df_dist[1]
-            df['Dist_CA_%s'%(time_str)][no] = df_dist[2] + df_dist[3]
+    # Split the bonsai file of each video with several arenas into the bonsai file of each animal
+    split_videos('EPM', videos)
+    report_calibration('EPM', calibration, [sex + str(no) for no, sex in zip(animal_no, animal_sex)])
+    
+    # The results are reused from the cache if the inputs of the animal did not change
+    keys = {}
+    cached = {}
+    for no, sex, time in zip(animal_no, animal_sex, starting_time):
+        anim_id = sex + str(no)
+        keys[no] = analysis_key('EPM', '%s-EPM-bonsai.csv'%(anim_id), get_coords(calibration, anim_id), video_info[no][0], time, total_exp_time_min, timebin_in_sec, analysis_way)
+        cached[no] = cache.get(keys[no])
+    
+    # The bonsai files of the next mice are loaded while the current mouse is analyzed
+    bonsai_files = prefetch(load_bonsai, ['%s%s-EPM-bonsai.csv'%(sex, no) for no, sex in zip(animal_no, animal_sex) if cached[no] is None])
     
-            df['Speed_CT_%s'%(time_str)][no] = float(df_dist[4])/float(df_time[4])
-            df['Speed_Total_%s'%(time_str)][no] = float(df_dist[5])/(i*300)
-            df['Speed_OA_%s'%(time_str)][no] = float((df_dist[0] + df_dist[1]))/float((df_time[0] + df_time[1]))
-            df['Speed_CA_%s'%(time_str)][no] = float((df_dist[2] + df_dist[3]))/float((df_time[2] + df_time[3]))
+    # Draw the trajectories in other processes while the next animals are analyzed
+    renderer = Renderer()
+    analyzed = {}
+    # Open the bonsai file of each mouse from excel file
+    for no, sex, time in zip(animal_no, animal_sex, starting_time):
+        anim_id = sex + str(no)
+        print(anim_id)
+        frame_rate, width, height = video_info[no]
+        coords = get_coords(calibration, anim_id)
         
-            draw_trajectory(bonsai_file_new, coords_list, anim_no, sex, time_str, width, height)                   
+        # Calculate the time spent, the distance travelled and speed in each region and draw the trajectory
+        key = keys[no]
+        results = cached[no]
+        if results is None:
+            with profile_stage(profiler, 'animal', anim_id):
+                with profile_stage(profiler, 'load_csv', anim_id) as record:
+                    bonsai_file = next(bonsai_files)[1]
+                    record['frames'] = len(bonsai_file)
+                results = analyze_animal(no, sex, time, coords, frame_rate, width, height, total_exp_time_min, timebin_in_sec, analysis_way, renderer=renderer, profiler=profiler, bonsai_file=bonsai_file)
+            analyzed[anim_id] = (no, sex, time, coords, frame_rate, width, height, total_exp_time_min, timebin_in_sec, analysis_way)
+            cache.put(key, results)
+        builder.add(no, results)
         
-        df['Timebin'][no] = timebin_in_sec
-    # Save all the data in excel file back
-    df_write = pd.ExcelWriter(excel_file, engine='xlsxwriter')
-    df.to_excel(df_write, sheet_name = 'Sheet1')
-    df_write.save()
+    with profile_stage(profiler, 'render_wait'):
+        renderer.close()
+    cache.report()
+    
+    # Save all the data in excel file back at once
+    df = builder.merge(df)
+    with profile_stage(profiler, 'excel'):
+        write_excel(df, excel_file)
+    
+    # Save the profiling report and the cProfile statistics of the slowest animal analyzed again
+    if profiler is not None:
+        profiler.save(path.join(directory, 'EPM_profile.json'))
+        profiler.summary()
+        slowest = profiler.slowest_animal()
+        if slowest is not None:
+            profile_call(path.join(directory, 'EPM_slowest.prof'), analyze_animal, *analyzed[slowest], draw=False)
+            print('Profiling report saved in EPM_profile.json, cProfile statistics of %s saved in EPM_slowest.prof'%(slowest))
\ No newline at end of file
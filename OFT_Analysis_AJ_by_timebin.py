@@ -11,172 +11,291 @@ This script is
 (1) to analyze the time spent (second) and distance travelled (cm) in border and small/large center (small center: 10% of OFT area, large center: 50% of OFT area) in specific time bin you enter (second) for the experimental time
 (2) to analyze the time spent (second), distance travelled (cm) and speed (cm/s) in border and small/large center for 05, 10, 15 and 20 minutes (depending on the experimental time)
 (3) to draw the trajectory of each mouse for 05, 10, 15 and 20 minutes (depending on the experimental time)
+(4) to count the entries, latencies (second), bouts, mean bout durations (second) and transitions between border and small/large center for the same periods
 
 *******
 Important information before starting this code
 
 1. In the same working directory, you should have a video file (F835_OFT.avi) and its bonsai file (F835_OFT-bonsai.csv) of each animal and an excel file (OFT_data.xlsx : Should include information with column names; 'Animal no':int, 'Sex':str,'Starting time':int (in sec), 'Group': str) with animal no, sex and the starting time (as second) of video analysis. Please keep the file name as above.
+   If several animals are recorded in one video (e.g. Rig1_OFT.avi and Rig1-OFT-bonsai.csv with the columns mouseX_1, mouseY_1, mouseX_2, ...), add the columns 'Video' (Rig1) and 'Arena' (1, 2, ...) to the excel file and click the corners of each arena for its animal. The bonsai file is split into the bonsai file of each animal.
 
-2. In the console, there will be two questions poped up: 
+2. In the console, there will be four questions poped up: 
     
     'Please enter how long one session of the experiment takes (in minutes):' --> Please write the experimental time in minutes. Then, press enter key.
     'Please enter the time bin (in second): ' --> Please write the divisor of experimental time (in second) that you entered. Then, press enter key.
+    'Do you want to detect the corners of OFT automatically (press 1) or click them (press 2)?   ' --> Press 1 or 2. Then, press enter key.
+    'Do you want to save a profiling report of the analysis (press 1) or not (press 2)?   ' --> Press 1 or 2. Then, press enter key.
 
 3. When the first frame of video pops up, you should click 4 corners of OFT area and enter esc key to close the video.
+   The clicked coordinates are saved in OFT_calibration.json and reused when the same video is analyzed again, so the first frame only pops up for new videos. 
+   If the number of clicks is not 4, the first frame pops up again.
+   If you choose to detect the corners automatically, the first frame only pops up when the OFT is not detected reliably.
 
 4. It is important to click the exact coordinates of OFT corners, since the pixel size and the coordinates of small/large center are calculated based on those coordinates.
 
 5. At the end, you will have an excel file with all the data analyzed and the trajectory of each mouse for 05, 10, 15 and 20 minutes (depending on the experimental time).
 
-6. If you want to reanalyze, please check whether you have proper column names and remove previous data in excel file.
+6. If you reanalyze, the previous results in the columns of this analysis are replaced. Other columns of the excel file are kept.
+   The results of each animal are cached in the directory result_cache. Only the animals whose bonsai file, coordinates, frame rate, starting time or the questions above changed are analyzed again (and their trajectories drawn).
+
+7. With the profiling report, the wall time, CPU time, peak memory and frames/s of each stage (video, load_csv, rasterize, classify, aggregate, bins, plot, excel) of each animal are saved in OFT_profile.json and summarized in the console.
+   The slowest animal is analyzed once more under cProfile (without drawing its trajectory again) and its statistics are saved in OFT_slowest.prof (python -m pstats OFT_slowest.prof).
+
+8. The first frames of the next videos and the bonsai files of the next mice are loaded in the background while the current mouse is analyzed (useful for cohorts on a network share).
+   How many files are loaded ahead and how much memory they may take are set by PREFETCH_DEPTH and PREFETCH_MEMORY_MB in maze_analysis/prefetch.py.
 *******
 Enjoy the analysis!
 """
 
 # Import packages
 import pandas as pd
-import matplotlib.pyplot as plt
-import cv2 as cv
-from matplotlib.path import Path
-import matplotlib.patches as patches
-from matplotlib import rc
 from os import path
 import numpy as np
+from maze_analysis import OUTSIDE, rasterize_ROI, classify_frames, step_distance, ZoneCumsum, calculate_speed, load_bonsai, ResultBuilder, write_excel, analysis_windows, frame_index, stream_zone_sums
+from maze_analysis.cohort import cohort_sums
+from maze_analysis.events import zone_events, event_columns, add_events
+from maze_analysis.timestamps import frame_durations
+from maze_analysis.rendering import Renderer, render_windows
+from maze_analysis.mazes import OFT_MAZE, draw_trajectory as draw_maze_trajectory
+from maze_analysis.video import read_video, click_coords
+from maze_analysis.calibration import calibration_path, load_calibration, save_calibration, get_coords, calibrate, report_calibration, check_clicks, video_fingerprint
+from maze_analysis.arenas import animal_videos, video_arenas, split_videos
+from maze_analysis.result_cache import ResultCache, CACHE_DIRECTORY, analysis_key
+from maze_analysis.profiling import Profiler, profile_stage, profile_call
+from maze_analysis.prefetch import prefetch
 
-def getFirstFrame(vid_cap):
+# Regions of the entries, latencies and bouts (zone labels: 0 small center, 1 large center without small center, OUTSIDE border)
+# and states of the transitions (largeCT: large center without small center)
+EVENT_REGIONS = [('smallCT', [0]), ('largeCT', [0, 1]), ('border', [OUTSIDE])]
+EVENT_STATES = [('smallCT', [0]), ('largeCT', [1]), ('border', [OUTSIDE])]
+
+def calculate_pixel(coords_list):
     """
-    Read the video file and return the first frame as an image file
+    Based on the coordinates of OFT (60cmx60cm), calculate and return the size of pixel
     """
-    success, image = vid_cap.read()
-    if success == 1:
-        first_image = image
-    return first_image
+    return OFT_MAZE.pixel_size(coords_list)
+   
+# Define a function to draw/save a graph
+def draw_trajectory(bonsai_file, coords_list, animal_no, animal_sex, time, width, height, renderer=None):
+    """
+    Draw the trajectory of mouse location depending on experimental time and save this graph.
+    With renderer (see maze_analysis/rendering.py), the graph is drawn in the background while the analysis goes on.
+    """    
+    draw_maze_trajectory(OFT_MAZE, bonsai_file, coords_list, "%s%s_OFT_%s"%(animal_sex, animal_no, time), width, height, "%s%s_OFT_%s.jpg"%(animal_sex, animal_no, time), renderer)
 
-def onclick(event,x,y,flag,image):
+def calculate_time(zone_cumsum, a, b, frame_rate):    
     """
-    Get the pixel coordinate of mouse click
+    Calculate time spent in ROI between frame a and b from the cumulative frame counts (or frame durations, see maze_analysis/timestamps.py) and return a list of [time spent in small ct, time spent in large ct, time spent out of large ct, total time]. Please take the order of elements into account when you add these values in the data set!!
+    zone_cumsum is built from the label raster of [small ct, large ct] (0: small ct, 1: large ct only, OUTSIDE: border).
     """
-    global coords
-    if event == cv.EVENT_LBUTTONUP:
-        coords.append((x,y))
-        # wait for Esc or q key and then exit
-        return
+    return OFT_MAZE.time_spent(zone_cumsum, a, b, frame_rate)
 
-def det(a, b):
-        return a[0] * b[1] - a[1] * b[0]
+def calculate_distance(zone_cumsum, a, b):
+    """
+    Calculate distance travelled in ROI between frame a and b from the cumulative distances and return a list of [dist in small ct, dist in large ct, dist out of large ct, total dist]. Please take the order of elements into account when you add these values in the data set!!
+    Each step is assigned to the ROI of the frame where the step starts (see calculate_time).
+    """
+    return OFT_MAZE.distance(zone_cumsum, a, b)
 
-def line_intersection(coords):    
+def create_columns(total_exp_time_min, timebin_in_sec):
     """
-    Get the 4 coordinates of OFT corners and return the coordinate of OFT center point
-    """    
-    xdiff = (coords[0][0] - coords[2][0], coords[1][0] - coords[3][0])
-    ydiff = (coords[0][1] - coords[2][1], coords[1][1] - coords[3][1])
-    div = det(xdiff, ydiff)
-    if div == 0:
-       raise Exception('lines do not intersect')
-    d = (det(coords[0], coords[2]), det(coords[1], coords[3]))
-    x = det(d, xdiff) / div
-    y = det(d, ydiff) / div
-    return [x, y]
-
-def resize_center(coords, factor):
+    Create the column names depending on the time bin
     """
-    coords must be clockwise
-    how much the coordinates are moved as an absolute value
-    """    
-    new_coords = []
-    intersection = tuple(line_intersection (coords))
-    for i in range(len(coords)):        
-        new_coords.append(((coords[i][0]-intersection[0])*factor+intersection[0],(coords[i][1]-intersection[1])*factor+intersection[1]))
-    return new_coords
+    total_exp_time_sec = total_exp_time_min*60
+    df_columns = ['Timebin']
+    for i in range(int(total_exp_time_sec/timebin_in_sec)):
+        start = timebin_in_sec * i
+        end = timebin_in_sec * (i+1)
+        period = '%ss_%ss'%(str(start), str(end))        
+        df_columns = df_columns + ['Time_smallCT_%s'%(period), 'Time_largeCT_%s'%(period), 'Time_border_%s'%(period)] + event_columns(period, EVENT_REGIONS, EVENT_STATES)
+        df_columns = df_columns + ['Dist_smallCT_%s'%(period), 'Dist_largeCT_%s'%(period), 'Dist_border_%s'%(period), 'Dist_Total_%s'%(period)]
+    
+    bin_5min = int(total_exp_time_min/5)
+    for i in range(bin_5min):
+    
+        period = str('%02d'%((i+1)*5))+'min'
+        df_columns = df_columns + ['Time_smallCT_%s'%(period), 'Time_largeCT_%s'%(period), 'Time_border_%s'%(period)] + event_columns(period, EVENT_REGIONS, EVENT_STATES)
+        df_columns = df_columns + ['Dist_smallCT_%s'%(period), 'Dist_largeCT_%s'%(period), 'Dist_border_%s'%(period), 'Dist_Total_%s'%(period), 'Speed_smallCT_%s'%(period), 'Speed_largeCT_%s'%(period), 'Speed_border_%s'%(period), 'Speed_Total_%s'%(period)]       
+    return df_columns
 
-def calculate_pixel(coords_list):
+def define_ROI(coords):
     """
-    Based on the coordinates of OFT (60cmx60cm), calculate and return the size of pixel
+    Define the regions of interest (OFT area, Small center (10%) and Large center (50%)) from the 4 corners of OFT (see OFT_MAZE in maze_analysis/mazes.py)
     """
-    x_1 = coords_list[0][0]
-    y_1 = coords_list[0][1]    
-    x_2 = coords_list[1][0]
-    y_2 = coords_list[1][1]    
-    p = (3600/((x_1-x_2)**2 + (y_1-y_2)**2))**0.5 # size of pixel in centimeter. 3600 means 60x60. Change 3600 depending on the size of OFT
-    return p
-   
-# Define a function to draw/save a graph
-def draw_trajectory(bonsai_file, coords_list, animal_no, animal_sex, time, width, height):
+    return OFT_MAZE.rois(coords)
+
+def add_results(results, zone_cumsum, frame_rate, time, total_exp_time_min, timebin_in_sec, zone_events=None, timestamps=None):
     """
-    Draw the trajectory of mouse location depending on experimental time and save this graph.
-    """    
-    # Plot each point
-    plt.scatter(bonsai_file['mouseX'], bonsai_file['mouseY'], s=1)       
-    # Draw each ROIs
-    oft_patch = patches.PathPatch(coords_list[0],edgecolor='yellow',fill=0, lw=2)
-    small_ct_patch = patches.PathPatch(coords_list[1],edgecolor='orange',fill=0, lw=2)
-    large_ct_patch = patches.PathPatch(coords_list[2],edgecolor='green',fill=0, lw=2)
-    
-    plt.gca().add_patch(oft_patch)
-    plt.gca().add_patch(small_ct_patch)
-    plt.gca().add_patch(large_ct_patch)
+    Calculate the time spent, the distance travelled and speed in each region by time bin and for 05, 10, 15 and 20 minutes and add them to results as {column name: value}.
+    With zone_events (see maze_analysis/events.py), the entries, latencies, bouts and transitions of the same windows are added too.
+    frame_rate and time can also be arrays with one value per animal (see analyze_cohort), then each value is an array.
+    With timestamps (see maze_analysis/timestamps.py), the frames of the time bins are found in the timestamps of the frames instead of the frame rate.
+    """
+    total_exp_time_sec = total_exp_time_min*60
+    bin_5min = int(total_exp_time_min/5)
     
-    # Assign the characteristics of the plot
-    plt. rcParams["figure.figsize"] = (8,6)
-    plt.title("%s%s_OFT_%s"%(animal_sex, animal_no, time))  
-    rc('font', **{'family':'Arial'})
-    plt.xlim(0, width)
-    plt.ylim(0, height)        
-    plt.axis('off')
-    plt.savefig("%s%s_OFT_%s.jpg"%(animal_sex, animal_no, time), format = 'jpg')
-    plt.show()
-    return
-
-def calculate_time(bonsai_file, frame_rate, coords_list):    
+    # Calculate the time spent and the distance travelled in each region by specific time bin
+    for i in range(int(total_exp_time_sec/(timebin_in_sec))):
+        start = timebin_in_sec * i
+        end = timebin_in_sec * (i+1)
+        period = '%ss_%ss'%(str(start), str(end))
+        
+        a = frame_index(frame_rate, time + start, timestamps)
+        b = frame_index(frame_rate, time + end, timestamps)
+        df_time_timebin = calculate_time(zone_cumsum, a, b, frame_rate)
+        df_dist_timebin = calculate_distance(zone_cumsum, a, b)
+
+        results['Time_smallCT_%s'%(period)] = df_time_timebin[0]
+        results['Time_largeCT_%s'%(period)] = df_time_timebin[1]
+        results['Time_border_%s'%(period)] = df_time_timebin[2]
+        if zone_events is not None:
+            add_events(results, zone_events, a, b, frame_rate, period, EVENT_REGIONS, EVENT_STATES)
+
+        results['Dist_smallCT_%s'%(period)] = df_dist_timebin[0]
+        results['Dist_largeCT_%s'%(period)] = df_dist_timebin[1]
+        results['Dist_border_%s'%(period)] = df_dist_timebin[2]
+        results['Dist_Total_%s'%(period)] = df_dist_timebin[3]
+        
+    # Calculate the time spent (second), the distance (cm) travelled and speed (cm/s) in each region/entire region for 05, 10, 15 and 20 minutes
+    for i in range(bin_5min):
+        i = i+1
+        a = frame_index(frame_rate, time, timestamps)
+        b = frame_index(frame_rate, time+i*300, timestamps)
+        
+        df_time = calculate_time(zone_cumsum, a, b, frame_rate)
+        df_dist = calculate_distance(zone_cumsum, a, b)
+        time_str = str('%02d'%(i*5))+'min'
+
+        results['Time_smallCT_%s'%(time_str)] = df_time[0]
+        results['Time_largeCT_%s'%(time_str)] = df_time[1]
+        results['Time_border_%s'%(time_str)] = df_time[2]
+        if zone_events is not None:
+            add_events(results, zone_events, a, b, frame_rate, time_str, EVENT_REGIONS, EVENT_STATES)
+
+        results['Dist_smallCT_%s'%(time_str)] = df_dist[0]
+        results['Dist_largeCT_%s'%(time_str)] = df_dist[1]
+        results['Dist_border_%s'%(time_str)] = df_dist[2]
+        results['Dist_Total_%s'%(time_str)] = df_dist[3]
+        
+        results['Speed_smallCT_%s'%(time_str)] = calculate_speed(df_dist[0], df_time[0])
+        results['Speed_largeCT_%s'%(time_str)] = calculate_speed(df_dist[1], df_time[1])
+        results['Speed_border_%s'%(time_str)] = calculate_speed(df_dist[2], df_time[2])
+        results['Speed_Total_%s'%(time_str)] = calculate_speed(df_dist[3], i*300)
+
+def analyze_animal(anim_no, sex, time, coords, frame_rate, width, height, total_exp_time_min, timebin_in_sec, draw=True, chunk_size=None, timestamps=None, renderer=None, profiler=None, bonsai_file=None):
     """
-    Calculate time spent in ROI and return a list of [total time, time spent in small ct, time spent in large ct, time spent out of large ct]. Please take the order of elements into account when you add these values in the data set!!
+    Analyze the bonsai file of one mouse with the 4 clicked corners of OFT and return the results as {column name: value}.
+    With draw=True (or 'all'), the trajectory of the mouse is drawn for 05, 10, 15 and 20 minutes, with draw='final' only for the whole session and with draw=False (or 'none') not at all.
+    With renderer (see maze_analysis/rendering.py), the trajectories are drawn by other processes while the analysis goes on.
+    With chunk_size, the bonsai file is streamed in chunks of chunk_size frames with constant memory (for long recordings), a trajectory is drawn from at most TRAJECTORY_POINTS positions (see maze_analysis/streaming.py).
+    With timestamps (TimestampIndex of the bonsai file, see maze_analysis/timestamps.py), the time bins and the time spent follow the real times of the frames (not with chunk_size).
+    With profiler (see maze_analysis/profiling.py), the wall time, CPU time, peak memory and frames of each stage are recorded.
+    With bonsai_file (DataFrame of the bonsai file loaded ahead, see maze_analysis/prefetch.py), the bonsai file is not read again (not with chunk_size).
     """
-    x = bonsai_file['mouseX']
-    y = bonsai_file['mouseY']
-    total_time = 0
-    small_ct_time = 0
-    large_ct_time = 0
-    border_time = 0
+    anim_id = sex + str(anim_no)
+    bin_5min = int(total_exp_time_min/5)
+    results = {}
+    
+    # Set the region of interest (OFT area, Small center (10%) and Large center (50%))
+    coords_list = define_ROI(coords)
+    p = calculate_pixel(coords)
+    
+    # Label raster of small and large center to classify the frames (border: OUTSIDE)
+    bonsai_csv = '%s-OFT-bonsai.csv'%(anim_id)
+    with profile_stage(profiler, 'rasterize', anim_id):
+        label_raster = rasterize_ROI(coords_list[1:], width, height)
+    
+    # Windows (first frame, last frame, name) of the trajectories of the mouse, the positions are kept while streaming
+    draw_windows = [(frame_index(frame_rate, time, timestamps), frame_index(frame_rate, time+(i+1)*300, timestamps), '%02dmin'%((i+1)*5)) for i in render_windows(draw, bin_5min)]
+    
+    if chunk_size is not None and timestamps is not None:
+        raise ValueError('The timestamp index cannot be used when the bonsai file is streamed in chunks')
+    if chunk_size is None:
+        # Read bonsai file and classify all frames once
+        if bonsai_file is None:
+            with profile_stage(profiler, 'load_csv', anim_id) as record:
+                bonsai_file = load_bonsai(bonsai_csv)
+                record['frames'] = len(bonsai_file)
+        with profile_stage(profiler, 'classify', anim_id, len(bonsai_file)):
+            zone_labels = classify_frames(label_raster, coords_list[1:], bonsai_file['mouseX'], bonsai_file['mouseY'])
         
-    for i in bonsai_file.index.values.tolist():
-        a = i    
-        total_time = total_time+1
-        if coords_list[1].contains_point((x[a], y[a])):
-            small_ct_time = small_ct_time+1            
-        if coords_list[2].contains_point((x[a], y[a])):
-            large_ct_time = large_ct_time+1
-        else:
-            border_time = border_time+1   
-    time_small_ct = small_ct_time / frame_rate
-    time_large_ct = large_ct_time / frame_rate
-    time_border = border_time / frame_rate
-    time_total = total_time / frame_rate
-    return [time_small_ct, time_large_ct, time_border, time_total]
-
-def calculate_distance(bonsai_file, p, coords_list):
+        # Cumulative sums of frames and distances per ROI, so that every time bin costs one difference
+        with profile_stage(profiler, 'aggregate', anim_id, len(bonsai_file)):
+            dist = step_distance(bonsai_file['mouseX'], bonsai_file['mouseY'], p)
+            durations = None if timestamps is None else frame_durations(timestamps, len(bonsai_file), bonsai_csv)
+            zone_cumsum = ZoneCumsum(zone_labels, dist, 2, durations)
+            
+            # Runs of the zone labels for the entries, latencies, bouts and transitions
+            events = zone_events(zone_labels, bonsai_file['mouseX'], bonsai_file['mouseY'], durations=durations)
+    else:
+        # Stream the bonsai file in chunks, only the cumulative sums at the edges of the time bins are kept
+        with profile_stage(profiler, 'stream', anim_id) as record:
+            windows = analysis_windows(frame_rate, time, total_exp_time_min, timebin_in_sec)
+            zone_cumsum = stream_zone_sums(bonsai_csv, windows, lambda x, y: classify_frames(label_raster, coords_list[1:], x, y), p, 2, chunk_size, draw_windows=[(a, b) for a, b, time_str in draw_windows])
+            events = zone_cumsum.zone_events()
+            record['frames'] = zone_cumsum.n_frame
+    
+    # Calculate the time spent, the distance travelled, speed and the zone events in each region
+    with profile_stage(profiler, 'bins', anim_id):
+        add_results(results, zone_cumsum, frame_rate, time, total_exp_time_min, timebin_in_sec, events, timestamps)
+    
+    # Draw the trajectory of each mouse for 05, 10, 15 and 20 minutes
+    with profile_stage(profiler, 'plot', anim_id):
+        for k, (a, b, time_str) in enumerate(draw_windows):
+            bonsai_file_new = bonsai_file.iloc[a:b] if chunk_size is None else zone_cumsum.trajectory(k)
+            draw_trajectory(bonsai_file_new, coords_list, anim_id, sex, time_str, width, height, renderer)
+    
+    results['Timebin'] = timebin_in_sec
+    return results
+
+def analyze_cohort(animals, total_exp_time_min, timebin_in_sec, timestamps=None, cohort=None):
     """
-    Calculate time spent in ROI and return a list of [total time, time spent in small ct, time spent in large ct, time spent out of large ct]. Please take the order of elements into account when you add these values in the data set!!
+    Analyze the bonsai files of all mice at once (see maze_analysis/cohort.py) and return the results of each mouse as {column name: value}, like analyze_animal without trajectory.
+    With timestamps (TimestampIndex of each animal), the time bins follow the real times of the frames.
+    With cohort (CohortTracks of the animals, see maze_analysis/store.py), the positions are not read from the bonsai files.
+    animals: list of (animal no, sex, starting time, 4 clicked corners of OFT, frame rate)
     """
-    x = bonsai_file['mouseX']
-    y = bonsai_file['mouseY']
-    total_dist = []
-    small_ct_dist = []
-    large_ct_dist = []
-    border_dist = []
+    coords_lists = [define_ROI(coords) for no, sex, time, coords, frame_rate in animals]
+    frame_rates = np.array([frame_rate for no, sex, time, coords, frame_rate in animals], dtype=np.float64)
+    times = np.array([time for no, sex, time, coords, frame_rate in animals], dtype=np.int64)
+    
+    # Frames and distances in the label raster of small and large center (border: OUTSIDE) of all mice and all windows
+    zone_sums, events = cohort_sums(['%s%s-OFT-bonsai.csv'%(sex, no) for no, sex, time, coords, frame_rate in animals],
+                                    [coords_list[1:] for coords_list in coords_lists],
+                                    [calculate_pixel(coords) for no, sex, time, coords, frame_rate in animals], 2,
+                                    analysis_windows(frame_rates, times, total_exp_time_min, timebin_in_sec, timestamps), timestamps=timestamps, cohort=cohort)
     
-    for i in bonsai_file.index.values.tolist()[:-2]:
-        a = i
-        b = a+1
-        dist = (((x[a] - x[b])*p)**2+((y[a] - y[b])*p)**2)**0.5
-        total_dist.append(dist)
-        if coords_list[1].contains_point((x[a], y[a])):
-            small_ct_dist.append(dist)            
-        if coords_list[2].contains_point((x[a], y[a])):
-            large_ct_dist.append(dist)
-        else:
-            border_dist.append(dist)            
-    return [np.nansum(small_ct_dist), np.nansum(large_ct_dist), np.nansum(border_dist), np.nansum(total_dist)]
+    cohort_results = {}
+    add_results(cohort_results, zone_sums, frame_rates, times, total_exp_time_min, timebin_in_sec, events, timestamps)
+    results = []
+    for k in range(len(animals)):
+        animal_results = {column: float(values[k]) for column, values in cohort_results.items()}
+        animal_results['Timebin'] = timebin_in_sec
+        results.append(animal_results)
+    return results
+
+def live_results(zone_sums, a, b, frame_rate, duration):
+    """
+    Calculate the time spent (second), the distance travelled (cm) and speed (cm/s) in border and small/large center between frame a and b for the live analysis and return them as {column name without period: value}
+    """
+    df_time = calculate_time(zone_sums, a, b, frame_rate)
+    df_dist = calculate_distance(zone_sums, a, b)
+    
+    results = {}
+    results['Time_smallCT'] = df_time[0]
+    results['Time_largeCT'] = df_time[1]
+    results['Time_border'] = df_time[2]
+    
+    results['Dist_smallCT'] = df_dist[0]
+    results['Dist_largeCT'] = df_dist[1]
+    results['Dist_border'] = df_dist[2]
+    results['Dist_Total'] = df_dist[3]
+    
+    results['Speed_smallCT'] = calculate_speed(df_dist[0], df_time[0])
+    results['Speed_largeCT'] = calculate_speed(df_dist[1], df_time[1])
+    results['Speed_border'] = calculate_speed(df_dist[2], df_time[2])
+    results['Speed_Total'] = calculate_speed(df_dist[3], duration)
+    return results
 
 
 if __name__ == '__main__':
@@ -195,124 +314,102 @@ if __name__ == '__main__':
     
     # Ask the time bin in sec and get the value in integer format
     total_exp_time_min = int(input('Please enter how long one session of the experiment takes (in minutes):  '))
-    total_exp_time_sec = total_exp_time_min*60
     timebin_in_sec = int(input('Please enter the time bin (in seconds):   '))    
         
-    # Create the column names depending on the time bin    
-    df_columns = ['Timebin']
-    for i in range(int(total_exp_time_sec/timebin_in_sec)):
-        start = timebin_in_sec * i
-        end = timebin_in_sec * (i+1)
-        period = '%ss_%ss'%(str(start), str(end))        
-        df_columns = df_columns + ['Time_smallCT_%s'%(period), 'Time_largeCT_%s'%(period), 'Time_border_%s'%(period), 'Dist_smallCT_%s'%(period), 'Dist_largeCT_%s'%(period), 'Dist_border_%s'%(period), 'Dist_Total_%s'%(period)]
+    # Cache of the results of each animal (see maze_analysis/result_cache.py)
+    cache = ResultCache(path.join(directory, CACHE_DIRECTORY))
     
-    bin_5min = int(total_exp_time_min/5)
-    for i in range(bin_5min):
+    # Collect the results of all animals in the columns depending on the time bin
+    builder = ResultBuilder(create_columns(total_exp_time_min, timebin_in_sec))
     
-        period = str('%02d'%((i+1)*5))+'min'
-        df_columns = df_columns + ['Time_smallCT_%s'%(period), 'Time_largeCT_%s'%(period), 'Time_border_%s'%(period), 'Dist_smallCT_%s'%(period), 'Dist_largeCT_%s'%(period), 'Dist_border_%s'%(period), 'Dist_Total_%s'%(period), 'Speed_smallCT_%s'%(period), 'Speed_largeCT_%s'%(period), 'Speed_border_%s'%(period), 'Speed_Total_%s'%(period)]       
-
-    # Create the new columns with new column names in the dataframe
-    df_add = pd.DataFrame(index = animal_no, columns = df_columns)
-    df_add = df_add.fillna(0)
-    df = pd.concat([df, df_add], axis=1)
+    # Ask whether the corners of new videos are detected automatically
+    auto_calibration = int(input('Do you want to detect the corners of OFT automatically (press 1) or click them (press 2)?   '))
     
-    # Open each video file and its bonsai file
-    for no, sex, time in zip(animal_no, animal_sex, starting_time):
-        anim_no=str(no)
+    # Ask whether the time and memory of each stage are recorded (see maze_analysis/profiling.py)
+    profiler = Profiler() if int(input('Do you want to save a profiling report of the analysis (press 1) or not (press 2)?   ')) == 1 else None
+    
+    # Load the calibration of the cohort (coordinates clicked in previous analyses)
+    calibration_file = calibration_path('OFT', directory)
+    calibration = load_calibration(calibration_file)
+    
+    # Click 4 corners of OFT on the first image of each new video, the saved coordinates are reused for the others
+    # Several animals can be recorded in one video (columns 'Video' and 'Arena', see maze_analysis/arenas.py), their arenas are clicked on the same frame
+    videos = animal_videos(df)
+    arenas = video_arenas(videos)
+    
+    # The first frames of the next videos are read while the corners of the current one are clicked (see maze_analysis/prefetch.py)
+    video_frames = prefetch(read_video, ["%s_OFT.avi"%(video) for video in dict.fromkeys(videos[sex + str(no)][0] for no, sex in zip(animal_no, animal_sex))])
+    frames = {}
+    video_info = {}
+    for no, sex in zip(animal_no, animal_sex):
         anim_id = sex + str(no)
-        video_file="%s_OFT.avi"%(anim_id)
-        vid_cap=cv.VideoCapture(video_file)
-        
-        # Get the frame rate, height and width of a video file
-        frame_rate = vid_cap.get(cv.CAP_PROP_FPS)        
-        height = vid_cap.get(cv.CAP_PROP_FRAME_HEIGHT)
-        width = vid_cap.get(cv.CAP_PROP_FRAME_WIDTH)
-        
-        success, image = vid_cap.read()
-        if success == 1:
-            img = image
-        
-        coords = []   
-        cv.namedWindow('Image_%s'%(anim_no), cv.WINDOW_NORMAL)
-        cv.imshow('Image_%s'%(anim_id), img)
-        # Save coordinates of 12 mouse clicks in coods
-        cv.setMouseCallback('Image_%s'%(anim_id), onclick, img)        
+        video = videos[anim_id][0]
+        video_file = "%s_OFT.avi"%(video)
+        if video not in frames:
+            with profile_stage(profiler, 'video', anim_id):
+                frames[video] = next(video_frames)[1]
+        img, frame_rate, width, height = frames[video]
+        video_info[no] = (frame_rate, width, height)
         
-        # wait for Esc or q key and then exit
-        while True:
-            key = cv.waitKey(1) & 0xFF
-            if key == 27 or key == ord("q"):
-                # print('Image cropped at coordinates: {}'.format(coords))
-                cv.destroyAllWindows()
-                break             
+        # An unreadable video can only be used with the saved coordinates of the animal
+        if img is None and (not path.exists(video_file) or not check_clicks('OFT', get_coords(calibration, anim_id, video_fingerprint(video_file)))):
+            raise SystemExit('The first frame of %s cannot be read, so the corners of %s cannot be detected or clicked. Please check the video file.'%(video_file, anim_id))
         
-        # Set the region of interest (OFT area, Small center (10%) and Large center (50%))
-        coords.append(coords[0])
-        OFT_area = Path([coords[0],coords[1],coords[2],coords[3],coords[0]], closed = True)
-        p = calculate_pixel(coords)
-        
-        # Save ROI in this list
-        coords_list=[]
-        coords_list.append(OFT_area)
-        coords_list.append(Path(resize_center(coords, 0.1), closed = True))
-        coords_list.append(Path(resize_center(coords, 0.5), closed = True))
-        
-        # Read bonsai file and assign according to duration
-        bonsai_file = pd.read_csv(r'%s-OFT-bonsai.csv'%(anim_id),sep='\s+', engine='python', encoding = "cp949", converters={'mouseX': float,'mouseY': float,'mouseAngle': float,'mouseMajorAxisLength': float, 'mouseMinorAxisLength': float,'mouseArea': float})
-        
-        # Calculate the time spent and the distance travelled in each region by specific time bin
-        for i in range(int(total_exp_time_sec/(timebin_in_sec))):
-            start = timebin_in_sec * i
-            end = timebin_in_sec * (i+1)
-            period = '%ss_%ss'%(str(start), str(end))
-            
-            a = int(frame_rate * (time + start))
-            b = int(frame_rate * (time + end))
-            bonsai_file_timebin = bonsai_file.iloc[a:b]
-            bonsai_file_timebin.columns = bonsai_file.columns
-            df_time_timebin = calculate_time(bonsai_file_timebin, frame_rate, coords_list)
-            df_dist_timebin = calculate_distance(bonsai_file_timebin, p, coords_list)
-
-            df['Time_smallCT_%s'%(period)][no] = df_time_timebin[0]
-            df['Time_largeCT_%s'%(period)][no] = df_time_timebin[1]
-            df['Time_border_%s'%(period)][no] = df_time_timebin[2]
-
-            df['Dist_smallCT_%s'%(period)][no] = df_dist_timebin[0]
-            df['Dist_largeCT_%s'%(period)][no] = df_dist_timebin[1]
-            df['Dist_border_%s'%(period)][no] = df_dist_timebin[2]
-            df['Dist_Total_%s'%(period)][no] = df_dist_timebin[3]
-            
-        # Calculate the time spent (second), the distance (cm) travelled and speed (cm/s) in each region/entire region and draw the trajectory of each mouse for 05, 10, 15 and 20 minutes
-        for i in range(bin_5min):
-            i = i+1
-            a = int(frame_rate*time)
-            b = int(frame_rate*(time+i*300))
-            
-            bonsai_file_new = bonsai_file.iloc[a:b]
-            bonsai_file_new.columns = bonsai_file.columns
-            df_time = calculate_time(bonsai_file_new, frame_rate, coords_list)
-            df_dist = calculate_distance(bonsai_file_new, p, coords_list)
-            time_str = str('%02d'%(i*5))+'min'
-
-            df['Time_smallCT_%s'%(time_str)][no] = df_time[0]
-            df['Time_largeCT_%s'%(time_str)][no] = df_time[1]
-            df['Time_border_%s'%(time_str)][no] = df_time[2]
-
-            df['Dist_smallCT_%s'%(time_str)][no] = df_dist[0]
-            df['Dist_largeCT_%s'%(time_str)][no] = df_dist[1]
-            df['Dist_border_%s'%(time_str)][no] = df_dist[2]
-            df['Dist_Total_%s'%(time_str)][no] = df_dist[3]
-            
-            df['Speed_smallCT_%s'%(time_str)][no] = float(df_dist[0])/float(df_time[0])
-            df['Speed_largeCT_%s'%(time_str)][no] = float(df_dist[1])/float(df_time[1])
-            df['Speed_border_%s'%(time_str)][no] = float(df_dist[2])/float(df_time[2])
-            df['Speed_Total_%s'%(time_str)][no] = float(df_dist[3])/(i*300)
-        
-            draw_trajectory(bonsai_file_new, coords_list, anim_id, sex, time_str, width, height)     
+        # The automatic detection only finds one maze per video
+        calibrate('OFT', calibration, anim_id, video_file, img, (width, height), click_coords, calculate_pixel, auto_calibration == 1 and len(arenas[video]) == 1)
+        save_calibration(calibration_file, calibration)
+    
+    # Split the bonsai file of each video with several arenas into the bonsai file of each animal
+    split_videos('OFT', videos)
+    report_calibration('OFT', calibration, [sex + str(no) for no, sex in zip(animal_no, animal_sex)])
+    
+    # The results are reused from the cache if the inputs of the animal did not change
+    keys = {}
+    cached = {}
+    for no, sex, time in zip(animal_no, animal_sex, starting_time):
+        anim_id = sex + str(no)
+        keys[no] = analysis_key('OFT', '%s-OFT-bonsai.csv'%(anim_id), get_coords(calibration, anim_id), video_info[no][0], time, total_exp_time_min, timebin_in_sec)
+        cached[no] = cache.get(keys[no])
+    
+    # The bonsai files of the next mice are loaded while the current mouse is analyzed
+    bonsai_files = prefetch(load_bonsai, ['%s%s-OFT-bonsai.csv'%(sex, no) for no, sex in zip(animal_no, animal_sex) if cached[no] is None])
+    
+    # Draw the trajectories in other processes while the next animals are analyzed
+    renderer = Renderer()
+    analyzed = {}
+    # Open the bonsai file of each mouse
+    for no, sex, time in zip(animal_no, animal_sex, starting_time):
+        anim_id = sex + str(no)
+        frame_rate, width, height = video_info[no]
+        coords = get_coords(calibration, anim_id)
         
-        df['Timebin'][no] = timebin_in_sec
+        # Calculate the time spent, the distance travelled and speed in each region and draw the trajectory
+        key = keys[no]
+        results = cached[no]
+        if results is None:
+            with profile_stage(profiler, 'animal', anim_id):
+                with profile_stage(profiler, 'load_csv', anim_id) as record:
+                    bonsai_file = next(bonsai_files)[1]
+                    record['frames'] = len(bonsai_file)
+                results = analyze_animal(no, sex, time, coords, frame_rate, width, height, total_exp_time_min, timebin_in_sec, renderer=renderer, profiler=profiler, bonsai_file=bonsai_file)
+            analyzed[anim_id] = (no, sex, time, coords, frame_rate, width, height, total_exp_time_min, timebin_in_sec)
+            cache.put(key, results)
+        builder.add(no, results)
 
-        df_write = pd.ExcelWriter(excel_file, engine='xlsxwriter')
-        df.to_excel(df_write, sheet_name = 'Sheet1')
-        df_write.save()
+    with profile_stage(profiler, 'render_wait'):
+        renderer.close()
+    cache.report()
+    
+    # Save all the data in excel file back at once
+    df = builder.merge(df)
+    with profile_stage(profiler, 'excel'):
+        write_excel(df, excel_file)
+    
+    # Save the profiling report and the cProfile statistics of the slowest animal analyzed again
+    if profiler is not None:
+        profiler.save(path.join(directory, 'OFT_profile.json'))
+        profiler.summary()
+        slowest = profiler.slowest_animal()
+        if slowest is not None:
+            profile_call(path.join(directory, 'OFT_slowest.prof'), analyze_animal, *analyzed[slowest], draw=False)
+            print('Profiling report saved in OFT_profile.json, cProfile statistics of %s saved in OFT_slowest.prof'%(slowest))
\ No newline at end of file
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch analysis of Elevated Plus Maze (EPM) and Open Field Test (OFT) by Bonsai & Python
+
+This script analyzes all the animals listed in EPM_data.xlsx or OFT_data.xlsx like EPM_Analysis_AJ_by_timebin.py
+and OFT_Analysis_AJ_by_timebin.py, but without any question in the console and without opening the videos.
+The animals are analyzed in parallel by a pool of processes.
+
+*******
+Important information before starting this code
+
+1. The coordinates of each animal are read from the calibration file (EPM_calibration.json or OFT_calibration.json)
+   in the same directory as the excel file. This file is saved by EPM_Analysis_AJ_by_timebin.py and
+   OFT_Analysis_AJ_by_timebin.py when you click the corners of the maze. The analysis stops if an animal is not
+   calibrated or its video was changed since it was clicked, and pixel sizes far from the cohort median are reported.
+   With --auto-calibrate, the corners of these animals are detected on the first frame of their video instead.
+
+   With --track, the mouse is tracked in the videos of the animals without bonsai file (F835-OFT-bonsai.csv), so the
+   videos can be analyzed without Bonsai. The tracking is saved in the same format as the bonsai file.
+
+   Several animals can be recorded in one video with the columns 'Video' and 'Arena' in the excel file
+   (see maze_analysis/arenas.py). All arenas of a video are tracked in one pass over the video.
+
+2. The session length, time bin and the regions of EPM are given as arguments, e.g.
+
+    python batch_analysis.py EPM --session 15 --timebin 60 --regions 1 --workers 8 --directory D:/EPM_cohort
+    python batch_analysis.py OFT --session 20 --timebin 60
+
+3. At the end, the results are saved in the excel file in the order of the animals of the excel file.
+   With --parquet results.parquet, they are also saved as long/tidy table (Animal no, Metric, Region, Period, Value).
+
+4. With --cohort, the bonsai files of all animals are concatenated and analyzed at once by vectorized sums over the
+   whole cohort (see maze_analysis/cohort.py) instead of one process per animal. The trajectories are not drawn.
+
+5. With --timestamps, the time bins are found in the timestamps of the frames (column Timestamp of the bonsai file,
+   or the timestamps of the video frames) instead of the frame rate, so dropped frames do not shift the later time
+   bins, and the time spent is the sum of the real intervals of the frames (see maze_analysis/timestamps.py).
+
+6. With --heatmaps, the occupancy of each animal is binned into a grid of the arena normalized by its calibration
+   coordinates and the mean cumulative 05, 10, 15 and 20 minute maps of each group ('Group' column) are saved as
+   jpg and in EPM_heatmaps.npz / OFT_heatmaps.npz. The grids of the animals are cached in the directory occupancy
+   (see maze_analysis/heatmaps.py).
+
+7. The results of each animal are cached in the directory result_cache. In the next analysis, only the animals whose
+   bonsai file, coordinates, frame rate, starting time, session length, time bin, regions or timestamps changed are analyzed
+   again (e.g. a new animal in the excel file). The trajectories of the reused animals are not drawn again.
+
+8. With --render final, only the trajectory of the whole session is drawn instead of each 5 minute window (--render all),
+   and --render none (or --no-trajectory) skips the trajectories. The figures are drawn headless without pyplot
+   (see maze_analysis/rendering.py).
+
+9. With --profile report.json, the wall time, CPU time, peak memory and frames/s of each stage (video, tracking, load_csv,
+   rasterize, classify, aggregate, bins, plot, excel, ...) of each animal are saved in this json file and summarized at
+   the end.
+   With --profile-slowest slowest.prof, the slowest animal is analyzed once more under cProfile (without drawing its
+   trajectories again) and the statistics are saved in this file (python -m pstats slowest.prof). See
+   maze_analysis/profiling.py.
+
+10. The first frames of the next videos are read in threads while the calibration of the current one is checked, and
+   with --cohort the next bonsai files are read while the current one is parsed (the worker processes of the other
+   modes already load their animals in parallel). --prefetch sets how many videos are read ahead (0: one after the
+   other) and --prefetch-memory the memory they may take. See maze_analysis/prefetch.py.
+
+11. With --store, the positions of all animals are saved as one float32 array in EPM_cohort.npy / OFT_cohort.npy with
+   the index EPM_cohort.json (offset, length, frame rate and starting frame of each animal). The animals are analyzed
+   from this file memory-mapped, so the worker processes share its pages and no bonsai file is parsed. The store is
+   written again when a bonsai file, a frame rate or a starting time changed. It can also be opened in a notebook
+   with CohortStore('EPM_cohort') (see maze_analysis/store.py).
+
+12. With --sweep sweep.csv (or .parquet), the time spent, distance travelled and speed of all time bins of
+   --sweep-timebins (e.g. 30 60 120 300) are saved in one long/tidy table (Animal no, Timebin, Center fraction,
+   Arena (cm2), Metric, Region, Period, Value) instead of the excel file. For OFT, the centers of --sweep-centers
+   (fractions of the OFT corners, e.g. 0.1 0.2 0.3 0.5) and the arena sizes of --sweep-arenas (cm2, e.g. 3600 4900)
+   are swept too. Each trajectory is loaded and classified once for all combinations (see maze_analysis/sweep.py).
+*******
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import EPM_Analysis_AJ_by_timebin as EPM
+import OFT_Analysis_AJ_by_timebin as OFT
+from maze_analysis import ResultBuilder, write_excel, write_parquet, write_bonsai, load_bonsai
+from maze_analysis.result_cache import ResultCache, CACHE_DIRECTORY, analysis_key
+from maze_analysis.timestamps import load_timestamps
+from maze_analysis.heatmaps import HEATMAP_BINS, animal_occupancy, group_maps, save_group_maps
+from maze_analysis.rendering import RENDER_MODES
+from maze_analysis.profiling import Profiler, profile_stage, profile_call
+from maze_analysis.video import read_video
+from maze_analysis.prefetch import PREFETCH_DEPTH, PREFETCH_MEMORY_MB, prefetch
+from maze_analysis.store import CohortStore, store_path, build_store
+from maze_analysis.sweep import SWEEP_CENTERS, sweep_animal, save_sweep
+from maze_analysis.mazes import OFT_AREA
+from maze_analysis.arenas import animal_videos, video_arenas, split_videos
+from maze_analysis.calibration import calibration_path, load_calibration, get_coords, check_clicks, video_fingerprint, report_calibration, auto_calibrate, save_calibration
+
+def parse_args(argv=None):
+    """
+    Parse the arguments of the command line
+    """
+    parser = argparse.ArgumentParser(description='Headless batch analysis of EPM/OFT experiments.')
+    parser.add_argument('test', choices=['EPM', 'OFT'], help='Test to analyze')
+    parser.add_argument('--session', type=int, required=True, help='How long one session of the experiment takes (in minutes)')
+    parser.add_argument('--timebin', type=int, required=True, help='Time bin (in seconds)')
+    parser.add_argument('--regions', type=int, choices=[1, 2], default=1, help='EPM only. 5 regions of EPM (1) or 3 regions of EPM (2)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes')
+    parser.add_argument('--directory', default='.', help='Directory of the excel file, videos, bonsai files and calibration file')
+    parser.add_argument('--auto-calibrate', action='store_true', help='Detect the corners of animals without valid coordinates on the first frame of their video')
+    parser.add_argument('--parquet', help='Also save the results as long/tidy table in this Parquet file')
+    parser.add_argument('--no-cache', action='store_true', help='Analyze all animals again instead of reusing the cached results')
+    parser.add_argument('--cache-size', type=int, default=64, help='Maximum size of the result cache (in MB)')
+    parser.add_argument('--chunk-size', type=int, help='Stream the bonsai files in chunks of this number of frames with constant memory (for long recordings)')
+    parser.add_argument('--track', action='store_true', help='Track the mouse in the videos of the animals without bonsai file instead of Bonsai')
+    parser.add_argument('--cohort', action='store_true', help='Analyze all animals at once in one process with vectorized cohort sums (no trajectories are drawn)')
+    parser.add_argument('--render', choices=RENDER_MODES, default='all', help='Draw the trajectories of all 5 minute windows, only of the whole session or none')
+    parser.add_argument('--no-trajectory', dest='render', action='store_const', const='none', help='Do not draw the trajectories (same as --render none)')
+    parser.add_argument('--heatmaps', action='store_true', help='Save the occupancy heatmaps of each group (mean of the animals) for 05, 10, 15 and 20 minutes')
+    parser.add_argument('--bins', type=int, default=HEATMAP_BINS, help='Number of cells along each side of the arena in the heatmaps')
+    parser.add_argument('--timestamps', action='store_true', help='Find the time bins in the timestamps of the frames (bonsai column Timestamp or video) instead of the frame rate')
+    parser.add_argument('--profile', help='Save the wall time, CPU time, peak memory and frames/s of each stage of each animal in this json file')
+    parser.add_argument('--profile-slowest', help='Analyze the slowest animal again under cProfile and save the statistics in this file')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH_DEPTH, help='Number of videos read ahead in threads while the current one is checked (0: one after the other)')
+    parser.add_argument('--prefetch-memory', type=int, default=PREFETCH_MEMORY_MB, help='Maximum memory of the videos read ahead (in MB)')
+    parser.add_argument('--sweep', help='Save the results of all time bins of --sweep-timebins (and OFT centers and arena sizes) in this csv/parquet file instead of the excel file')
+    parser.add_argument('--sweep-timebins', type=int, nargs='+', help='Time bins (in seconds) of the sweep (default: --timebin)')
+    parser.add_argument('--sweep-centers', type=float, nargs='+', default=list(SWEEP_CENTERS), help='OFT only. Fractions of the OFT corners of the centers in the sweep (0.1: small center, 0.5: large center)')
+    parser.add_argument('--sweep-arenas', type=float, nargs='+', default=[OFT_AREA], help='OFT only. Areas of OFT (in cm2) in the sweep')
+    parser.add_argument('--store', action='store_true', help='Analyze the trajectories from the memory-mapped cohort store (EPM_cohort.npy), written again if a bonsai file changed')
+    args = parser.parse_args(argv)
+    args.profiling = args.profile is not None or args.profile_slowest is not None
+    if args.timestamps and args.chunk_size:
+        parser.error('--timestamps cannot be used with --chunk-size')
+    if args.store and args.chunk_size:
+        parser.error('--store cannot be used with --chunk-size')
+    if args.sweep and (args.timestamps or args.chunk_size or args.cohort):
+        parser.error('--sweep cannot be used with --timestamps, --chunk-size or --cohort')
+    if any(not 0 < center <= 1 for center in args.sweep_centers):
+        parser.error('--sweep-centers must be fractions between 0 and 1')
+    if args.sweep_timebins is None:
+        args.sweep_timebins = [args.timebin]
+    return args
+
+def track_job(job):
+    """
+    Track the mouse in each arena of one video inside its clicked maze (in a worker process) and save the bonsai file of each animal
+    """
+    # opencv is only loaded by the processes which track videos
+    from maze_analysis.tracking import TRACKING_COLUMNS, track_arenas
+    test, video, arena_jobs = job
+    frame_rate, width, height, video_file = arena_jobs[0][5]
+    tracks = track_arenas(video_file, [arena_job[4] for arena_job in arena_jobs], width, height)
+    for arena_job, track in zip(arena_jobs, tracks):
+        write_bonsai(track, '%s%s-%s-bonsai.csv'%(arena_job[2], arena_job[1], test), TRACKING_COLUMNS)
+
+def read_first_frame(video_file):
+    """
+    Read the first frame, the frame rate, the width and the height of a video file and its fingerprint (None without video file)
+    """
+    return read_video(video_file) + ((video_fingerprint(video_file) if os.path.exists(video_file) else None),)
+
+def analyze_job(job):
+    """
+    Analyze one animal with its saved coordinates (in a worker process) and return the results as {column name: value}
+    and the profiling records of its stages (empty without --profile)
+    """
+    test, no, sex, time, coords, (frame_rate, width, height, video_file), args = job
+    profiler = Profiler() if args.profiling else None
+    with profile_stage(profiler, 'animal', sex + str(no)):
+        timestamps = None
+        if args.timestamps:
+            with profile_stage(profiler, 'timestamps', sex + str(no)):
+                timestamps = load_timestamps('%s%s-%s-bonsai.csv'%(sex, no, test), video_file)
+        
+        # The positions are a view of the store, the pages are shared by all worker processes
+        bonsai_file = None
+        if args.store:
+            with profile_stage(profiler, 'load_csv', sex + str(no)) as record:
+                bonsai_file = CohortStore(store_path(test)).bonsai_file(sex + str(no))
+                record['frames'] = len(bonsai_file)
+        if test == 'EPM':
+            results = EPM.analyze_animal(no, sex, time, coords, frame_rate, width, height, args.session, args.timebin, args.regions, draw=args.render, chunk_size=args.chunk_size, timestamps=timestamps, profiler=profiler, bonsai_file=bonsai_file)
+        else:
+            results = OFT.analyze_animal(no, sex, time, coords, frame_rate, width, height, args.session, args.timebin, draw=args.render, chunk_size=args.chunk_size, timestamps=timestamps, profiler=profiler, bonsai_file=bonsai_file)
+    return results, [] if profiler is None else profiler.records
+
+def sweep_job(job):
+    """
+    Return the long/tidy table of the sweep of one animal (in a worker process), its trajectory is classified once
+    """
+    test, no, sex, time, coords, (frame_rate, width, height, video_file), args = job
+    if args.store:
+        bonsai_file = CohortStore(store_path(test)).bonsai_file(sex + str(no))
+    else:
+        bonsai_file = load_bonsai('%s%s-%s-bonsai.csv'%(sex, no, test))
+    return sweep_animal(test, no, coords, bonsai_file, frame_rate, time, args.session, args.sweep_timebins, args.sweep_centers, args.sweep_arenas, width, height)
+
+def heatmap_job(job):
+    """
+    Return the occupancy grids of the 5 minute blocks of one animal (in a worker process), from the cache if its inputs did not change
+    """
+    test, no, sex, time, coords, (frame_rate, width, height, video_file), args = job
+    timestamps = load_timestamps('%s%s-%s-bonsai.csv'%(sex, no, test), video_file) if args.timestamps else None
+    return animal_occupancy(test, sex + str(no), coords, frame_rate, time, args.session, args.bins, timestamps)
+
+def analyze_cohort_jobs(jobs):
+    """
+    Analyze all animals at once (see maze_analysis/cohort.py) and return the results of each animal as {column name: value}
+    """
+    test, args = jobs[0][0], jobs[0][-1]
+    animals = [(no, sex, time, coords, frame_rate) for test, no, sex, time, coords, (frame_rate, width, height, video_file), args in jobs]
+    timestamps = None
+    if args.timestamps:
+        timestamps = [load_timestamps('%s%s-%s-bonsai.csv'%(sex, no, test), video_file) for test, no, sex, time, coords, (frame_rate, width, height, video_file), args in jobs]
+    cohort = CohortStore(store_path(test)).cohort([sex + str(no) for no, sex, time, coords, frame_rate in animals]) if args.store else None
+    if test == 'EPM':
+        return EPM.analyze_cohort(animals, args.session, args.timebin, args.regions, timestamps, cohort)
+    return OFT.analyze_cohort(animals, args.session, args.timebin, timestamps, cohort)
+
+def main(argv=None):
+    args = parse_args(argv)
+    test = args.test
+    profiler = Profiler() if args.profiling else None
+    
+    # The videos and bonsai files are opened relative to the directory of the excel file
+    os.chdir(args.directory)
+    excel_file = '%s_data.xlsx'%(test)
+    df = pd.read_excel(excel_file, converters={'Animal no':str,'Sex':str,'Starting time':int}, index_col = 'Animal no')
+    
+    # Get the saved coordinates of each animal, they must belong to the current video file
+    calibration = load_calibration(calibration_path(test))
+    script = EPM if test == 'EPM' else OFT
+    videos = animal_videos(df)
+    arenas = video_arenas(videos)
+    
+    # The first frames and fingerprints of the next videos are read while the current one is checked (see maze_analysis/prefetch.py)
+    video_frames = prefetch(read_first_frame, ['%s_%s.avi'%(video, test) for video in dict.fromkeys(videos[sex + str(no)][0] for no, sex in zip(df.index.to_list(), df['Sex'].to_list()))], args.prefetch, args.prefetch_memory)
+    frames = {}
+    jobs = []
+    missing = []
+    for no, sex, time in zip(df.index.to_list(), df['Sex'].to_list(), df['Starting time'].to_list()):
+        anim_id = sex + str(no)
+        video = videos[anim_id][0]
+        video_file = '%s_%s.avi'%(video, test)
+        if video not in frames:
+            with profile_stage(profiler, 'video', anim_id):
+                frames[video] = next(video_frames)[1]
+        img, frame_rate, width, height, video_hash = frames[video]
+        coords = get_coords(calibration, anim_id, video_hash)
+        
+        # The automatic detection only finds one maze per video
+        if not check_clicks(test, coords) and args.auto_calibrate and img is not None and len(arenas[video]) == 1:
+            coords = auto_calibrate(test, calibration, anim_id, video_hash, img, (width, height), script.calculate_pixel)
+        if not check_clicks(test, coords):
+            missing.append(anim_id)
+        jobs.append((test, no, sex, time, coords, (frame_rate, width, height, video_file), args))
+    if args.auto_calibrate:
+        save_calibration(calibration_path(test), calibration)
+    if missing:
+        raise SystemExit('No valid coordinates in %s for: %s. Please click them with %s_Analysis_AJ_by_timebin.py.'%(calibration_path(test), ', '.join(missing), test))
+    report_calibration(test, calibration, [job[2] + str(job[1]) for job in jobs])
+    
+    # Track the videos of the animals without bonsai file in parallel, all arenas of a video in one pass
+    if args.track:
+        animal_jobs = {job[2] + str(job[1]): job for job in jobs}
+        untracked = []
+        for video, video_animals in arenas.items():
+            if os.path.exists('%s-%s-bonsai.csv'%(video, test)) or all(os.path.exists('%s-%s-bonsai.csv'%(anim_id, test)) for arena, anim_id in video_animals):
+                continue
+            untracked.append((test, video, [animal_jobs[anim_id] for arena, anim_id in video_animals]))
+        with profile_stage(profiler, 'tracking'), ProcessPoolExecutor(max_workers=args.workers) as executor:
+            for job, _ in zip(untracked, executor.map(track_job, untracked)):
+                print('%s tracked'%(job[1]))
+    
+    # Split the bonsai file of each video with several arenas into the bonsai file of each animal
+    split_videos(test, videos)
+    
+    # Concatenate the trajectories of all animals into the memory-mapped store (see maze_analysis/store.py)
+    if args.store:
+        with profile_stage(profiler, 'store'):
+            build_store(store_path(test), [(job[2] + str(job[1]), '%s%s-%s-bonsai.csv'%(job[2], job[1], test), job[5][0], job[3]) for job in jobs])
+    
+    # Sweep of the time bins (and OFT centers and arena sizes) instead of the analysis, one table for all animals
+    if args.sweep:
+        with profile_stage(profiler, 'sweep'), ProcessPoolExecutor(max_workers=args.workers) as executor:
+            save_sweep(pd.concat(executor.map(sweep_job, jobs), ignore_index=True), args.sweep)
+        print('Sweep saved in %s'%(args.sweep))
+        if profiler is not None:
+            if args.profile:
+                profiler.save(args.profile)
+            profiler.summary()
+        return
+    
+    # Reuse the results of the animals whose inputs did not change since the last analysis
+    cache = None if args.no_cache else ResultCache(CACHE_DIRECTORY, args.cache_size*1024*1024)
+    results = [None]*len(jobs)
+    keys = [None]*len(jobs)
+    if cache is not None:
+        for k, (test, no, sex, time, coords, (frame_rate, width, height, video_file), args) in enumerate(jobs):
+            keys[k] = analysis_key(test, '%s%s-%s-bonsai.csv'%(sex, no, test), coords, frame_rate, time, args.session, args.timebin, args.regions if test == 'EPM' else None, args.timestamps)
+            results[k] = cache.get(keys[k])
+    pending = [k for k in range(len(jobs)) if results[k] is None]
+    
+    # Analyze the other animals in parallel, the results come back in the order of the animals
+    if args.cohort:
+        with profile_stage(profiler, 'cohort'):
+            animal_results = [(results, []) for results in analyze_cohort_jobs([jobs[k] for k in pending])] if pending else []
+    else:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        animal_results = executor.map(analyze_job, [jobs[k] for k in pending])
+    for k, (animal_results, records) in zip(pending, animal_results):
+        print('%s%s done'%(jobs[k][2], jobs[k][1]))
+        if profiler is not None:
+            profiler.extend(records)
+        results[k] = animal_results
+        if cache is not None:
+            cache.put(keys[k], animal_results)
+    if not args.cohort:
+        executor.shutdown()
+    if cache is not None:
+        cache.report()
+    
+    # Collect the results of all animals in the columns depending on the time bin
+    if test == 'EPM':
+        builder = ResultBuilder(EPM.create_columns(args.session, args.timebin, args.regions))
+    else:
+        builder = ResultBuilder(OFT.create_columns(args.session, args.timebin))
+    for job, animal_results in zip(jobs, results):
+        builder.add(job[1], animal_results)
+    
+    # Save all the data in excel file back at once, and the long table for statistics
+    with profile_stage(profiler, 'excel'):
+        write_excel(builder.merge(df), excel_file)
+    if args.parquet:
+        with profile_stage(profiler, 'parquet'):
+            write_parquet(builder, args.parquet)
+    
+    # Mean occupancy maps of each group from the grids of the animals
+    if args.heatmaps:
+        with profile_stage(profiler, 'heatmaps'):
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                grids = list(executor.map(heatmap_job, jobs))
+            groups = [str(group) if pd.notna(group) else 'NoGroup' for group in df['Group'].to_list()] if 'Group' in df.columns else ['All']*len(jobs)
+            save_group_maps(test, group_maps(grids, groups))
+    
+    # Profiling report, and the slowest animal analyzed again under cProfile (without drawing)
+    if profiler is not None:
+        if args.profile:
+            profiler.save(args.profile)
+        profiler.summary()
+        slowest = profiler.slowest_animal()
+        if args.profile_slowest and slowest is not None:
+            k = [job[2] + str(job[1]) for job in jobs].index(slowest)
+
+            # The trajectories are not drawn again, they were drawn by the run above
+            no_render = argparse.Namespace(**dict(vars(args), render='none'))
+            profile_call(args.profile_slowest, analyze_job, jobs[k][:-1] + (no_render,))
+            print('cProfile statistics of %s saved in %s'%(slowest, args.profile_slowest))
+
+if __name__ == '__main__':
+    main()
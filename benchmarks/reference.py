@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Reference implementations of the time spent and the distance travelled for the correctness checks
+
+These are the per-frame loops of the first versions of EPM_Analysis_AJ_by_timebin.py and OFT_Analysis_AJ_by_timebin.py
+(Path.contains_point for every frame on the slice bonsai_file.iloc[a:b] of each window). They are slow, so they are
+only run on short tracks, and the results of the optimized functions of the scripts must be the same.
+"""
+
+import numpy as np
+
+def epm_calculate_time(bonsai_file, frame_rate, coords_list):
+    """
+    Calculate the time spent in ROIs and return the data in list format
+    """
+    bonsai_file_list = list(zip(bonsai_file['mouseX'], bonsai_file['mouseY']))
+    time_spent = []
+    for i in range(len(coords_list)):
+        inside_region = coords_list[i].contains_points(bonsai_file_list)
+        time_spent.append(sum(inside_region)/frame_rate)
+    return time_spent
+
+def epm_calculate_distance(bonsai_file, p, coords_list):
+    """
+    Calculate distance travelled in ROI and return a list of [dist in OA_left, dist in OA_right, dist in CA_up, dist in CA_down, dist in center, Total dist]
+    """
+    x = bonsai_file['mouseX']
+    y = bonsai_file['mouseY']
+    dists = [[] for i in range(len(coords_list))]
+    total_dist = []
+    for a in bonsai_file.index.values.tolist()[:-2]:
+        b = a+1
+        dist = (((x[a] - x[b])*p)**2+((y[a] - y[b])*p)**2)**0.5
+        total_dist.append(dist)
+
+        # Each step belongs to the first ROI which contains its start
+        for i in range(len(coords_list)):
+            if coords_list[i].contains_point((x[a], y[a])):
+                dists[i].append(dist)
+                break
+    return [np.nansum(dist) for dist in dists] + [np.nansum(total_dist)]
+
+def oft_calculate_time(bonsai_file, frame_rate, coords_list):
+    """
+    Calculate time spent in ROI and return a list of [time spent in small ct, time spent in large ct, time spent out of large ct, total time]
+    """
+    x = bonsai_file['mouseX']
+    y = bonsai_file['mouseY']
+    total_time = 0
+    small_ct_time = 0
+    large_ct_time = 0
+    border_time = 0
+    for a in bonsai_file.index.values.tolist():
+        total_time = total_time+1
+        if coords_list[1].contains_point((x[a], y[a])):
+            small_ct_time = small_ct_time+1
+        if coords_list[2].contains_point((x[a], y[a])):
+            large_ct_time = large_ct_time+1
+        else:
+            border_time = border_time+1
+    return [small_ct_time/frame_rate, large_ct_time/frame_rate, border_time/frame_rate, total_time/frame_rate]
+
+def oft_calculate_distance(bonsai_file, p, coords_list):
+    """
+    Calculate distance travelled in ROI and return a list of [dist in small ct, dist in large ct, dist out of large ct, total dist]
+    """
+    x = bonsai_file['mouseX']
+    y = bonsai_file['mouseY']
+    total_dist = []
+    small_ct_dist = []
+    large_ct_dist = []
+    border_dist = []
+    for a in bonsai_file.index.values.tolist()[:-2]:
+        b = a+1
+        dist = (((x[a] - x[b])*p)**2+((y[a] - y[b])*p)**2)**0.5
+        total_dist.append(dist)
+        if coords_list[1].contains_point((x[a], y[a])):
+            small_ct_dist.append(dist)
+        if coords_list[2].contains_point((x[a], y[a])):
+            large_ct_dist.append(dist)
+        else:
+            border_dist.append(dist)
+    return [np.nansum(small_ct_dist), np.nansum(large_ct_dist), np.nansum(border_dist), np.nansum(total_dist)]
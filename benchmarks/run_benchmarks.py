@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the hot paths of the EPM and OFT analysis on synthetic tracks
+
+This script times each stage of the analysis of one animal separately on synthetic Bonsai files (see synthetic.py)
+of 10k to 10M frames, so that a change of the code or an upgrade of pandas/numpy/matplotlib which makes one stage
+slower can be found:
+
+    load_csv            parse the Bonsai csv file (read_bonsai_csv)
+    load_sidecar        load the binary sidecar of the csv file (load_bonsai)
+    zones               rasterize the ROIs and classify the frames (rasterize_ROI, classify_frames)
+    distance            step distances (step_distance)
+    cumsum              cumulative sums per zone (ZoneCumsum)
+    events              runs of the zones for entries, latencies, bouts and transitions (zone_events)
+    calculate_time      calculate_time of the script for every time bin and 5 minute window
+    calculate_distance  calculate_distance of the script for every time bin and 5 minute window
+    bins                all the columns of the animal (add_results of the script)
+    render              trajectory of the whole session (render_trajectory)
+    excel               excel file of a cohort of animals with these results (write_excel)
+
+The frame rate of each track is chosen so that the track covers the whole session, so the time bins are spread over
+all frames whatever the size. Each stage is run --repeat times and the best time is kept.
+
+Before the timings, the correctness check compares the time spent and the distance travelled of every window with the
+reference per-frame loops of the first versions of the scripts (see reference.py) on short tracks of both motions.
+
+The results (versions of the packages, timings and checks) are saved as json file. With --compare, the timings are
+compared with a previous json file and the stages slower than --threshold times are reported (exit code 1), e.g.
+
+    python benchmarks/run_benchmarks.py --output before.json
+    (change the code or upgrade pandas)
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+    python benchmarks/run_benchmarks.py --tests OFT --motions wall --sizes 10000000 --stages load_csv load_sidecar zones
+
+The synthetic Bonsai files are written once in benchmarks/data and reused by the next runs.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# The benchmarks import the scripts and the package of the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+import EPM_Analysis_AJ_by_timebin as EPM
+import OFT_Analysis_AJ_by_timebin as OFT
+from maze_analysis import rasterize_ROI, classify_frames, step_distance, ZoneCumsum, zone_events, load_bonsai, analysis_windows, write_excel
+from maze_analysis.bonsai_io import read_bonsai_csv
+from maze_analysis.rendering import trajectory_job, render_trajectory
+from synthetic import MOTIONS, WIDTH, HEIGHT, maze_coords, track_file
+import reference
+
+STAGES = ('load_csv', 'load_sidecar', 'zones', 'distance', 'cumsum', 'events', 'calculate_time', 'calculate_distance', 'bins', 'render', 'excel')
+
+# Number of frames of the tracks, 10M frames (about 500 MB of csv file per test and motion) only on request
+SIZES = (10000, 100000, 1000000)
+
+# Session length (min) and time bin (s) of each test
+SESSIONS = {'EPM': (15, 60), 'OFT': (20, 60)}
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+RESULT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the EPM and OFT analysis on synthetic tracks')
+    parser.add_argument('--tests', nargs='+', choices=['EPM', 'OFT'], default=['EPM', 'OFT'], help='Tests to benchmark')
+    parser.add_argument('--motions', nargs='+', choices=MOTIONS, default=list(MOTIONS), help='Motions of the synthetic tracks')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES), help='Numbers of frames of the tracks (e.g. 10000 100000 1000000 10000000)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help='Stages to time')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs of each stage (the best time is kept)')
+    parser.add_argument('--animals', type=int, default=20, help='Number of animals in the excel file of the excel stage')
+    parser.add_argument('--check-frames', type=int, default=10000, help='Number of frames of the tracks of the correctness check')
+    parser.add_argument('--no-check', dest='check', action='store_false', help='Skip the correctness check against the reference loops')
+    parser.add_argument('--data', default=DATA_DIRECTORY, help='Directory of the synthetic Bonsai files')
+    parser.add_argument('--output', help='Json file of the results (default: benchmarks/results/bench-<date>.json)')
+    parser.add_argument('--compare', help='Json file of previous results to compare the timings with')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Report the stages slower than this ratio to the previous results')
+    return parser.parse_args(argv)
+
+class Maze(object):
+    """
+    ROIs, pixel size, frame rate and windows of a synthetic track of the test
+    """
+    def __init__(self, test, n_frame):
+        self.test = test
+        self.script = EPM if test == 'EPM' else OFT
+        self.coords = maze_coords(test)
+        self.coords_list = self.script.define_ROI(self.coords)
+        self.p = self.script.calculate_pixel(self.coords)
+        self.session, self.timebin = SESSIONS[test]
+        self.frame_rate = n_frame/(self.session*60)
+
+        # EPM: the 5 arms and the center, OFT: small and large center (border: OUTSIDE)
+        self.rois = self.coords_list if test == 'EPM' else self.coords_list[1:]
+        self.windows = analysis_windows(self.frame_rate, 0, self.session, self.timebin)
+
+    def labels(self, bonsai_file):
+        return classify_frames(rasterize_ROI(self.rois, WIDTH, HEIGHT), self.rois, bonsai_file['mouseX'], bonsai_file['mouseY'])
+
+    def events(self, zone_labels, bonsai_file):
+        return zone_events(zone_labels, bonsai_file['mouseX'], bonsai_file['mouseY'], carry_outside=self.test == 'EPM')
+
+    def calculate_time(self, zone_cumsum, a, b):
+        if self.test == 'EPM':
+            return self.script.calculate_time(zone_cumsum, a, b, self.frame_rate, self.coords_list)
+        return self.script.calculate_time(zone_cumsum, a, b, self.frame_rate)
+
+    def calculate_distance(self, zone_cumsum, a, b):
+        if self.test == 'EPM':
+            return self.script.calculate_distance(zone_cumsum, a, b, self.coords_list)
+        return self.script.calculate_distance(zone_cumsum, a, b)
+
+    def add_results(self, results, zone_cumsum, events):
+        if self.test == 'EPM':
+            self.script.add_results(results, zone_cumsum, self.frame_rate, 0, self.session, self.timebin, self.coords_list, 1, events)
+        else:
+            self.script.add_results(results, zone_cumsum, self.frame_rate, 0, self.session, self.timebin, events)
+
+    def columns(self):
+        if self.test == 'EPM':
+            return self.script.create_columns(self.session, self.timebin, 1)
+        return self.script.create_columns(self.session, self.timebin)
+
+    def reference(self, bonsai_file, a, b):
+        """
+        Return the time spent and the distance travelled in the window [a, b) by the reference loops
+        """
+        window = bonsai_file.iloc[a:b]
+        if self.test == 'EPM':
+            return reference.epm_calculate_time(window, self.frame_rate, self.coords_list), reference.epm_calculate_distance(window, self.p, self.coords_list)
+        return reference.oft_calculate_time(window, self.frame_rate, self.coords_list), reference.oft_calculate_distance(window, self.p, self.coords_list)
+
+def timed(function, repeat):
+    """
+    Run the function repeat times and return the best time (s) and the value of the last run
+    """
+    best = np.inf
+    for i in range(max(repeat, 1)):
+        start = time.perf_counter()
+        value = function()
+        best = min(best, time.perf_counter() - start)
+    return best, value
+
+def check_track(test, motion, n_frame, directory):
+    """
+    Compare the time spent and the distance travelled of every window of the optimized functions with the reference loops
+    """
+    maze = Maze(test, n_frame)
+    bonsai_file = load_bonsai(track_file(directory, test, motion, n_frame)).astype(np.float64)
+    zone_labels = maze.labels(bonsai_file)
+    zone_cumsum = ZoneCumsum(zone_labels, step_distance(bonsai_file['mouseX'], bonsai_file['mouseY'], maze.p), len(maze.rois))
+
+    max_diff = 0.0
+    for a, b in maze.windows:
+        time_ref, dist_ref = maze.reference(bonsai_file, a, b)
+        time_new = maze.calculate_time(zone_cumsum, a, b)
+        dist_new = maze.calculate_distance(zone_cumsum, a, b)
+        # Relative difference, the distances are sums of many steps in another order
+        for new, ref in zip(list(time_new) + list(dist_new), list(time_ref) + list(dist_ref)):
+            max_diff = max(max_diff, abs(float(new) - float(ref))/max(abs(float(ref)), 1.0))
+    return {'test': test, 'motion': motion, 'frames': n_frame, 'windows': len(maze.windows), 'max_rel_diff': max_diff, 'ok': bool(max_diff < 1e-9)}
+
+def benchmark_track(test, motion, n_frame, stages, repeat, animals, directory):
+    """
+    Time the stages of the analysis of one synthetic track and return the list of {test, motion, frames, stage, seconds}
+    """
+    maze = Maze(test, n_frame)
+    bonsai_csv = track_file(directory, test, motion, n_frame)
+    timings = {}
+
+    # The later stages need the values of the earlier stages, they are computed once if their stage is not timed
+    def stage(name, function):
+        if name in stages:
+            timings[name], value = timed(function, repeat)
+            return value
+        return function()
+
+    if 'load_csv' in stages:
+        stage('load_csv', lambda: read_bonsai_csv(bonsai_csv))
+    load_bonsai(bonsai_csv)
+    bonsai_file = stage('load_sidecar', lambda: load_bonsai(bonsai_csv))
+    zone_labels = stage('zones', lambda: maze.labels(bonsai_file))
+    dist = stage('distance', lambda: step_distance(bonsai_file['mouseX'], bonsai_file['mouseY'], maze.p))
+    zone_cumsum = stage('cumsum', lambda: ZoneCumsum(zone_labels, dist, len(maze.rois)))
+    events = stage('events', lambda: maze.events(zone_labels, bonsai_file))
+    if 'calculate_time' in stages:
+        stage('calculate_time', lambda: [maze.calculate_time(zone_cumsum, a, b) for a, b in maze.windows])
+    if 'calculate_distance' in stages:
+        stage('calculate_distance', lambda: [maze.calculate_distance(zone_cumsum, a, b) for a, b in maze.windows])
+    results = {}
+    stage('bins', lambda: maze.add_results(results, zone_cumsum, events))
+
+    with tempfile.TemporaryDirectory() as temp_directory:
+        if 'render' in stages:
+            rois = [(roi, 'red') for roi in maze.coords_list]
+            job = trajectory_job(bonsai_file['mouseX'], bonsai_file['mouseY'], rois, '%s_%s_%d'%(test, motion, n_frame), WIDTH, HEIGHT, os.path.join(temp_directory, 'trajectory.jpg'))
+            stage('render', lambda: render_trajectory(job))
+        if 'excel' in stages:
+            df = pd.DataFrame([results]*animals, index=pd.Index(range(animals), name='Animal no')).reindex(columns=maze.columns(), fill_value=0)
+            stage('excel', lambda: write_excel(df, os.path.join(temp_directory, '%s_data.xlsx'%(test))))
+
+    return [{'test': test, 'motion': motion, 'frames': n_frame, 'stage': name, 'seconds': timings[name]} for name in STAGES if name in timings]
+
+def environment():
+    """
+    Return the versions of python and of the packages, the machine and the commit of the code
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'matplotlib': matplotlib.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+def compare(timings, previous, threshold):
+    """
+    Print the ratio of each timing to the previous timing of the same track and stage and return the regressions
+    """
+    previous = {(t['test'], t['motion'], t['frames'], t['stage']): t['seconds'] for t in previous['timings']}
+    regressions = []
+    print('\nComparison with the previous results (ratio > %.2f: slower)'%(threshold))
+    for t in timings:
+        before = previous.get((t['test'], t['motion'], t['frames'], t['stage']))
+        if before is None or before <= 0:
+            continue
+        ratio = t['seconds']/before
+        flag = ' <-- slower' if ratio > threshold else ''
+        print('%s %-6s %9d %-18s %10.4f s -> %10.4f s  x%.2f%s'%(t['test'], t['motion'], t['frames'], t['stage'], before, t['seconds'], ratio, flag))
+        if ratio > threshold:
+            regressions.append(dict(t, previous=before, ratio=ratio))
+    return regressions
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = {'environment': environment(), 'checks': [], 'timings': []}
+
+    # The optimized functions must give the same numbers as the reference loops
+    if args.check:
+        for test in args.tests:
+            for motion in args.motions:
+                check = check_track(test, motion, args.check_frames, args.data)
+                report['checks'].append(check)
+                print('Check %s %-6s %d frames, %d windows: max relative difference %.2e %s'%(test, motion, check['frames'], check['windows'], check['max_rel_diff'], 'ok' if check['ok'] else 'FAILED'))
+
+    for test in args.tests:
+        for motion in args.motions:
+            for n_frame in args.sizes:
+                timings = benchmark_track(test, motion, n_frame, args.stages, args.repeat, args.animals, args.data)
+                report['timings'] += timings
+                print('%s %-6s %9d frames: %s'%(test, motion, n_frame, ', '.join('%s %.4f s'%(t['stage'], t['seconds']) for t in timings)))
+
+    failed = [check for check in report['checks'] if not check['ok']]
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report['regressions'] = compare(report['timings'], json.load(f), args.threshold)
+
+    # Save the results as json file for the next comparison
+    output = args.output
+    if output is None:
+        os.makedirs(RESULT_DIRECTORY, exist_ok=True)
+        output = os.path.join(RESULT_DIRECTORY, 'bench-%s.json'%(datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    print('Results saved in %s'%(output))
+
+    if failed or report.get('regressions'):
+        sys.exit(1)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic Bonsai files and mazes for the benchmarks
+
+The tracks are written in the format of the Bonsai csv files (mouseX, mouseY, mouseAngle, mouseMajorAxisLength,
+mouseMinorAxisLength, mouseArea separated by spaces, NaN when the mouse is not detected), so they go through the
+same loading and analysis as the recorded files. Two kinds of motion:
+
+    random:  bounded random walk over the whole frame, the mouse is not detected in 1% of the frames
+    wall:    the mouse follows the outer walls of the maze with a few pixels of jitter, so that many frames are
+             close to the edges of the ROIs (the slow path of classify_frames)
+
+The same size, motion and seed always give the same track, so the generated files are reused between runs.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from maze_analysis import TRACK_COLUMNS
+
+# Motions of the synthetic tracks
+MOTIONS = ('random', 'wall')
+
+# Columns of the Bonsai csv files
+BONSAI_COLUMNS = list(TRACK_COLUMNS) + ['mouseAngle', 'mouseMajorAxisLength', 'mouseMinorAxisLength', 'mouseArea']
+
+# Size of the synthetic video
+WIDTH = 640
+HEIGHT = 480
+
+def epm_coords(width=WIDTH, height=HEIGHT, center=40, arm=200):
+    """
+    Return the 12 corners of an EPM in the middle of the frame, counterclockwise from the top left corner of the upper closed arm
+    """
+    x_0, y_0 = width/2 - center/2, height/2 - center/2
+    x_1, y_1 = x_0 + center, y_0 + center
+    return [(x_0, y_0-arm), (x_0, y_0), (x_0-arm, y_0), (x_0-arm, y_1), (x_0, y_1), (x_0, y_1+arm),
+            (x_1, y_1+arm), (x_1, y_1), (x_1+arm, y_1), (x_1+arm, y_0), (x_1, y_0), (x_1, y_0-arm)]
+
+def oft_coords(width=WIDTH, height=HEIGHT):
+    """
+    Return the 4 corners of a slightly tilted OFT clockwise from the top left corner (as clicked on a real video)
+    """
+    return [(0.15*width, 0.12*height), (0.80*width, 0.14*height), (0.78*width, 0.95*height), (0.16*width, 0.93*height)]
+
+def maze_coords(test, width=WIDTH, height=HEIGHT):
+    """
+    Return the clicked coordinates of the synthetic maze of the test
+    """
+    if test == 'EPM':
+        return epm_coords(width, height)
+    return oft_coords(width, height)
+
+def random_walk(n_frame, width=WIDTH, height=HEIGHT, step=3.0, missing=0.01, seed=0):
+    """
+    Return the positions (x, y) of a random walk reflected at the borders of the frame, NaN in a fraction missing of the frames
+    """
+    rng = np.random.default_rng(seed)
+    positions = []
+    for size in (width, height):
+        walk = np.cumsum(rng.normal(0, step, n_frame)) + size/2
+        # Reflect the walk into [0, size)
+        walk = np.abs((walk + size) % (2*size) - size)
+        positions.append(np.minimum(walk, size - 1e-3))
+    x, y = positions
+    lost = rng.random(n_frame) < missing
+    x[lost] = np.nan
+    y[lost] = np.nan
+    return x, y
+
+def wall_walk(n_frame, coords, step=2.0, jitter=3.0, seed=0):
+    """
+    Return the positions (x, y) of a mouse which walks back and forth along the polygon of the outer walls (coords)
+    """
+    rng = np.random.default_rng(seed)
+    corners = np.asarray(list(coords) + [coords[0]], dtype=np.float64)
+    lengths = np.hypot(*np.diff(corners, axis=0).T)
+    perimeter = np.concatenate([[0], np.cumsum(lengths)])
+
+    # Position along the walls, the mouse turns around from time to time
+    direction = np.where(np.cumsum(rng.random(n_frame) < 0.002) % 2 == 0, 1.0, -1.0)
+    along = np.cumsum(direction*np.abs(rng.normal(step, step/2, n_frame))) % perimeter[-1]
+    x = np.interp(along, perimeter, corners[:, 0]) + rng.normal(0, jitter, n_frame)
+    y = np.interp(along, perimeter, corners[:, 1]) + rng.normal(0, jitter, n_frame)
+    return x, y
+
+def synthetic_track(test, motion, n_frame, width=WIDTH, height=HEIGHT, seed=0):
+    """
+    Return the positions (x, y) of a synthetic track of the test (EPM or OFT) with the motion (random or wall)
+    """
+    if motion == 'random':
+        return random_walk(n_frame, width, height, seed=seed)
+    if motion == 'wall':
+        return wall_walk(n_frame, maze_coords(test, width, height), seed=seed)
+    raise ValueError('Unknown motion %s, please use one of %s'%(motion, ', '.join(MOTIONS)))
+
+def write_track(file_path, x, y):
+    """
+    Write the positions in the format of the Bonsai csv file (the other columns are constant)
+    """
+    n_frame = len(x)
+    columns = {'mouseX': x, 'mouseY': y, 'mouseAngle': np.zeros(n_frame), 'mouseMajorAxisLength': np.full(n_frame, 20.0),
+               'mouseMinorAxisLength': np.full(n_frame, 10.0), 'mouseArea': np.full(n_frame, 150.0)}
+    temp_file = '%s.%s.tmp'%(file_path, os.getpid())
+    pd.DataFrame(columns)[BONSAI_COLUMNS].to_csv(temp_file, sep=' ', index=False, float_format='%.4f', na_rep='NaN', lineterminator='\n')
+    os.replace(temp_file, file_path)
+
+def track_file(directory, test, motion, n_frame, seed=0):
+    """
+    Return the path of the synthetic Bonsai file of the test, motion and number of frames, written if it does not exist yet
+    """
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, '%s-%s-%d-bonsai.csv'%(test, motion, n_frame))
+    if not os.path.exists(file_path):
+        x, y = synthetic_track(test, motion, n_frame, seed=seed)
+        write_track(file_path, x, y)
+    return file_path
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Live analysis of Elevated Plus Maze (EPM) and Open Field Test (OFT) by Bonsai & Python
+
+This script follows the bonsai file of one animal (F835-OFT-bonsai.csv) while Bonsai is still writing it during the
+experiment, and prints the time spent (second), distance travelled (cm) and speed (cm/s) in each region of every time
+bin as soon as the time bin is over. So you can see during the session whether the tracking works.
+
+*******
+Important information before starting this code
+
+1. The coordinates of the animal are read from the calibration file (EPM_calibration.json or OFT_calibration.json)
+   in the directory, like in batch_analysis.py. Please click or detect them before the experiment starts.
+
+2. The animal, the session length and the time bin are given as arguments, e.g.
+
+    python live_analysis.py OFT F835 --session 20 --timebin 60 --directory D:/OFT_cohort
+    python live_analysis.py EPM M801 --session 15 --timebin 60 --regions 2 --output M801_live.csv
+
+   With --output, each time bin is appended as one line to this csv file instead of the console.
+   The frame rate is read from the video, if the video cannot be read yet please give it with --frame-rate.
+
+3. The analysis stops after the last time bin, or when the bonsai file did not grow for --idle-timeout seconds.
+   Then the remaining time bins are given with the frames recorded so far, like in the offline analysis.
+
+4. With --replay, a recorded bonsai file is written again into a new file at --speed times the frame rate and this
+   new file is followed, e.g. to test the live analysis without an experiment:
+
+    python live_analysis.py OFT F835 --session 20 --timebin 60 --replay F835-OFT-bonsai.csv --speed 10
+*******
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+
+import EPM_Analysis_AJ_by_timebin as EPM
+import OFT_Analysis_AJ_by_timebin as OFT
+from maze_analysis import rasterize_ROI, classify_frames, analysis_windows
+from maze_analysis.calibration import calibration_path, load_calibration, get_coords, check_clicks
+from maze_analysis.live import POLL_INTERVAL, live_zone_sums, replay_bonsai, LiveWriter
+
+def parse_args(argv=None):
+    """
+    Parse the arguments of the command line
+    """
+    parser = argparse.ArgumentParser(description='Live analysis of a growing bonsai file of EPM/OFT experiments.')
+    parser.add_argument('test', choices=['EPM', 'OFT'], help='Test to analyze')
+    parser.add_argument('animal', help='Sex and animal no, e.g. F835')
+    parser.add_argument('--session', type=int, required=True, help='How long one session of the experiment takes (in minutes)')
+    parser.add_argument('--timebin', type=int, required=True, help='Time bin (in seconds)')
+    parser.add_argument('--start', type=int, default=0, help='Starting time of the analysis (in seconds)')
+    parser.add_argument('--regions', type=int, choices=[1, 2], default=1, help='EPM only. 5 regions of EPM (1) or 3 regions of EPM (2)')
+    parser.add_argument('--directory', default='.', help='Directory of the video, bonsai file and calibration file')
+    parser.add_argument('--frame-rate', type=float, help='Frame rate of the video (read from the video by default)')
+    parser.add_argument('--bonsai', help='Bonsai file to follow (default: <animal>-<test>-bonsai.csv)')
+    parser.add_argument('--output', help='Append the results of each time bin to this csv file instead of printing them')
+    parser.add_argument('--idle-timeout', type=float, default=30, help='Stop when the bonsai file did not grow for this number of seconds')
+    parser.add_argument('--poll', type=float, default=POLL_INTERVAL, help='Seconds between two reads of the bonsai file')
+    parser.add_argument('--replay', help='Replay this recorded bonsai file into a new file and follow it')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed (times the frame rate)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    test = args.test
+    anim_id = args.animal
+    os.chdir(args.directory)
+    script = EPM if test == 'EPM' else OFT
+
+    # Get the saved coordinates and frame size of the animal, the video is still recorded so it is not checked
+    calibration = load_calibration(calibration_path(test))
+    coords = get_coords(calibration, anim_id)
+    if not check_clicks(test, coords):
+        raise SystemExit('No valid coordinates in %s for: %s. Please click them with %s_Analysis_AJ_by_timebin.py.'%(calibration_path(test), anim_id, test))
+    width, height = calibration[anim_id]['frame_size']
+    frame_rate = args.frame_rate
+    if frame_rate is None:
+        frame_rate = script.read_video('%s_%s.avi'%(anim_id, test))[1]
+    if not frame_rate:
+        raise SystemExit('The frame rate cannot be read from %s_%s.avi. Please give it with --frame-rate.'%(anim_id, test))
+
+    # Set the regions of interest and the label raster to classify the frames
+    coords_list = script.define_ROI(coords)
+    p = script.calculate_pixel(coords)
+    rois = coords_list if test == 'EPM' else coords_list[1:]
+    label_raster = rasterize_ROI(rois, width, height)
+
+    # Replay a recorded bonsai file into a new file, which is followed like the file of a running experiment.
+    # Without --bonsai, the new file is written into a temporary directory which is removed at the end.
+    bonsai_csv = args.bonsai or '%s-%s-bonsai.csv'%(anim_id, test)
+    with tempfile.TemporaryDirectory() as replay_directory:
+        replay = None
+        stop = threading.Event()
+        if args.replay:
+            if args.bonsai is None:
+                bonsai_csv = os.path.join(replay_directory, '%s-%s-bonsai.csv'%(anim_id, test))
+            elif os.path.exists(bonsai_csv):
+                raise SystemExit('%s already exists and would be overwritten by the replay.'%(bonsai_csv))
+            replay = threading.Thread(target=replay_bonsai, args=(args.replay, bonsai_csv, frame_rate, args.speed), kwargs={'stop': stop}, daemon=True)
+            replay.start()
+
+        # Emit the results of each time bin as soon as its last frame is written
+        n_bin = int(args.session*60/args.timebin)
+        windows = analysis_windows(frame_rate, args.start, args.session, args.timebin)[:n_bin]
+        writer = LiveWriter(args.output)
+        try:
+            for k, zone_sums in live_zone_sums(bonsai_csv, windows, lambda x, y: classify_frames(label_raster, rois, x, y), p, len(rois),
+                                               poll_interval=args.poll, idle_timeout=args.idle_timeout):
+                a, b = windows[k]
+                row = {'Animal': anim_id, 'Period': '%ss_%ss'%(str(args.timebin*k), str(args.timebin*(k+1)))}
+                if test == 'EPM':
+                    row.update(EPM.live_results(zone_sums, a, b, frame_rate, args.timebin, coords_list, args.regions))
+                else:
+                    row.update(OFT.live_results(zone_sums, a, b, frame_rate, args.timebin))
+                writer.write(row)
+        finally:
+            writer.close()
+
+            # Stop the replay, so that its file is closed before the temporary directory is removed
+            if replay is not None:
+                stop.set()
+                replay.join()
+
+if __name__ == '__main__':
+    main()
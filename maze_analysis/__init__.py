@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the video analysis of behavioral mazes (EPM, OFT) by Bonsai & Python
+
+The EPM/OFT analysis scripts in the parent directory import the functions of this package. Other arenas are described
+by a Maze (ROIs, pixel size, regions, see mazes.py) and analyzed by the same functions.
+
+Only numpy and pandas are imported with the package: opencv (video.py, tracking.py, arena_detection.py) and matplotlib
+(ROIs, rendering.py, heatmaps.py) are imported by the functions which need them.
+"""
+
+from .zones import OUTSIDE, EDGE, rasterize_ROI, classify_frames
+from .aggregation import step_distance, ZoneCumsum, calculate_speed, analysis_windows, frame_index
+from .bonsai_io import TRACK_COLUMNS, load_bonsai, write_bonsai
+from .results import ResultBuilder, write_excel, write_parquet
+from .streaming import CHUNK_SIZE, stream_zone_sums, read_bonsai_window
+from .events import ZoneEvents, zone_events
+from .timestamps import TimestampIndex, load_timestamps
+from .mazes import Maze, EPM_MAZE, OFT_MAZE, MAZES, analyze_track
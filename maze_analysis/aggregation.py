@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass aggregation of time spent and distance travelled in the zones by cumulative sums
+
+The zone label and the step distance of each frame are computed once per animal. The cumulative sums of
+frame counts and distances per zone then give the values of any time bin or window [a, b) (in frames)
+by one difference, without slicing and reclassifying the bonsai file again.
+
+Columns of the cumulative sums: zone 0, zone 1, ..., zone n_zone-1, OUTSIDE, total.
+
+Same conventions as the previous per-window loops:
+    - The time of a window counts the frames a .. b-1.
+    - The distance of a window sums the steps from frame k to k+1 for k = a .. b-3 (the last two frames of
+      the window are not used as start of a step) and each step belongs to the zone of frame k.
+    - Windows are clipped to the length of the bonsai file, as with bonsai_file.iloc[a:b].
+    - NaN steps (mouse not detected) are ignored as with np.nansum.
+    - The time spent is the number of frames divided by the frame rate, or with the durations of the frames of a
+      timestamp index (see timestamps.py) the sum of the real intervals of the frames.
+"""
+
+import numpy as np
+from .zones import OUTSIDE
+
+def step_distance(x, y, p):
+    """
+    Return the distance (cm) of the step from each frame to the next frame (number of frames - 1 steps).
+    p is the size of pixel in centimeter (see calculate_pixel).
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    return np.hypot(np.diff(x)*p, np.diff(y)*p)
+
+class ZoneCumsum(object):
+    """
+    Cumulative frame counts and distances per zone of one animal.
+    zone_labels: zone label of each frame (0 .. n_zone-1 or OUTSIDE, see classify_frames)
+    dist: step distance from each frame to the next frame (see step_distance)
+    durations: optional duration (s) of each frame (see TimestampIndex.durations)
+    """
+    def __init__(self, zone_labels, dist, n_zone, durations=None):
+        zone_labels = np.asarray(zone_labels)
+        n_frame = len(zone_labels)
+        self.n_frame = n_frame
+        self.n_zone = n_zone
+
+        # Steps start at frames 0 .. n_frame-2, the last frame has no step
+        step = np.zeros(n_frame)
+        step[:len(dist)] = np.nan_to_num(np.asarray(dist[:max(n_frame-1, 0)], dtype=np.float64), nan=0.0)
+
+        count_type = np.int32 if n_frame < 2**31 else np.int64
+        self.frame_cumsum = np.zeros((n_frame+1, n_zone+2), dtype=count_type)
+        self.dist_cumsum = np.zeros((n_frame+1, n_zone+2))
+        for i, label in enumerate(list(range(n_zone)) + [OUTSIDE]):
+            in_zone = zone_labels == label
+            np.cumsum(in_zone, out=self.frame_cumsum[1:, i])
+            np.cumsum(np.where(in_zone, step, 0.0), out=self.dist_cumsum[1:, i])
+        self.frame_cumsum[1:, -1] = np.arange(1, n_frame+1)
+        np.cumsum(step, out=self.dist_cumsum[1:, -1])
+
+        # Cumulative time spent per zone from the real durations of the frames
+        self.time_cumsum = None
+        if durations is not None:
+            durations = np.asarray(durations, dtype=np.float64)
+            if len(durations) != n_frame:
+                raise ValueError('%d frame durations for %d frames'%(len(durations), n_frame))
+            self.time_cumsum = np.zeros((n_frame+1, n_zone+2))
+            for i, label in enumerate(list(range(n_zone)) + [OUTSIDE]):
+                np.cumsum(np.where(zone_labels == label, durations, 0.0), out=self.time_cumsum[1:, i])
+            np.cumsum(durations, out=self.time_cumsum[1:, -1])
+
+    def clip(self, a, b):
+        """
+        Clip the window [a, b) to the frames of the bonsai file and return the start, end and end of the steps.
+        """
+        a = min(max(int(a), 0), self.n_frame)
+        b = min(max(int(b), a), self.n_frame)
+        return a, b, max(a, b-2)
+
+    def frames(self, a, b):
+        """
+        Return the number of frames per column (zones, OUTSIDE, total) in the window [a, b).
+        """
+        a, b, e = self.clip(a, b)
+        return self.frame_cumsum[b] - self.frame_cumsum[a]
+
+    def distance(self, a, b):
+        """
+        Return the distance travelled per column (zones, OUTSIDE, total) in the window [a, b).
+        """
+        a, b, e = self.clip(a, b)
+        return self.dist_cumsum[e] - self.dist_cumsum[a]
+
+    def seconds(self, a, b, frame_rate):
+        """
+        Return the time spent (s) per column (zones, OUTSIDE, total) in the window [a, b), from the frame durations if given.
+        """
+        if self.time_cumsum is None:
+            return self.frames(a, b) / frame_rate
+        a, b, e = self.clip(a, b)
+        return self.time_cumsum[b] - self.time_cumsum[a]
+
+    def windows(self, starts, ends):
+        """
+        Vectorized version of frames and distance for many windows. Return two arrays (windows x columns).
+        """
+        starts = np.clip(np.asarray(starts, dtype=np.int64), 0, self.n_frame)
+        ends = np.clip(np.asarray(ends, dtype=np.int64), starts, self.n_frame)
+        step_ends = np.maximum(starts, ends-2)
+        return (self.frame_cumsum[ends] - self.frame_cumsum[starts],
+                self.dist_cumsum[step_ends] - self.dist_cumsum[starts])
+
+def calculate_speed(dist, time):
+    """
+    Calculate the speed (cm/s) from distance (cm) and time (s). Return NaN if no time was spent in the region.
+    """
+    if np.ndim(dist) == 0 and np.ndim(time) == 0:
+        if time == 0:
+            return np.nan
+        return float(dist)/float(time)
+
+    # One value per animal (see analyze_cohort)
+    dist, time = np.broadcast_arrays(np.asarray(dist, dtype=np.float64), np.asarray(time, dtype=np.float64))
+    return np.divide(dist, time, out=np.full(dist.shape, np.nan), where=time != 0)
+
+def frame_index(frame_rate, seconds, timestamps=None):
+    """
+    Return the frame at the time (in second), int(frame_rate*seconds).
+    frame_rate and seconds can also be arrays with one value per animal, then an int64 array is returned.
+    With timestamps (TimestampIndex, or a list of TimestampIndex or None per animal), the frame is found in the
+    timestamps of the frames instead (see timestamps.py).
+    """
+    if timestamps is not None:
+        if hasattr(timestamps, 'frame_at'):
+            return timestamps.frame_at(seconds)
+        frame_rate, seconds = np.broadcast_arrays(np.asarray(frame_rate, dtype=np.float64), np.asarray(seconds))
+        return np.array([frame_index(frame_rate[k], seconds[k], index) for k, index in enumerate(timestamps)], dtype=np.int64)
+    if np.ndim(frame_rate) == 0 and np.ndim(seconds) == 0:
+        return int(frame_rate*seconds)
+    return (np.asarray(frame_rate, dtype=np.float64)*np.asarray(seconds)).astype(np.int64)
+
+def analysis_windows(frame_rate, time, total_exp_time_min, timebin_in_sec, timestamps=None):
+    """
+    Return the windows (a, b) in frames of the time bins and of the cumulative 5 minute windows from the starting time (in second)
+    """
+    windows = []
+    for i in range(int(total_exp_time_min*60/timebin_in_sec)):
+        windows.append((frame_index(frame_rate, time + timebin_in_sec*i, timestamps), frame_index(frame_rate, time + timebin_in_sec*(i+1), timestamps)))
+    for i in range(int(total_exp_time_min/5)):
+        windows.append((frame_index(frame_rate, time, timestamps), frame_index(frame_rate, time+(i+1)*300, timestamps)))
+    return windows
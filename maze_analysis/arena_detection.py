@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Automatic detection of the arena (OFT square, EPM cross) on the first frame of a video
+
+The arena is segmented from the floor by Otsu threshold (both polarities are tried), the outline of each large
+blob is simplified to a polygon (cv.approxPolyDP) and the polygon with the right number of corners and the best
+confidence is returned, in the same order as the corners are clicked:
+
+    OFT: 4 corners clockwise from the top left corner (see resize_center)
+    EPM: 12 corners counterclockwise from the top left corner of the upper closed arm (see define_ROI).
+         The closed arms are assumed to be the upper and lower arms, as for clicking.
+
+Confidence (0 .. 1) is the worst of these scores:
+    fill:   area of the blob / area of the polygon (1 for a perfect polygon)
+    shape:  OFT: shortest side / longest side (1 for a square)
+            EPM: shortest side / longest side of the center (1 for a square center)
+The caller falls back to clicking the corners when the confidence is below MIN_CONFIDENCE.
+"""
+
+import cv2 as cv
+import numpy as np
+
+# Number of corners of each arena
+N_CORNERS = {'EPM': 12, 'OFT': 4}
+
+# Confidence below which the corners must be clicked
+MIN_CONFIDENCE = 0.85
+
+# Minimum area of the arena as fraction of the frame
+MIN_AREA_FRACTION = 0.05
+
+def signed_area(polygon):
+    """
+    Return the signed area of a polygon in image coordinates (positive: clockwise on the screen)
+    """
+    x = polygon[:, 0]
+    y = polygon[:, 1]
+    return 0.5*(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+def reflex_corners(polygon):
+    """
+    Return a boolean array with True for the reflex (inner) corners of a polygon which is clockwise on the screen
+    """
+    previous = polygon - np.roll(polygon, 1, axis=0)
+    following = np.roll(polygon, -1, axis=0) - polygon
+    cross = previous[:, 0]*following[:, 1] - previous[:, 1]*following[:, 0]
+    return cross < 0
+
+def side_lengths(polygon):
+    """
+    Return the lengths of the sides of a polygon
+    """
+    return np.hypot(*(np.roll(polygon, -1, axis=0) - polygon).T)
+
+def order_OFT(polygon):
+    """
+    Order 4 corners clockwise on the screen from the top left corner
+    """
+    if signed_area(polygon) < 0:
+        polygon = polygon[::-1]
+    start = np.argmin(polygon[:, 0] + polygon[:, 1])
+    return np.roll(polygon, -start, axis=0)
+
+def order_EPM(polygon):
+    """
+    Order 12 corners counterclockwise on the screen from the top left corner of the upper closed arm.
+    Return None if the polygon is not a cross (4 reflex corners, every third corner).
+    """
+    if signed_area(polygon) < 0:
+        polygon = polygon[::-1]
+    reflex = np.flatnonzero(reflex_corners(polygon))
+    if len(reflex) != 4 or len(set(reflex % 3)) != 1:
+        return None
+
+    # Counterclockwise order, the top left corner of the center comes second
+    polygon = polygon[::-1]
+    reflex = len(polygon) - 1 - reflex
+    top_left = reflex[np.argmin(polygon[reflex, 0] + polygon[reflex, 1])]
+    return np.roll(polygon, 1 - top_left, axis=0)
+
+def score_polygon(test, contour, polygon):
+    """
+    Return the ordered corners and the confidence of a polygon, or (None, 0) if it has not the shape of the arena
+    """
+    polygon = polygon.reshape(-1, 2).astype(np.float64)
+    if len(polygon) != N_CORNERS[test]:
+        return None, 0.0
+    polygon_area = abs(signed_area(polygon))
+    if polygon_area == 0:
+        return None, 0.0
+    fill = cv.contourArea(contour)/polygon_area
+    fill_score = max(0.0, 1 - abs(1 - fill))
+
+    if test == 'OFT':
+        if not cv.isContourConvex(polygon.astype(np.float32)):
+            return None, 0.0
+        corners = order_OFT(polygon)
+        sides = side_lengths(corners)
+    else:
+        corners = order_EPM(polygon)
+        if corners is None:
+            return None, 0.0
+        sides = side_lengths(corners[[1, 4, 7, 10]])
+    shape_score = sides.min()/sides.max()
+    return corners, min(fill_score, shape_score)
+
+def detect_arena(test, img):
+    """
+    Detect the corners of the arena (test: EPM or OFT) on the first image of a video.
+    Return the corners as list of (x, y) in the order of clicking and the confidence (0 .. 1), or (None, 0) if nothing was found.
+    """
+    gray = img if img.ndim == 2 else cv.cvtColor(img, cv.COLOR_BGR2GRAY)
+    gray = cv.GaussianBlur(gray, (5, 5), 0)
+    frame_area = gray.shape[0]*gray.shape[1]
+
+    best_corners, best_confidence = None, 0.0
+    for threshold_type in [cv.THRESH_BINARY, cv.THRESH_BINARY_INV]:
+        _, mask = cv.threshold(gray, 0, 255, threshold_type + cv.THRESH_OTSU)
+        mask = cv.morphologyEx(mask, cv.MORPH_OPEN, np.ones((5, 5), np.uint8))
+        contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            area = cv.contourArea(contour)
+            if area < MIN_AREA_FRACTION*frame_area or area > 0.98*frame_area:
+                continue
+            perimeter = cv.arcLength(contour, True)
+            for epsilon in [0.005, 0.01, 0.02, 0.03]:
+                polygon = cv.approxPolyDP(contour, epsilon*perimeter, True)
+                corners, confidence = score_polygon(test, contour, polygon)
+                if confidence > best_confidence:
+                    best_corners, best_confidence = corners, confidence
+
+    if best_corners is None:
+        return None, 0.0
+    return [(float(x), float(y)) for x, y in best_corners], best_confidence
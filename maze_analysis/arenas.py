@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Several arenas (animals) recorded in one video
+
+Some rigs record four OFT boxes or two EPMs in one camera frame. In the excel file, the optional column 'Video' gives
+the name of the video of each animal (Rig1 for Rig1_OFT.avi and Rig1-OFT-bonsai.csv) and the optional column 'Arena'
+the number of its arena in the video (1, 2, ...). Animals without video name have their own video (F835_OFT.avi).
+
+The corners of each arena are clicked on the same first frame and saved for its animal, with its own pixel size.
+The bonsai file of a video with several arenas has the columns mouseX_1, mouseY_1, mouseX_2, mouseY_2, ... (one pair
+per arena). It is read once and split into the bonsai file of each animal (F835-OFT-bonsai.csv), so the analysis of
+each animal is the same as with one arena per video. The columns of each animal are also saved in its sidecar (see
+bonsai_io.py) from memory, so the analysis does not parse the csv files of the animals again.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from .bonsai_io import TRACK_COLUMNS, read_bonsai_header, read_bonsai_csv, write_bonsai, sidecar_path, file_key, save_sidecar
+
+def animal_videos(df):
+    """
+    Return {animal id: (video name, arena no)} in the order of the excel file (index: 'Animal no', columns 'Sex' and
+    optionally 'Video' and 'Arena'). Without video name, the video is named after the animal (arena 1).
+    """
+    videos = {}
+    for k, (no, sex) in enumerate(zip(df.index.to_list(), df['Sex'].to_list())):
+        anim_id = sex + str(no)
+        video = df['Video'].iloc[k] if 'Video' in df.columns else None
+        arena = df['Arena'].iloc[k] if 'Arena' in df.columns else None
+        if video is None or pd.isna(video) or str(video).strip() == '':
+            video = anim_id
+        arena = 1 if arena is None or pd.isna(arena) else int(arena)
+        videos[anim_id] = (str(video).strip(), arena)
+    return videos
+
+def video_arenas(videos):
+    """
+    Return {video name: [(arena no, animal id), ...] sorted by arena} from animal_videos
+    """
+    arenas = {}
+    for anim_id, (video, arena) in videos.items():
+        arenas.setdefault(video, []).append((arena, anim_id))
+    for video in arenas:
+        arenas[video].sort()
+        numbers = [arena for arena, anim_id in arenas[video]]
+        if len(set(numbers)) != len(numbers):
+            raise ValueError('Two animals have the same arena in the video %s: %s'%(video, arenas[video]))
+    return arenas
+
+def arena_columns(header, arena, n_arena, columns=TRACK_COLUMNS):
+    """
+    Return the columns of an arena in a multi-arena bonsai file (mouseX_2, ...). A video with one arena may also
+    have the columns without number.
+    """
+    names = ['%s_%d'%(column, arena) for column in columns]
+    if n_arena == 1 and not all(name in header for name in names):
+        return list(columns)
+    return names
+
+def split_bonsai(video_csv, arenas, test, columns=TRACK_COLUMNS):
+    """
+    Read the bonsai file of a video with several arenas once and write the bonsai file of each animal
+    (arenas: [(arena no, animal id), ...]). The files of the animals are only written again if the bonsai file of
+    the video is newer.
+    """
+    animal_csvs = ['%s-%s-bonsai.csv'%(anim_id, test) for arena, anim_id in arenas]
+    if all(os.path.exists(csv) and os.path.getmtime(csv) >= os.path.getmtime(video_csv) for csv in animal_csvs):
+        return
+    header = read_bonsai_header(video_csv)
+    arena_cols = [arena_columns(header, arena, len(arenas), columns) for arena, anim_id in arenas]
+    missing = [column for cols in arena_cols for column in cols if column not in header]
+    if missing:
+        raise ValueError('%s has no column %s'%(video_csv, ', '.join(missing)))
+    bonsai_file = read_bonsai_csv(video_csv, [column for cols in arena_cols for column in cols])
+    for csv, cols in zip(animal_csvs, arena_cols):
+        values = bonsai_file[cols].to_numpy(dtype=np.float64)
+        write_bonsai(values, csv, list(columns))
+
+        # The sidecar holds the values of the csv file (4 decimals), so load_bonsai does not parse it
+        save_sidecar(sidecar_path(csv), file_key(csv), pd.DataFrame(np.round(values, 4).astype(np.float32), columns=list(columns)))
+
+def split_videos(test, videos):
+    """
+    Split the bonsai file of every video with its own name (not the name of an animal) into the bonsai files of its animals
+    """
+    for video, arenas in video_arenas(videos).items():
+        video_csv = '%s-%s-bonsai.csv'%(video, test)
+        if video not in videos and os.path.exists(video_csv):
+            split_bonsai(video_csv, arenas, test)
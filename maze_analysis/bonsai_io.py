@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Fast loading of Bonsai csv files with a binary sidecar cache
+
+The Bonsai csv files (e.g. F835-EPM-bonsai.csv) are whitespace-delimited text with the columns
+mouseX, mouseY, mouseAngle, mouseMajorAxisLength, mouseMinorAxisLength and mouseArea.
+Only the needed columns are parsed (by the C parser of pandas) as float32.
+
+The parsed columns are saved next to the csv file as a binary sidecar (F835-EPM-bonsai.csv.npz) together
+with the size and the modification time of the csv file. As long as the csv file is not changed, the next
+run reads the sidecar and skips the text parsing. Other arrays derived from the csv file (e.g. the timestamp index)
+are cached in the same sidecar.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# Columns used by the analysis
+TRACK_COLUMNS = ('mouseX', 'mouseY')
+
+def sidecar_path(file_path):
+    """
+    Return the path of the binary sidecar of a Bonsai csv file
+    """
+    return file_path + '.npz'
+
+def file_key(file_path):
+    """
+    Return the key (size in bytes, modification time in ns) which identifies the version of a file
+    """
+    stat = os.stat(file_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def read_bonsai_csv(file_path, columns=TRACK_COLUMNS):
+    """
+    Parse the columns of a Bonsai csv file and return them as DataFrame of float32
+    """
+    return pd.read_csv(file_path, sep=r'\s+', engine='c', encoding='cp949', usecols=list(columns),
+                       dtype={column: np.float32 for column in columns})[list(columns)]
+
+def load_bonsai(file_path, columns=TRACK_COLUMNS, cache=True):
+    """
+    Load the columns of a Bonsai csv file as DataFrame of float32, from the sidecar if it is up to date.
+    With cache=True, the sidecar is (re)written after parsing the csv file.
+    """
+    columns = list(columns)
+    key = file_key(file_path)
+    cache_file = sidecar_path(file_path)
+
+    # Read the sidecar if it belongs to this version of the csv file and has all the columns
+    if cache and os.path.exists(cache_file):
+        try:
+            with np.load(cache_file, allow_pickle=False) as sidecar:
+                if np.array_equal(sidecar['__key__'], key) and all(column in sidecar.files for column in columns):
+                    return pd.DataFrame({column: sidecar[column] for column in columns})
+        except (OSError, ValueError, KeyError):
+            pass
+
+    bonsai_file = read_bonsai_csv(file_path, columns)
+    if cache:
+        save_sidecar(cache_file, key, bonsai_file)
+    return bonsai_file
+
+def sidecar_arrays(cache_file, key):
+    """
+    Return the arrays of the sidecar as {name: array} if it belongs to this version of the csv file, else {}
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with np.load(cache_file, allow_pickle=False) as sidecar:
+            if np.array_equal(sidecar['__key__'], key):
+                return {name: sidecar[name] for name in sidecar.files if name != '__key__'}
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+def write_sidecar(cache_file, key, arrays):
+    """
+    Write the arrays and the key of the csv file to the sidecar (atomically, via a temporary file)
+    """
+    temp_file = '%s.%s.tmp'%(cache_file, os.getpid())
+    try:
+        with open(temp_file, 'wb') as f:
+            np.savez(f, __key__=key, **arrays)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        # A read-only directory only disables the cache
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def save_sidecar(cache_file, key, bonsai_file):
+    """
+    Write the columns of bonsai_file and the key of the csv file to the sidecar. Other arrays of the same version
+    (e.g. the timestamps, see timestamps.py) are kept.
+    """
+    arrays = {name: values for name, values in sidecar_arrays(cache_file, key).items() if name.startswith('__')}
+    arrays.update({column: bonsai_file[column].to_numpy(dtype=np.float32) for column in bonsai_file.columns})
+    write_sidecar(cache_file, key, arrays)
+
+def load_sidecar_array(file_path, name):
+    """
+    Return the array saved as name in the sidecar of a Bonsai csv file, None if the sidecar is not up to date
+    """
+    return sidecar_arrays(sidecar_path(file_path), file_key(file_path)).get(name)
+
+def save_sidecar_array(file_path, name, values):
+    """
+    Save an array (e.g. the timestamps) as name in the sidecar of a Bonsai csv file, with the columns already saved
+    """
+    key = file_key(file_path)
+    arrays = sidecar_arrays(sidecar_path(file_path), key)
+    arrays[name] = np.asarray(values)
+    write_sidecar(sidecar_path(file_path), key, arrays)
+
+def read_bonsai_header(file_path):
+    """
+    Return the column names of a Bonsai csv file
+    """
+    with open(file_path, encoding='cp949') as f:
+        return f.readline().split()
+
+def write_bonsai(values, file_path, columns):
+    """
+    Write an array (frames x columns) in the format of the Bonsai csv file (header line, values separated by spaces) atomically
+    """
+    temp_file = '%s.%s.tmp'%(file_path, os.getpid())
+    with open(temp_file, 'w', encoding='cp949', newline='\n') as f:
+        pd.DataFrame(values, columns=list(columns)).to_csv(f, sep=' ', index=False, float_format='%.4f', na_rep='NaN', lineterminator='\n')
+    os.replace(temp_file, file_path)
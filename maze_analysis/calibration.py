@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent calibration store of a cohort: the coordinates clicked on the first frame of each video
+
+The calibration of a cohort is saved as json file (e.g. EPM_calibration.json) in the directory of the
+excel file. Each animal is keyed by its animal id and keeps the fingerprint of its video file, so that
+the coordinates are reused as long as the video is the same one that was calibrated:
+
+    {"F835": {"coords": [[x, y], ...],          clicked coordinates (12 for EPM, 4 for OFT)
+              "video_hash": "...",              fingerprint of the video file (see video_fingerprint)
+              "pixel_size": 0.12,               size of pixel in centimeter (see calculate_pixel)
+              "frame_size": [width, height],    frame size of the video
+              "confidence": 0.95},              only for automatically detected corners (see arena_detection)
+     ...}
+
+Validation:
+    - The number of clicks must be 12 for EPM and 4 for OFT (check_clicks).
+    - The pixel size of an animal which is far from the median of the cohort usually means a wrong click
+      (pixel_size_outliers).
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+
+# Number of corners to click for each test
+N_CLICKS = {'EPM': 12, 'OFT': 4}
+
+# Relative deviation of the pixel size from the cohort median which is flagged
+PIXEL_SIZE_TOLERANCE = 0.1
+
+def calibration_path(test, directory=''):
+    """
+    Return the path of the calibration file of a test (EPM or OFT)
+    """
+    return os.path.join(directory, '%s_calibration.json'%(test))
+
+def load_calibration(file_path):
+    """
+    Load the calibration file and return it as {animal id: {...}} (empty if the file does not exist yet)
+    """
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_calibration(file_path, calibration):
+    """
+    Save the calibration to the file (atomically, via a temporary file)
+    """
+    temp_file = '%s.%s.tmp'%(file_path, os.getpid())
+    # One line per animal, so that the file stays readable and easy to compare
+    lines = ['%s: %s'%(json.dumps(anim_id), json.dumps(calibration[anim_id], sort_keys=True)) for anim_id in sorted(calibration)]
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write('{\n' + ',\n'.join(lines) + '\n}\n')
+    os.replace(temp_file, file_path)
+
+def video_fingerprint(video_file, block_size=1<<20):
+    """
+    Return the fingerprint of a video file: sha1 of its size, its first and its last block (1 MB).
+    Reading the whole video would take longer than clicking it again.
+    """
+    size = os.path.getsize(video_file)
+    sha = hashlib.sha1(str(size).encode())
+    with open(video_file, 'rb') as f:
+        sha.update(f.read(block_size))
+        if size > block_size:
+            f.seek(max(size - block_size, block_size))
+            sha.update(f.read(block_size))
+    return sha.hexdigest()
+
+def check_clicks(test, coords):
+    """
+    Return True if the number of clicked coordinates is right for the test (12 for EPM, 4 for OFT)
+    """
+    return coords is not None and len(coords) == N_CLICKS[test]
+
+def get_coords(calibration, anim_id, video_hash=None):
+    """
+    Return the saved coordinates of an animal as list of (x, y).
+    Return None if the animal is not calibrated or if its video is not the one which was clicked (video_hash).
+    """
+    entry = calibration.get(anim_id)
+    if entry is None:
+        return None
+    if video_hash is not None and entry.get('video_hash') != video_hash:
+        return None
+    return [tuple(xy) for xy in entry['coords']]
+
+def set_calibration(calibration, anim_id, coords, video_hash, pixel_size, frame_size, confidence=None):
+    """
+    Save the coordinates, the fingerprint of the video, the pixel size and the frame size of an animal.
+    The confidence is only given for automatically detected coordinates (see detect_arena).
+    """
+    calibration[anim_id] = {'coords': [[float(x), float(y)] for x, y in coords],
+                            'video_hash': video_hash,
+                            'pixel_size': float(pixel_size),
+                            'frame_size': [int(frame_size[0]), int(frame_size[1])]}
+    if confidence is not None:
+        calibration[anim_id]['confidence'] = round(float(confidence), 3)
+
+def pixel_size_outliers(calibration, tolerance=PIXEL_SIZE_TOLERANCE):
+    """
+    Return {animal id: (pixel size, cohort median)} of the animals whose pixel size deviates more than tolerance from the median
+    """
+    pixel_size = {anim_id: entry['pixel_size'] for anim_id, entry in calibration.items() if 'pixel_size' in entry}
+    if len(pixel_size) < 3:
+        return {}
+    median = float(np.median(list(pixel_size.values())))
+    return {anim_id: (p, median) for anim_id, p in pixel_size.items() if abs(p - median) > tolerance*median}
+
+def report_calibration(test, calibration, anim_ids):
+    """
+    Print the problems of the calibration of the animals (missing coordinates, wrong click count, pixel size outliers) and return the number of problems
+    """
+    problems = 0
+    for anim_id in anim_ids:
+        coords = get_coords(calibration, anim_id)
+        if coords is None:
+            print('%s: no saved coordinates'%(anim_id))
+            problems += 1
+        elif not check_clicks(test, coords):
+            print('%s: %s clicks are saved, but %s corners of %s are needed'%(anim_id, len(coords), N_CLICKS[test], test))
+            problems += 1
+    outliers = pixel_size_outliers({anim_id: calibration[anim_id] for anim_id in anim_ids if anim_id in calibration})
+    for anim_id, (p, median) in outliers.items():
+        print('%s: pixel size %.4f cm is far from the median of the cohort (%.4f cm). Please check the clicked corners.'%(anim_id, p, median))
+    return problems + len(outliers)
+
+def auto_calibrate(test, calibration, anim_id, video_hash, img, frame_size, calculate_pixel):
+    """
+    Detect the corners of the arena on the first image and save them in the calibration if the detection is confident.
+    Return the coordinates or None if they must be clicked.
+    """
+    from .arena_detection import detect_arena, MIN_CONFIDENCE
+    coords, confidence = detect_arena(test, img)
+    if coords is None or confidence < MIN_CONFIDENCE:
+        print('%s: the %s was not detected reliably (confidence %.2f).'%(anim_id, test, confidence))
+        return None
+    set_calibration(calibration, anim_id, coords, video_hash, calculate_pixel(coords), frame_size, confidence)
+    return coords
+
+def calibrate(test, calibration, anim_id, video_file, img, frame_size, click_coords, calculate_pixel, auto=False):
+    """
+    Return the saved coordinates of an animal if its video was already calibrated. Otherwise, detect the corners
+    automatically (auto=True) or pop the first image up (click_coords) until the number of clicks is right,
+    and save the new coordinates in the calibration. Clicking is the fallback of an unreliable detection.
+    """
+    video_hash = video_fingerprint(video_file)
+    coords = get_coords(calibration, anim_id, video_hash)
+    if check_clicks(test, coords):
+        return coords
+    if auto:
+        coords = auto_calibrate(test, calibration, anim_id, video_hash, img, frame_size, calculate_pixel)
+        if coords is not None:
+            return coords
+
+    coords = click_coords(anim_id, img)
+    while not check_clicks(test, coords):
+        print('%s clicks are saved, but %s corners of %s are needed. Please click again.'%(len(coords), N_CLICKS[test], test))
+        coords = click_coords(anim_id, img)
+    set_calibration(calibration, anim_id, coords, video_hash, calculate_pixel(coords), frame_size)
+    return coords
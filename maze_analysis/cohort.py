@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Analysis of a whole cohort at once with segment reductions
+
+The positions of all animals are concatenated into one contiguous float32 array (frames x 2) with the offsets of
+each animal, like a ragged array. The zone labels and the step distances of all frames are computed in one pass,
+and the frames and distances of all windows of all animals are summed by one bincount over the segments between the
+window edges. So the time bins and animals are not looped over in Python any more.
+
+CohortSums answers frames(a, b) and distance(a, b) with a and b as arrays (one window per animal) and returns
+(columns x animals), so calculate_time and calculate_distance of the scripts give one value per animal.
+Same conventions as ZoneCumsum (clipping, last two frames without step, NaN steps ignored). The zone labels of the
+cohort are also run-length encoded at once into one ZoneEvents with the same offsets (see events.py).
+"""
+
+import numpy as np
+from .zones import OUTSIDE, EDGE, rasterize_ROI
+from .bonsai_io import TRACK_COLUMNS, load_bonsai
+from .prefetch import prefetch
+from .events import zone_events
+
+class CohortTracks(object):
+    """
+    Positions of all animals in one float32 array (frames x 2) and the offsets of each animal (animals + 1)
+    """
+    def __init__(self, xy, offsets):
+        self.xy = xy
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets)
+        self.n_animal = len(self.lengths)
+
+    def animal_of_frames(self):
+        """
+        Return the index of the animal of each frame
+        """
+        return np.repeat(np.arange(self.n_animal), self.lengths)
+
+def load_cohort(bonsai_csvs, columns=TRACK_COLUMNS):
+    """
+    Load the bonsai files of all animals (from their sidecars if up to date) into one CohortTracks.
+    The next bonsai files are read while the current one is parsed (see prefetch.py).
+    """
+    tracks = [track for bonsai_csv, track in prefetch(lambda bonsai_csv: load_bonsai(bonsai_csv, columns), bonsai_csvs)]
+    offsets = np.zeros(len(tracks)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(track) for track in tracks])
+    xy = np.empty((offsets[-1], len(columns)), dtype=np.float32)
+    for k, track in enumerate(tracks):
+        for j, column in enumerate(columns):
+            xy[offsets[k]:offsets[k+1], j] = track[column].to_numpy()
+    return CohortTracks(xy, offsets)
+
+def cohort_labels(cohort, roi_lists):
+    """
+    Return the zone label of each frame of the cohort (roi_lists: list of ROIs of each animal, see classify_frames).
+    The ROIs of each animal are rasterized only in their bounding box, and the label rasters of all animals are
+    stacked, so that all frames are looked up at once. Frames in EDGE pixels are classified exactly per animal.
+    """
+    # Bounding box of the ROIs of each animal (1 pixel margin), all positions outside are OUTSIDE
+    boxes = []
+    for rois in roi_lists:
+        vertices = np.concatenate([roi.vertices for roi in rois])
+        x_0, y_0 = np.floor(vertices.min(axis=0)).astype(int) - 1
+        x_1, y_1 = np.ceil(vertices.max(axis=0)).astype(int) + 2
+        boxes.append((x_0, y_0, x_1 - x_0, y_1 - y_0))
+    boxes = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+    rasters = np.full((cohort.n_animal, boxes[:, 3].max(initial=1), boxes[:, 2].max(initial=1)), OUTSIDE, dtype=np.uint8)
+    for k, (rois, (x_0, y_0, width, height)) in enumerate(zip(roi_lists, boxes)):
+        rasters[k, :height, :width] = rasterize_ROI(rois, width, height, x_0, y_0)
+
+    # Look up the pixel of each frame in the raster of its animal (float32 positions round to the same pixel)
+    n_row, n_col = rasters.shape[1:]
+    col = np.rint(cohort.xy[:, 0]) - np.repeat(boxes[:, 0].astype(np.float32), cohort.lengths)
+    row = np.rint(cohort.xy[:, 1]) - np.repeat(boxes[:, 1].astype(np.float32), cohort.lengths)
+    in_box = (col >= 0) & (col < np.repeat(boxes[:, 2], cohort.lengths)) & (row >= 0) & (row < np.repeat(boxes[:, 3], cohort.lengths))
+    index = np.flatnonzero(in_box)
+    pixel = (cohort.animal_of_frames()[index]*n_row + row[index].astype(np.int64))*n_col + col[index].astype(np.int64)
+    labels = np.full(len(cohort.xy), OUTSIDE, dtype=np.uint8)
+    labels[index] = rasters.ravel()[pixel]
+
+    # Exact test for the frames on the edges of ROIs, with the precedence of the ROIs
+    edge = np.flatnonzero(labels == EDGE)
+    labels[edge] = OUTSIDE
+    bounds = np.searchsorted(edge, cohort.offsets)
+    for k in np.flatnonzero(np.diff(bounds)):
+        index = edge[bounds[k]:bounds[k+1]]
+        for i, roi in enumerate(roi_lists[k]):
+            if len(index) == 0:
+                break
+            inside = roi.contains_points(cohort.xy[index].astype(np.float64))
+            labels[index[inside]] = i
+            index = index[~inside]
+    return labels
+
+def cohort_steps(cohort, pixel_sizes):
+    """
+    Return the step distance (cm) from each frame to the next frame of the same animal (0 for the last frame of each
+    animal and NaN steps). pixel_sizes: size of pixel in centimeter of each animal (see calculate_pixel).
+    """
+    p = np.repeat(np.asarray(pixel_sizes, dtype=np.float64), cohort.lengths)[:-1]
+    step = np.zeros(len(cohort.xy))
+    if len(step) > 1:
+        # Same as step_distance: the differences of the float32 positions are taken in float64
+        dx = np.subtract(cohort.xy[1:, 0], cohort.xy[:-1, 0], dtype=np.float64)
+        dy = np.subtract(cohort.xy[1:, 1], cohort.xy[:-1, 1], dtype=np.float64)
+        np.hypot(np.multiply(dx, p, out=dx), np.multiply(dy, p, out=dy), out=step[:-1])
+    step[cohort.offsets[1:] - 1] = 0
+    return np.nan_to_num(step, nan=0.0, copy=False)
+
+class CohortSums(object):
+    """
+    Frame counts and distances per zone (columns: zones, OUTSIDE, total) of all windows of all animals.
+    windows: list of (a, b) where a and b are arrays with the window of each animal in frames (see analysis_windows)
+    durations: optional duration (s) of each frame of the cohort (see timestamps.py)
+    """
+    def __init__(self, cohort, labels, steps, n_zone, windows, durations=None):
+        self.offsets = cohort.offsets
+        self.lengths = cohort.lengths
+        self.n_zone = n_zone
+        n_column = n_zone + 2
+
+        # Edges of all windows in the concatenated frames (start, end and end of the steps)
+        edges = [np.array([0, len(labels)], dtype=np.int64)]
+        for a, b in windows:
+            edges.extend(self.clip(a, b))
+        self.edges = np.unique(np.concatenate(edges))
+
+        # Sum the frames and the steps per zone in each segment between two edges, one bincount for the cohort
+        segment = np.repeat(np.arange(len(self.edges)-1), np.diff(self.edges))
+        columns = np.where(labels < n_zone, labels, n_zone).astype(np.int64)
+        index = segment*n_column + columns
+        n_bins = (len(self.edges)-1)*n_column
+        frame_sums = np.bincount(index, minlength=n_bins).reshape(-1, n_column)
+        dist_sums = np.bincount(index, weights=steps, minlength=n_bins).reshape(-1, n_column)
+        frame_sums[:, -1] = np.diff(self.edges)
+        dist_sums[:, -1] = np.bincount(segment, weights=steps, minlength=len(self.edges)-1)
+
+        # Cumulative sums at the edges
+        self.frame_at = np.zeros((len(self.edges), n_column), dtype=np.int64)
+        self.dist_at = np.zeros((len(self.edges), n_column))
+        np.cumsum(frame_sums, axis=0, out=self.frame_at[1:])
+        np.cumsum(dist_sums, axis=0, out=self.dist_at[1:])
+
+        # Time spent from the real durations of the frames
+        self.time_at = None
+        if durations is not None:
+            time_sums = np.bincount(index, weights=durations, minlength=n_bins).reshape(-1, n_column)
+            time_sums[:, -1] = np.bincount(segment, weights=durations, minlength=len(self.edges)-1)
+            self.time_at = np.zeros((len(self.edges), n_column))
+            np.cumsum(time_sums, axis=0, out=self.time_at[1:])
+
+    def clip(self, a, b):
+        """
+        Clip the windows of all animals to their frames and return the start, end and end of the steps in the
+        concatenated frames
+        """
+        a = np.minimum(np.maximum(np.asarray(a, dtype=np.int64), 0), self.lengths)
+        b = np.minimum(np.maximum(np.asarray(b, dtype=np.int64), a), self.lengths)
+        return self.offsets[:-1] + a, self.offsets[:-1] + b, self.offsets[:-1] + np.maximum(a, b-2)
+
+    def frames(self, a, b):
+        """
+        Return the number of frames per column (zones, OUTSIDE, total) in the window [a, b) of each animal (columns x animals)
+        """
+        a, b, e = self.clip(a, b)
+        return (self.frame_at[np.searchsorted(self.edges, b)] - self.frame_at[np.searchsorted(self.edges, a)]).T
+
+    def distance(self, a, b):
+        """
+        Return the distance travelled per column (zones, OUTSIDE, total) in the window [a, b) of each animal (columns x animals)
+        """
+        a, b, e = self.clip(a, b)
+        return (self.dist_at[np.searchsorted(self.edges, e)] - self.dist_at[np.searchsorted(self.edges, a)]).T
+
+    def seconds(self, a, b, frame_rate):
+        """
+        Return the time spent (s) per column (zones, OUTSIDE, total) in the window [a, b) of each animal (columns x animals)
+        """
+        if self.time_at is None:
+            return self.frames(a, b) / frame_rate
+        a, b, e = self.clip(a, b)
+        return (self.time_at[np.searchsorted(self.edges, b)] - self.time_at[np.searchsorted(self.edges, a)]).T
+
+def cohort_durations(cohort, timestamps):
+    """
+    Return the duration (s) of each frame of the cohort from the TimestampIndex of each animal (see timestamps.py)
+    """
+    durations = np.empty(len(cohort.xy))
+    for k, index in enumerate(timestamps):
+        if index.n_frame != cohort.lengths[k]:
+            raise ValueError('%d timestamps for %d frames of animal %d'%(index.n_frame, cohort.lengths[k], k))
+        durations[cohort.offsets[k]:cohort.offsets[k+1]] = index.durations()
+    return durations
+
+def cohort_sums(bonsai_csvs, roi_lists, pixel_sizes, n_zone, windows, carry_outside=False, timestamps=None, cohort=None):
+    """
+    Load the bonsai files of the cohort and return the CohortSums of the windows and the ZoneEvents of the cohort.
+    With timestamps (TimestampIndex of each animal), the time spent is the sum of the real durations of the frames.
+    With cohort (CohortTracks of the animals, e.g. from the memory-mapped store, see store.py), the bonsai files are not read.
+    """
+    if cohort is None:
+        cohort = load_cohort(bonsai_csvs)
+    labels = cohort_labels(cohort, roi_lists)
+    durations = None if timestamps is None else cohort_durations(cohort, timestamps)
+    events = zone_events(labels, cohort.xy[:, 0], cohort.xy[:, 1], carry_outside, cohort.offsets, durations)
+    return CohortSums(cohort, labels, cohort_steps(cohort, pixel_sizes), n_zone, windows, durations), events
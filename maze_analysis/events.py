@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Zone events (entries, latencies, bouts and transitions) from the run-length encoding of the zone labels
+
+The zone labels of all frames (see classify_frames) are run-length encoded once: a run is a sequence of frames in
+the same zone. All events of any window [a, b) (in frames) are then found by binary searches in the runs, without
+going through the frames again:
+
+    Entries:    number of runs of a region which start in the window (the first run of the recording is no entry)
+    Latency:    time (s) from the start of the window to the first frame in the region (0 if the mouse is already
+                in it, NaN if it never goes in)
+    Bouts:      number of runs of a region which overlap the window
+    BoutTime:   mean duration (s) of these bouts, clipped to the window
+    Trans:      number of transitions from one state to another in the window (states: zones which do not overlap)
+
+A region is a set of zone labels (e.g. the open arms are the left and the right open arm), so a run of a region
+can contain several runs of zones. Frames where the mouse was not detected (NaN position) continue the zone of the
+previous frame, so that a lost frame in the middle of an arm is not counted as exit and entry. With carry_outside,
+the frames outside of all zones (OUTSIDE) also continue the previous zone (e.g. EPM, where OUTSIDE is off the maze).
+
+The runs of several animals can be stored together with the offsets of each animal (see cohort.py), then a and b
+are arrays with the window of each animal and each event is an array with one value per animal.
+With the durations of the frames of a timestamp index (see timestamps.py), the latencies and bout durations are
+measured with the real times of the frames instead of the frame rate.
+"""
+
+import numpy as np
+from .zones import OUTSIDE
+
+def fill_invalid(zone_labels, valid, offsets):
+    """
+    Return the zone labels where the invalid frames have the label of the previous valid frame of the same animal
+    """
+    n_frame = len(zone_labels)
+    index = np.where(valid, np.arange(n_frame), 0)
+    index[offsets[:-1][offsets[:-1] < n_frame]] = offsets[:-1][offsets[:-1] < n_frame]
+    np.maximum.accumulate(index, out=index)
+    return zone_labels[index]
+
+def event_valid(zone_labels, x, y, carry_outside=False):
+    """
+    Return the frames whose zone is used for the events (position detected, and not OUTSIDE with carry_outside)
+    """
+    valid = np.isfinite(np.asarray(x, dtype=np.float64)) & np.isfinite(np.asarray(y, dtype=np.float64))
+    if carry_outside:
+        valid &= np.asarray(zone_labels) != OUTSIDE
+    return valid
+
+def run_lengths(zone_labels, offsets):
+    """
+    Return the first frame and the zone label of each run of equal labels. A new run starts at each offset (animal).
+    """
+    zone_labels = np.asarray(zone_labels)
+    change = np.flatnonzero(zone_labels[1:] != zone_labels[:-1]) + 1
+    starts = np.union1d(change, offsets[:-1][offsets[:-1] < len(zone_labels)]).astype(np.int64)
+    return starts, zone_labels[starts]
+
+class ZoneEvents(object):
+    """
+    Runs of the zone labels of one or several animals (offsets: first frame of each animal and number of frames)
+    durations: optional duration (s) of each frame
+    """
+    def __init__(self, starts, values, offsets, durations=None):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.lengths = np.diff(self.offsets)
+        self.ends = np.append(self.starts[1:], self.offsets[-1])
+
+        # The first run of each animal is no transition
+        self.first = np.isin(self.starts, self.offsets[:-1])
+        self.regions = {}
+        self.transition_counts = {}
+
+        # Time (s) at the start of each frame, from the durations of the frames
+        self.elapsed = None
+        if durations is not None:
+            self.elapsed = np.zeros(self.offsets[-1]+1)
+            np.cumsum(np.asarray(durations, dtype=np.float64), out=self.elapsed[1:])
+
+    def clip(self, a, b):
+        """
+        Clip the windows of all animals to their frames and return the start and the end in the frames of all animals
+        """
+        a = np.minimum(np.maximum(np.atleast_1d(np.asarray(a, dtype=np.int64)), 0), self.lengths)
+        b = np.minimum(np.maximum(np.atleast_1d(np.asarray(b, dtype=np.int64)), a), self.lengths)
+        return self.offsets[:-1] + a, self.offsets[:-1] + b
+
+    def result(self, values, a):
+        # One animal with scalar window: scalar result
+        return values[0] if np.ndim(a) == 0 else values
+
+    def region(self, labels):
+        """
+        Return the start, the end and the first flag of the runs of the region (set of zone labels)
+        """
+        key = tuple(sorted(labels))
+        if key not in self.regions:
+            in_region = np.isin(self.values, key)
+            new = self.first | np.append(True, in_region[1:] != in_region[:-1])
+            group = np.flatnonzero(new)
+            ends = np.append(self.starts[group[1:]], self.offsets[-1])
+            select = in_region[group]
+            self.regions[key] = (self.starts[group][select], ends[select], self.first[group][select])
+        return self.regions[key]
+
+    def entries(self, labels, a, b):
+        """
+        Return the number of entries into the region in the window [a, b)
+        """
+        A, B = self.clip(a, b)
+        starts, ends, first = self.region(labels)
+        starts = starts[~first]
+        return self.result(np.searchsorted(starts, B) - np.searchsorted(starts, A), a)
+
+    def bouts(self, labels, a, b):
+        """
+        Return the number of bouts in the region which overlap the window [a, b)
+        """
+        A, B = self.clip(a, b)
+        starts, ends, first = self.region(labels)
+        n = np.searchsorted(starts, B) - np.searchsorted(ends, A, side='right')
+        return self.result(np.where(B > A, n, 0), a)
+
+    def dwell(self, labels, a, b, clock=None):
+        """
+        Return the number of frames in the region in the window [a, b) (invalid frames count for the previous zone).
+        With clock (time at the start of each frame and at the end), the time in the region instead.
+        """
+        A, B = self.clip(a, b)
+        starts, ends, first = self.region(labels)
+        if clock is None:
+            clock = np.arange(self.offsets[-1]+1)
+        cumulative = np.append(0, np.cumsum(clock[ends] - clock[starts]))
+
+        def before(position):
+            i = np.maximum(np.searchsorted(starts, position, side='right') - 1, 0)
+            if len(starts) == 0:
+                return np.zeros(len(position), dtype=cumulative.dtype)
+            inside = clock[np.clip(position, starts[i], ends[i])] - clock[starts[i]]
+            return np.where(position > starts[0], cumulative[i] + inside, 0)
+        return self.result(before(B) - before(A), a)
+
+    def bout_time(self, labels, a, b, frame_rate):
+        """
+        Return the mean duration (s) of the bouts in the region in the window [a, b), NaN without bout
+        """
+        bouts = np.atleast_1d(self.bouts(labels, a, b))
+        if self.elapsed is None:
+            dwell = np.atleast_1d(self.dwell(labels, a, b)) / np.asarray(frame_rate, dtype=np.float64)
+        else:
+            dwell = np.atleast_1d(self.dwell(labels, a, b, self.elapsed))
+        mean = np.divide(dwell, bouts, out=np.full(bouts.shape, np.nan), where=bouts > 0)
+        return self.result(mean, a)
+
+    def latency(self, labels, a, b, frame_rate):
+        """
+        Return the time (s) from the start of the window [a, b) to the first frame in the region, NaN if the mouse does not go in
+        """
+        A, B = self.clip(a, b)
+        starts, ends, first = self.region(labels)
+        i = np.searchsorted(ends, A, side='right')
+        found = i < len(starts)
+        first_frame = np.maximum(starts[np.minimum(i, len(starts)-1)], A) if len(starts) else A
+        found &= first_frame < B
+        if self.elapsed is None:
+            latency = np.where(found, (first_frame - A)/np.asarray(frame_rate, dtype=np.float64), np.nan)
+        else:
+            latency = np.where(found, self.elapsed[first_frame] - self.elapsed[A], np.nan)
+        return self.result(latency, a)
+
+    def transition_sums(self, states):
+        """
+        Return the first frame of each transition between the states and the cumulative number of transitions of each
+        pair of states (from state x number of states + to state) before each transition
+        """
+        key = tuple(tuple(sorted(labels)) for labels in states)
+        if key not in self.transition_counts:
+            state_of = np.full(256, -1, dtype=np.int64)
+            for k, labels in enumerate(states):
+                state_of[list(labels)] = k
+            state = state_of[self.values]
+            animal = np.searchsorted(self.offsets, self.starts, side='right') - 1
+            keep = state >= 0
+            starts, state, animal = self.starts[keep], state[keep], animal[keep]
+
+            # Transitions: a new state of the same animal
+            change = np.flatnonzero((state[1:] != state[:-1]) & (animal[1:] == animal[:-1])) + 1
+            pair = state[change-1]*len(states) + state[change]
+            counts = np.zeros((len(change)+1, len(states)**2), dtype=np.int64)
+            for k in range(len(states)**2):
+                np.cumsum(pair == k, out=counts[1:, k])
+            self.transition_counts[key] = (starts[change], counts)
+        return self.transition_counts[key]
+
+    def transitions(self, states, a, b):
+        """
+        Return the number of transitions between the states (list of sets of zone labels which do not overlap) in the
+        window [a, b) as matrix (from state x to state), for each animal. Runs in no state are skipped.
+        """
+        A, B = self.clip(a, b)
+        frames, counts = self.transition_sums(states)
+        matrix = (counts[np.searchsorted(frames, B)] - counts[np.searchsorted(frames, A)]).reshape(-1, len(states), len(states))
+        return matrix[0] if np.ndim(a) == 0 else matrix
+
+def zone_events(zone_labels, x, y, carry_outside=False, offsets=None, durations=None):
+    """
+    Return the ZoneEvents of the zone labels and positions of one animal (or of several animals with offsets)
+    """
+    zone_labels = np.asarray(zone_labels)
+    offsets = np.array([0, len(zone_labels)], dtype=np.int64) if offsets is None else np.asarray(offsets, dtype=np.int64)
+    filled = fill_invalid(zone_labels, event_valid(zone_labels, x, y, carry_outside), offsets)
+    starts, values = run_lengths(filled, offsets)
+    return ZoneEvents(starts, values, offsets, durations)
+
+class RunBuilder(object):
+    """
+    Run-length encoding of the zone labels of one animal which come in chunks (see StreamingZoneSums). All runs are
+    kept, so that the events of any window can be asked at the end: memory grows with the number of changes of zone.
+    """
+    def __init__(self, carry_outside=False):
+        self.carry_outside = carry_outside
+        self.starts = []
+        self.values = []
+        self.n_frame = 0
+        self.last = None
+
+    def add(self, zone_labels, x, y):
+        zone_labels = np.asarray(zone_labels)
+        m = len(zone_labels)
+        if m == 0:
+            return
+        valid = event_valid(zone_labels, x, y, self.carry_outside)
+
+        # The label of the last frame of the previous chunk continues into this chunk
+        if self.last is not None:
+            filled = fill_invalid(np.append(self.last, zone_labels), np.append(True, valid), np.array([0, m+1]))[1:]
+            previous = self.last
+        else:
+            filled = fill_invalid(zone_labels, valid, np.array([0, m]))
+            previous = None
+        starts, values = run_lengths(filled, np.array([0, m]))
+        if previous is not None and values[0] == previous:
+            starts, values = starts[1:], values[1:]
+        self.starts.append(starts + self.n_frame)
+        self.values.append(values)
+        self.n_frame += m
+        self.last = filled[-1]
+
+    def events(self):
+        """
+        Return the ZoneEvents of all chunks
+        """
+        starts = np.concatenate(self.starts) if self.starts else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(self.values) if self.values else np.zeros(0, dtype=np.uint8)
+        return ZoneEvents(starts, values, np.array([0, self.n_frame]))
+
+def event_columns(period, regions, states):
+    """
+    Return the column names of the events in the period (regions and states: list of (name, set of zone labels))
+    """
+    columns = []
+    for metric in ['Entries', 'Latency', 'Bouts', 'BoutTime']:
+        columns = columns + ['%s_%s_%s'%(metric, name, period) for name, labels in regions]
+    columns = columns + ['Trans_%s_to_%s_%s'%(name_1, name_2, period) for name_1, labels_1 in states for name_2, labels_2 in states if name_1 != name_2]
+    return columns
+
+def add_events(results, zone_events, a, b, frame_rate, period, regions, states):
+    """
+    Add the events of the window [a, b) to results as {column name: value} (see event_columns)
+    """
+    for name, labels in regions:
+        results['Entries_%s_%s'%(name, period)] = zone_events.entries(labels, a, b)
+        results['Latency_%s_%s'%(name, period)] = zone_events.latency(labels, a, b, frame_rate)
+        results['Bouts_%s_%s'%(name, period)] = zone_events.bouts(labels, a, b)
+        results['BoutTime_%s_%s'%(name, period)] = zone_events.bout_time(labels, a, b, frame_rate)
+    matrix = zone_events.transitions([labels for name, labels in states], a, b)
+    for i, (name_1, labels_1) in enumerate(states):
+        for j, (name_2, labels_2) in enumerate(states):
+            if i != j:
+                results['Trans_%s_to_%s_%s'%(name_1, name_2, period)] = matrix[..., i, j]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Occupancy heatmaps of the animals and of the groups from cached 2D histograms
+
+The positions of each animal are mapped from the pixels of its video to the arena normalized to the unit square by
+the perspective transform of its calibration coordinates (OFT: the 4 corners, EPM: the ends of the 4 arms), so the
+maps of all animals have the same grid whatever the camera. The time spent (s) in each cell of the grid is summed
+for each 5 minute block from the starting time in one bincount.
+
+The grids of each animal (5 minute blocks x bins x bins, float32) are cached in the directory occupancy as small
+npz files with the key of their inputs. The cumulative 05, 10, 15 and 20 minute maps are the cumulative sums of the
+blocks and the group maps are the means over the animals of each group ('Group' column of the excel file), so they
+are computed from the cached grids without reading the bonsai files again.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from .bonsai_io import load_bonsai, file_key
+from .aggregation import frame_index
+from .timestamps import frame_durations
+
+# Number of cells of the grid along each side of the normalized arena
+HEATMAP_BINS = 50
+
+# Directory of the cached grids of the animals
+OCCUPANCY_DIRECTORY = 'occupancy'
+
+# Change this when the grids change, so that the old grids are not reused
+OCCUPANCY_VERSION = 2
+
+def arena_points(test, coords):
+    """
+    Return the calibration points of the arena and their position in the normalized arena (unit square)
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    if test == 'OFT':
+        return coords[:4], np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float64)
+
+    # EPM: the middle of the end of each arm (closed arm up, open arm left, closed arm down, open arm right) on the axes of a plus
+    ends = [(coords[11] + coords[0])/2, (coords[2] + coords[3])/2, (coords[5] + coords[6])/2, (coords[8] + coords[9])/2]
+    return np.array(ends), np.array([[0.5, 0], [0, 0.5], [0.5, 1], [1, 0.5]], dtype=np.float64)
+
+def perspective_transform(src, dst):
+    """
+    Return the 3x3 perspective transform which maps the 4 points src to the 4 points dst
+    """
+    A = np.zeros((8, 8))
+    rhs = np.zeros(8)
+    for i, ((x, y), (u, v)) in enumerate(zip(src, dst)):
+        A[2*i] = [x, y, 1, 0, 0, 0, -u*x, -u*y]
+        A[2*i+1] = [0, 0, 0, x, y, 1, -v*x, -v*y]
+        rhs[2*i] = u
+        rhs[2*i+1] = v
+    return np.append(np.linalg.solve(A, rhs), 1).reshape(3, 3)
+
+def normalize_positions(transform, x, y):
+    """
+    Return the positions (pixels) in the normalized arena
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    w = transform[2, 0]*x + transform[2, 1]*y + transform[2, 2]
+    return (transform[0, 0]*x + transform[0, 1]*y + transform[0, 2])/w, (transform[1, 0]*x + transform[1, 1]*y + transform[1, 2])/w
+
+def occupancy_grids(x, y, transform, block_edges, weights, bins=HEATMAP_BINS):
+    """
+    Return the time spent in each cell of the grid of the normalized arena for each block [edge k, edge k+1) of
+    frames (blocks x bins x bins, rows: y). weights: duration (s) of each frame. Frames outside of the arena or
+    without position are not counted.
+    """
+    u, v = normalize_positions(transform, x, y)
+    n_block = len(block_edges) - 1
+    with np.errstate(invalid='ignore'):
+        col = np.floor(u*bins)
+        row = np.floor(v*bins)
+        inside = (col >= 0) & (col < bins) & (row >= 0) & (row < bins)
+
+    # Block of each frame, the frames after the last block are not counted
+    block = np.searchsorted(block_edges, np.arange(len(u)), side='right') - 1
+    inside &= (block >= 0) & (block < n_block)
+    index = (block[inside]*bins + row[inside].astype(np.int64))*bins + col[inside].astype(np.int64)
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), u.shape)[inside]
+    return np.bincount(index, weights=weights, minlength=n_block*bins*bins).reshape(n_block, bins, bins).astype(np.float32)
+
+def occupancy_key(test, bonsai_csv, coords, frame_rate, time, total_exp_time_min, bins, timestamps=False):
+    """
+    Return the key of the grids of an animal: the sha1 of the inputs (the bonsai file by its size and modification time)
+    """
+    inputs = {'version': OCCUPANCY_VERSION,
+              'test': test,
+              'bonsai_csv': [int(value) for value in file_key(bonsai_csv)],
+              'coords': [[float(x), float(y)] for x, y in coords],
+              'frame_rate': float(frame_rate),
+              'starting_time': float(time),
+              'session': total_exp_time_min,
+              'bins': bins,
+              'timestamps': bool(timestamps)}
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def animal_occupancy(test, anim_id, coords, frame_rate, time, total_exp_time_min, bins=HEATMAP_BINS, timestamps=None, directory=OCCUPANCY_DIRECTORY):
+    """
+    Return the grids of the 5 minute blocks of an animal (blocks x bins x bins), from the cache if its inputs did not change
+    """
+    bonsai_csv = '%s-%s-bonsai.csv'%(anim_id, test)
+    key = occupancy_key(test, bonsai_csv, coords, frame_rate, time, total_exp_time_min, bins, timestamps is not None)
+    cache_file = os.path.join(directory, '%s-%s.npz'%(anim_id, test))
+    if os.path.exists(cache_file):
+        try:
+            with np.load(cache_file, allow_pickle=False) as cached:
+                if str(cached['key']) == key:
+                    return cached['grids']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    bonsai_file = load_bonsai(bonsai_csv)
+    block_edges = [frame_index(frame_rate, time + 300*i, timestamps) for i in range(int(total_exp_time_min/5) + 1)]
+    weights = 1/frame_rate if timestamps is None else frame_durations(timestamps, len(bonsai_file), bonsai_csv)
+    grids = occupancy_grids(bonsai_file['mouseX'], bonsai_file['mouseY'], perspective_transform(*arena_points(test, coords)), block_edges, weights, bins)
+
+    os.makedirs(directory, exist_ok=True)
+    temp_file = '%s.%s.tmp'%(cache_file, os.getpid())
+    with open(temp_file, 'wb') as f:
+        np.savez(f, key=np.array(key), grids=grids)
+    os.replace(temp_file, cache_file)
+    return grids
+
+def cumulative_maps(grids):
+    """
+    Return the maps of 05, 10, 15, ... minutes from the grids of the 5 minute blocks
+    """
+    return np.cumsum(grids, axis=0, dtype=np.float64)
+
+def group_maps(grids, groups):
+    """
+    Return {group: mean cumulative maps of its animals (periods x bins x bins)} from the grids of each animal
+    """
+    maps = {}
+    for group in dict.fromkeys(groups):
+        maps[group] = np.mean([cumulative_maps(animal_grids) for animal_grids, animal_group in zip(grids, groups) if animal_group == group], axis=0)
+    return maps
+
+def draw_heatmap(occupancy, title, file_name):
+    """
+    Draw an occupancy map (time spent in s per cell) of the normalized arena and save it as jpg
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=(6, 5))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    image = ax.imshow(occupancy, extent=(0, 1, 1, 0), cmap='inferno', interpolation='nearest')
+    fig.colorbar(image, ax=ax, label='Time (s)')
+    ax.set_title(title)
+    ax.axis('off')
+    fig.savefig(file_name, format='jpg')
+
+def save_group_maps(test, maps, directory=''):
+    """
+    Draw the cumulative 05, 10, 15, ... minute map of each group (EPM_heatmap_Control_05min.jpg) and save all maps in
+    one npz file (EPM_heatmaps.npz, arrays named <group>_<period>)
+    """
+    arrays = {}
+    for group, group_map in maps.items():
+        for i, occupancy in enumerate(group_map):
+            period = '%02dmin'%((i+1)*5)
+            draw_heatmap(occupancy, '%s %s %s'%(test, group, period), os.path.join(directory, '%s_heatmap_%s_%s.jpg'%(test, group, period)))
+            arrays['%s_%s'%(group, period)] = occupancy
+    np.savez(os.path.join(directory, '%s_heatmaps.npz'%(test)), **arrays)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Live analysis of a Bonsai csv file which is still growing during the experiment
+
+follow_bonsai follows the file as Bonsai appends to it and yields the new positions every poll. The positions are fed
+into StreamingZoneSums (same classification and distances as the offline analysis), and each time bin is emitted as
+soon as its last frame is written. replay_bonsai writes a recorded Bonsai file into a new file at a controlled rate,
+so that the live analysis can be tested without a running experiment.
+"""
+
+import io
+import os
+import sys
+import time as clock
+import numpy as np
+import pandas as pd
+from .bonsai_io import TRACK_COLUMNS
+from .streaming import StreamingZoneSums
+
+# Seconds between two reads of the growing file
+POLL_INTERVAL = 0.05
+
+def read_track_lines(lines, column_index):
+    """
+    Parse complete lines of a Bonsai csv file (without header) and return the tracked columns as float64 arrays
+    """
+    data = pd.read_csv(io.BytesIO(b''.join(lines)), sep=r'\s+', engine='c', encoding='cp949', header=None,
+                       usecols=list(column_index), dtype=np.float64)
+    return [data[i].to_numpy() for i in column_index]
+
+def follow_bonsai(file_path, columns=TRACK_COLUMNS, poll_interval=POLL_INTERVAL, idle_timeout=None):
+    """
+    Follow a growing Bonsai csv file and yield the positions of the new complete lines as float64 arrays.
+    A line is only read once it ends with a newline. The generator stops when the file did not grow for
+    idle_timeout seconds (never with idle_timeout=None).
+    """
+    last_growth = clock.monotonic()
+    while not os.path.exists(file_path):
+        if idle_timeout is not None and clock.monotonic() - last_growth > idle_timeout:
+            return
+        clock.sleep(poll_interval)
+
+    with open(file_path, 'rb') as f:
+        column_index = None
+        rest = b''
+        while True:
+            data = f.read()
+            if data:
+                last_growth = clock.monotonic()
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+
+                # The header gives the position of the tracked columns
+                if column_index is None and lines:
+                    header = lines.pop(0).decode('cp949').split()
+                    column_index = [header.index(column) for column in columns]
+                lines = [line + b'\n' for line in lines if line.strip()]
+                if lines:
+                    yield read_track_lines(lines, column_index)
+            elif idle_timeout is not None and clock.monotonic() - last_growth > idle_timeout:
+                return
+            else:
+                clock.sleep(poll_interval)
+
+def live_zone_sums(file_path, windows, classify, p, n_zone, poll_interval=POLL_INTERVAL, idle_timeout=None):
+    """
+    Follow a growing Bonsai csv file and yield (index of window, zone sums) for each window as soon as its last frame
+    is written (in the order of the windows' ends). The zone sums answer frames(a, b) and distance(a, b) like ZoneCumsum.
+    When the file stops growing (idle_timeout), the remaining windows are yielded clipped to the end of the recording,
+    like in the offline analysis.
+    """
+    zone_sums = StreamingZoneSums(windows, classify, p, n_zone)
+    order = sorted(range(len(windows)), key=lambda k: windows[k][1])
+    n_done = 0
+    for x, y in follow_bonsai(file_path, poll_interval=poll_interval, idle_timeout=idle_timeout):
+        zone_sums.feed(x, y)
+        while n_done < len(order) and windows[order[n_done]][1] <= zone_sums.n_frame:
+            yield order[n_done], zone_sums
+            n_done += 1
+        if n_done == len(order):
+            return
+    zone_sums.finish()
+    for k in order[n_done:]:
+        yield k, zone_sums
+
+def replay_bonsai(source, target, frame_rate, speed=1.0, batch_interval=0.1, stop=None):
+    """
+    Write a recorded Bonsai csv file into target at speed times the frame rate, like Bonsai during the experiment.
+    The header is written first, then the lines of every batch_interval seconds at once. With stop (threading.Event),
+    the replay ends early when it is set.
+    """
+    with open(source, 'rb') as f:
+        lines = f.readlines()
+    batch = max(int(round(frame_rate*speed*batch_interval)), 1)
+    start = clock.monotonic()
+    with open(target, 'wb') as out:
+        out.write(lines[0])
+        out.flush()
+        for i in range(1, len(lines), batch):
+
+            # Wait until the frames of this batch are recorded
+            delay = start + (i-1)/(frame_rate*speed) - clock.monotonic()
+            if stop is not None and stop.wait(max(delay, 0)):
+                return
+            if stop is None and delay > 0:
+                clock.sleep(delay)
+            out.writelines(lines[i:i+batch])
+            out.flush()
+
+class LiveWriter(object):
+    """
+    Write the results of each time bin as one csv line to stdout or to a rolling csv file (flushed after each line).
+    The columns are given by the results of the first time bin.
+    """
+    def __init__(self, output=None):
+        self.output = output
+        self.file = sys.stdout if output is None else open(output, 'a', newline='')
+        self.columns = None
+        if output is not None and os.path.getsize(output) > 0:
+            with open(output) as f:
+                self.columns = f.readline().rstrip('\r\n').split(',')
+
+    def write(self, row):
+        if self.columns is None:
+            self.columns = list(row)
+            self.file.write(','.join(self.columns) + '\n')
+        self.file.write(','.join(format_value(row.get(column, '')) for column in self.columns) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.output is not None:
+            self.file.close()
+
+def format_value(value):
+    if isinstance(value, (float, np.floating)):
+        return '%.6g'%(value)
+    return str(value)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Arena-agnostic description of a maze and the presets of the Elevated Plus Maze (EPM) and the Open Field Test (OFT)
+
+A Maze describes everything the analysis needs to know about an arena:
+
+    rois        function (clicked coordinates -> list of ROIs as matplotlib Path), all ROIs in the order they are drawn
+    pixel_size  function (clicked coordinates -> size of pixel in centimeter), from the known size of a part of the maze
+    zones       indices of the ROIs which are classified into zone labels 0, 1, ... (the first ROI wins, see zones.py)
+    regions     (name, zone labels) of the regions of the results, summed from the zones (OUTSIDE: not in any zone)
+    colors      edge color of each ROI in the trajectory, and point_size of the positions
+
+With a maze, any arena gets the same analysis: the positions are classified into the zones by the label raster,
+summed per zone by ZoneCumsum, and the time spent, the distance travelled and the speed in each region are read from
+the sums (see metrics). EPM_MAZE and OFT_MAZE are the presets used by EPM_Analysis_AJ_by_timebin.py and
+OFT_Analysis_AJ_by_timebin.py, other arenas only need a new Maze.
+
+Only numpy is imported here: matplotlib.path is imported when the ROIs are built and the plotting when a trajectory is
+drawn (see rendering.py), so compute-only runs do not load the GUI and plotting packages.
+"""
+
+from .zones import OUTSIDE, rasterize_ROI, classify_frames
+from .aggregation import step_distance, ZoneCumsum, calculate_speed
+from .rendering import trajectory_job, render_trajectory
+
+class Maze(object):
+    """
+    ROIs, pixel size, zones and regions of an arena (see above)
+    """
+    def __init__(self, name, n_clicks, rois, pixel_size, zones, regions, colors, point_size=1):
+        self.name = name
+        self.n_clicks = n_clicks
+        self.rois = rois
+        self.pixel_size = pixel_size
+        self.zones = list(zones)
+        self.regions = list(regions)
+        self.colors = list(colors)
+        self.point_size = point_size
+
+    @property
+    def n_zone(self):
+        return len(self.zones)
+
+    def zone_rois(self, coords_list):
+        """
+        Return the ROIs which are classified into zones (zone label i: ROI zones[i])
+        """
+        return [coords_list[i] for i in self.zones]
+
+    def region_sums(self, values):
+        """
+        Return the values of each region followed by the total from the values per column (zones, OUTSIDE, total)
+        """
+        columns = [[self.n_zone if label == OUTSIDE else label for label in labels] for name, labels in self.regions]
+        return [sum(values[column] for column in region) for region in columns] + [values[-1]]
+
+    def time_spent(self, zone_sums, a, b, frame_rate):
+        """
+        Return the time spent (s) in each region and in total between frame a and b (ZoneCumsum, CohortSums or the streaming sums)
+        """
+        return self.region_sums(zone_sums.seconds(a, b, frame_rate))
+
+    def distance(self, zone_sums, a, b):
+        """
+        Return the distance travelled (cm) in each region and in total between frame a and b. Each step belongs to the region of the frame where it starts.
+        """
+        return self.region_sums(zone_sums.distance(a, b))
+
+    def metrics(self, zone_sums, a, b, frame_rate):
+        """
+        Return the time spent, the distance travelled and the speed of each region between frame a and b as
+        {Time_<region>, Dist_<region>, Speed_<region>, Dist_Total, Speed_Total: value}
+        """
+        time_spent = self.time_spent(zone_sums, a, b, frame_rate)
+        distance = self.distance(zone_sums, a, b)
+        results = {}
+        for (name, labels), seconds, dist in zip(self.regions, time_spent, distance):
+            results['Time_%s'%(name)] = seconds
+            results['Dist_%s'%(name)] = dist
+            results['Speed_%s'%(name)] = calculate_speed(dist, seconds)
+        results['Dist_Total'] = distance[-1]
+        results['Speed_Total'] = calculate_speed(distance[-1], time_spent[-1])
+        return results
+
+    def trajectory_job(self, bonsai_file, coords_list, title, width, height, file_name):
+        """
+        Return the job of the trajectory of the positions with the ROIs in their colors (see rendering.py)
+        """
+        return trajectory_job(bonsai_file['mouseX'], bonsai_file['mouseY'], list(zip(coords_list, self.colors)), title, width, height, file_name, self.point_size)
+
+def analyze_track(maze, coords, x, y, width, height, frame_rate, windows, durations=None):
+    """
+    Analyze the positions (pixels) of one animal in the maze with its clicked coordinates and return the metrics of
+    each window (a, b) in frames (see Maze.metrics)
+    """
+    coords_list = maze.rois(coords)
+    rois = maze.zone_rois(coords_list)
+    zone_labels = classify_frames(rasterize_ROI(rois, width, height), rois, x, y)
+    zone_cumsum = ZoneCumsum(zone_labels, step_distance(x, y, maze.pixel_size(coords)), maze.n_zone, durations)
+    return [maze.metrics(zone_cumsum, a, b, frame_rate) for a, b in windows]
+
+def draw_trajectory(maze, bonsai_file, coords_list, title, width, height, file_name, renderer=None):
+    """
+    Draw the trajectory of the positions with the ROIs of the maze and save it as jpg, in the background with renderer
+    """
+    job = maze.trajectory_job(bonsai_file, coords_list, title, width, height, file_name)
+    if renderer is None:
+        render_trajectory(job)
+    else:
+        renderer.submit(job)
+
+def epm_rois(coords):
+    """
+    Define the regions of interest of EPM (open arm left, open arm right, closed arm up, closed arm down, center) from the 12 clicked corners
+    """
+    from matplotlib.path import Path
+    open_arm_1 = Path([coords[1],coords[2],coords[3],coords[4]])
+    open_arm_2 = Path([coords[7],coords[8],coords[9],coords[10]])
+    closed_arm_1 = Path([coords[0],coords[1],coords[10],coords[11]])
+    closed_arm_2 = Path([coords[4],coords[5],coords[6],coords[7]])
+    center = Path([coords[1],coords[4],coords[7],coords[10]])
+    return [open_arm_1, open_arm_2, closed_arm_1, closed_arm_2, center]
+
+def epm_pixel_size(coords):
+    """
+    Based on the coordinates of EPM (5cm x 5cm in center), calculate and return the size of pixel
+    """
+    x_1, y_1 = coords[1]
+    x_2, y_2 = coords[4]
+    x_3, y_3 = coords[7]
+    x_4, y_4 = coords[10]
+
+    p_1 = (25/((x_1-x_2)**2 + (y_1-y_2)**2))**0.5 # size of pixel in centimeter. 25 means 5cmx5cm for center of EPM.
+    p_2 = (25/((x_3-x_2)**2 + (y_3-y_2)**2))**0.5
+    p_3 = (25/((x_3-x_4)**2 + (y_3-y_4)**2))**0.5
+    p_4 = (25/((x_1-x_4)**2 + (y_1-y_4)**2))**0.5
+    return (p_1+p_2+p_3+p_4)/4
+
+def det(a, b):
+    return a[0] * b[1] - a[1] * b[0]
+
+def line_intersection(coords):
+    """
+    Get the 4 coordinates of OFT corners and return the coordinate of OFT center point
+    """
+    xdiff = (coords[0][0] - coords[2][0], coords[1][0] - coords[3][0])
+    ydiff = (coords[0][1] - coords[2][1], coords[1][1] - coords[3][1])
+    div = det(xdiff, ydiff)
+    if div == 0:
+        raise Exception('lines do not intersect')
+    d = (det(coords[0], coords[2]), det(coords[1], coords[3]))
+    x = det(d, xdiff) / div
+    y = det(d, ydiff) / div
+    return [x, y]
+
+def resize_center(coords, factor):
+    """
+    coords must be clockwise
+    how much the coordinates are moved as an absolute value
+    """
+    new_coords = []
+    intersection = tuple(line_intersection(coords))
+    for i in range(len(coords)):
+        new_coords.append(((coords[i][0]-intersection[0])*factor+intersection[0],(coords[i][1]-intersection[1])*factor+intersection[1]))
+    return new_coords
+
+def oft_rois(coords):
+    """
+    Define the regions of interest (OFT area, Small center (10%) and Large center (50%)) from the 4 corners of OFT
+    """
+    from matplotlib.path import Path
+    coords = list(coords) + [coords[0]]
+    OFT_area = Path([coords[0],coords[1],coords[2],coords[3],coords[0]], closed = True)
+    return [OFT_area, Path(resize_center(coords, 0.1), closed = True), Path(resize_center(coords, 0.5), closed = True)]
+
+# Area of OFT (cm2), 3600 means 60x60. Change it depending on the size of OFT
+OFT_AREA = 3600
+
+def oft_pixel_size(coords, area=OFT_AREA):
+    """
+    Based on the coordinates of OFT (60cmx60cm, or area in cm2), calculate and return the size of pixel
+    """
+    x_1, y_1 = coords[0]
+    x_2, y_2 = coords[1]
+    return (area/((x_1-x_2)**2 + (y_1-y_2)**2))**0.5 # size of pixel in centimeter
+
+# EPM: 5 zones (the arms and the center), the results of each arm and the center
+EPM_MAZE = Maze('EPM', 12, epm_rois, epm_pixel_size, zones=range(5),
+                regions=[('OA_left', [0]), ('OA_right', [1]), ('CA_up', [2]), ('CA_down', [3]), ('CT', [4])],
+                colors=['yellow', 'orange', 'green', 'blue', 'red'], point_size=0.5)
+
+# OFT: 2 zones (small center, large center without small center), the border is OUTSIDE of the large center
+OFT_MAZE = Maze('OFT', 4, oft_rois, oft_pixel_size, zones=[1, 2],
+                regions=[('smallCT', [0]), ('largeCT', [0, 1]), ('border', [OUTSIDE])],
+                colors=['yellow', 'orange', 'green'], point_size=1)
+
+MAZES = {'EPM': EPM_MAZE, 'OFT': OFT_MAZE}
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Loading the inputs of the next animals while the current animal is analyzed
+
+Each animal first waits for the disk (or the network share): the first frame of its video, then its bonsai file.
+prefetch loads the inputs of the next animals in a small pool of threads while the current animal is analyzed, so
+reading and computing overlap:
+
+    for bonsai_csv, bonsai_file in prefetch(load_bonsai, bonsai_csvs):
+        ...
+
+The inputs are given back in the order of the items. At most depth inputs are loaded ahead of the current one, and
+the next input is only started if the inputs loaded ahead and the estimated size of the next one (mean size of the
+inputs loaded so far) stay within memory_mb, so a cohort of long recordings does not fill the memory. With depth=0
+each input is loaded when it is reached, like a plain loop. An error while loading an input is raised when this input
+is reached, like without prefetch.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Inputs loaded ahead of the current animal and the memory they may take
+PREFETCH_DEPTH = 2
+PREFETCH_MEMORY_MB = 512
+
+def value_size(value):
+    """
+    Return the size (bytes) of the arrays and DataFrames of a loaded input (also inside tuples, lists and dicts)
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, 'memory_usage'):
+        return int(np.sum(value.memory_usage(index=True)))
+    if isinstance(value, (tuple, list)):
+        return sum(value_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(value_size(item) for item in value.values())
+    return 0
+
+def sized_load(load, item):
+    """
+    Load the item and return it with its size (in the thread which loads it)
+    """
+    value = load(item)
+    return value, value_size(value)
+
+def loaded_bytes(futures, mean_size):
+    """
+    Return the size of the inputs loaded ahead, the inputs which are still loading count as mean_size
+    """
+    total = 0
+    for future in futures:
+        if future.done() and future.exception() is None:
+            total += future.result()[1]
+        else:
+            total += mean_size
+    return total
+
+def prefetch(load, items, depth=PREFETCH_DEPTH, memory_mb=PREFETCH_MEMORY_MB):
+    """
+    Yield (item, load(item)) for each item in order while the next items are loaded in threads (see above)
+    """
+    items = list(items)
+    if depth <= 0:
+        for item in items:
+            yield item, load(item)
+        return
+
+    budget = memory_mb*2**20
+    executor = ThreadPoolExecutor(max_workers=depth)
+    pending = deque()
+    submitted = 0
+    total_size = 0
+    try:
+        for k, item in enumerate(items):
+            if not pending:
+                pending.append(executor.submit(sized_load, load, items[submitted]))
+                submitted += 1
+            future = pending.popleft()
+
+            # Start loading the next items while the current one is analyzed
+            mean_size = total_size/k if k else 0
+            while submitted < len(items) and len(pending) < depth and loaded_bytes(pending, mean_size) + mean_size <= budget:
+                pending.append(executor.submit(sized_load, load, items[submitted]))
+                submitted += 1
+
+            value, size = future.result()
+            total_size += size
+            yield item, value
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of the stages of the analysis
+
+A Profiler records for each stage of each animal (e.g. load_csv, classify, aggregate, plot) the wall time, the CPU
+time, the peak memory and the number of frames, so the throughput (frames/s) of each stage can be compared:
+
+    profiler = Profiler()
+    with profiler.stage('load_csv', 'F835') as record:
+        bonsai_file = load_bonsai('F835-OFT-bonsai.csv')
+        record['frames'] = len(bonsai_file)
+
+The functions of the scripts take profiler=None and use profile_stage, which does nothing without profiler, so the
+instrumentation costs nothing when it is not asked for. The peak memory is the peak of the memory allocated by python
+and numpy during the stage (tracemalloc, the memory of the C libraries like the csv parser of pandas is not counted).
+The records of worker processes are sent back as plain dicts and added with extend.
+
+At the end of the run, the report (stages, animals and all records) is saved as json file and a short summary is
+printed. profile_call runs a function under cProfile (e.g. the slowest animal again) and dumps the statistics, which
+can be read with python -m pstats or snakeviz.
+"""
+
+import cProfile
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+class Profiler(object):
+    """
+    Wall time, CPU time, peak memory and frames of each stage of each animal
+    """
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self.start = time.perf_counter()
+        # Peak memory of the open stages, a nested stage resets the peak of tracemalloc
+        self.peaks = []
+
+    @contextmanager
+    def stage(self, name, animal=None, frames=None):
+        """
+        Record the stage while the with block runs. The record (dict) is given to the block to set the frames later.
+        A stage without frames gets the frames of its nested stages of the same animal.
+        """
+        record = {'stage': name, 'animal': animal, 'frames': frames}
+        first = len(self.records)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if self.peaks:
+                self.peaks[-1] = max(self.peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self.peaks.append(current)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            if self.memory:
+                peak = max(self.peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = peak/2**20
+                if self.peaks:
+                    self.peaks[-1] = max(self.peaks[-1], peak)
+            if record['frames'] is None:
+                record['frames'] = max([nested['frames'] for nested in self.records[first:] if nested['animal'] == animal and nested['frames']], default=None)
+            self.records.append(record)
+
+    def extend(self, records):
+        """
+        Add the records of another profiler (e.g. of a worker process)
+        """
+        self.records.extend(records)
+
+    def stages(self):
+        """
+        Return {stage: totals over all animals} in the order of the first record of each stage
+        """
+        return totals(self.records, 'stage')
+
+    def animals(self):
+        """
+        Return {animal: {stage: totals}} of the records of each animal
+        """
+        animals = {}
+        for record in self.records:
+            if record['animal'] is not None:
+                animals.setdefault(record['animal'], []).append(record)
+        return {animal: totals(records, 'stage') for animal, records in animals.items()}
+
+    def slowest_animal(self, stage='animal'):
+        """
+        Return the animal whose stage took the longest wall time (None without records of the stage)
+        """
+        times = {}
+        for record in self.records:
+            if record['stage'] == stage and record['animal'] is not None:
+                times[record['animal']] = times.get(record['animal'], 0.0) + record['wall']
+        return max(times, key=times.get) if times else None
+
+    def report(self):
+        """
+        Return the report as dict: totals of each stage, totals of each stage of each animal and all records
+        """
+        return {'elapsed': time.perf_counter() - self.start, 'stages': self.stages(), 'animals': self.animals(),
+                'slowest_animal': self.slowest_animal(), 'records': self.records}
+
+    def save(self, file_path):
+        """
+        Save the report as json file
+        """
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=1, default=str)
+
+    def summary(self):
+        """
+        Print the wall time, CPU time, peak memory and throughput of each stage (the stages of animals analyzed in
+        parallel add up to more than the elapsed time)
+        """
+        stages = self.stages()
+        total = sum(values['wall'] for name, values in stages.items() if name != 'animal')
+        print('\n%-12s %6s %10s %6s %10s %10s %12s'%('Stage', 'Calls', 'Wall (s)', '%', 'CPU (s)', 'Peak (MB)', 'Frames/s'))
+        for name, values in stages.items():
+            share = '' if name == 'animal' or total == 0 else '%.1f'%(100*values['wall']/total)
+            fps = '' if values['fps'] is None else '%.0f'%(values['fps'])
+            peak = '' if values['peak_mb'] is None else '%.1f'%(values['peak_mb'])
+            print('%-12s %6d %10.3f %6s %10.3f %10s %12s'%(name, values['calls'], values['wall'], share, values['cpu'], peak, fps))
+        slowest = self.slowest_animal()
+        if slowest is not None:
+            print('Slowest animal: %s (%.3f s)'%(slowest, self.animals()[slowest]['animal']['wall']))
+        print('Elapsed: %.3f s'%(time.perf_counter() - self.start))
+
+def totals(records, key):
+    """
+    Return {value of key: calls, wall, cpu, max peak memory, frames and frames/s} of the records
+    """
+    groups = {}
+    for record in records:
+        group = groups.setdefault(record[key], {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak_mb': None, 'frames': 0})
+        group['calls'] += 1
+        group['wall'] += record['wall']
+        group['cpu'] += record['cpu']
+        if record.get('peak_mb') is not None:
+            group['peak_mb'] = max(group['peak_mb'] or 0.0, record['peak_mb'])
+        group['frames'] += record['frames'] or 0
+    for group in groups.values():
+        group['fps'] = group['frames']/group['wall'] if group['frames'] and group['wall'] > 0 else None
+    return groups
+
+def profile_stage(profiler, name, animal=None, frames=None):
+    """
+    Return the stage of the profiler, or a context which does nothing without profiler (both give a record dict)
+    """
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, animal, frames)
+
+def profile_call(file_path, function, *args, **kwargs):
+    """
+    Run the function under cProfile, dump the statistics to file_path and return the value of the function
+    """
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        profile.dump_stats(file_path)
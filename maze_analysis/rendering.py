@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Headless rendering of the trajectories on a pool of worker processes
+
+Each trajectory is drawn on its own Figure object with the Agg canvas (no pyplot, no window, no global state shared
+between the figures), and the point cloud is rasterized so that long sessions stay fast and small. A trajectory is
+described by a picklable job (points, ROIs with their colors, title, frame size, file name), so the figures can be
+drawn by a Renderer in other processes while the main process analyzes the next animal.
+
+Render modes of the 5 minute windows of an animal:
+    all:    the trajectories of 05, 10, 15 (and 20) minutes
+    final:  only the trajectory of the whole session
+    none:   no trajectory
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+RENDER_MODES = ('all', 'final', 'none')
+
+# Number of processes drawing the figures
+RENDER_WORKERS = 2
+
+def render_windows(mode, n_window):
+    """
+    Return the indices of the 5 minute windows to draw in the render mode (True: all, False: none)
+    """
+    if mode is True or mode == 'all':
+        return list(range(n_window))
+    if mode == 'final':
+        return [n_window-1] if n_window > 0 else []
+    if mode is False or mode is None or mode == 'none':
+        return []
+    raise ValueError('Unknown render mode %s, please use one of %s'%(mode, ', '.join(RENDER_MODES)))
+
+def trajectory_job(x, y, rois, title, width, height, file_name, point_size=1):
+    """
+    Return the job of one trajectory. rois: list of (matplotlib Path, edge color)
+    """
+    return {'x': np.asarray(x, dtype=np.float32), 'y': np.asarray(y, dtype=np.float32), 'rois': rois, 'title': title,
+            'width': width, 'height': height, 'file_name': file_name, 'point_size': point_size}
+
+def render_trajectory(job):
+    """
+    Draw the points and the ROIs of a trajectory job on its own figure and save it as jpg
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.patches import PathPatch
+
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.scatter(job['x'], job['y'], s=job['point_size'], rasterized=True)
+    for roi, color in job['rois']:
+        ax.add_patch(PathPatch(roi, edgecolor=color, fill=0, lw=2))
+    ax.set_title(job['title'], fontfamily=['Arial', 'sans-serif'])
+    ax.set_xlim(0, job['width'])
+    ax.set_ylim(0, job['height'])
+    ax.axis('off')
+    fig.savefig(job['file_name'], format='jpg')
+    return job['file_name']
+
+class Renderer(object):
+    """
+    Pool of processes which draw the trajectory jobs in the background. Errors are raised at the next submit or at close.
+    """
+    def __init__(self, workers=RENDER_WORKERS):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def submit(self, job):
+        self.check()
+        self.futures.append(self.executor.submit(render_trajectory, job))
+
+    def check(self):
+        # Raise the error of a finished figure and forget the finished figures
+        for future in [future for future in self.futures if future.done()]:
+            future.result()
+        self.futures = [future for future in self.futures if not future.done()]
+
+    def close(self):
+        """
+        Wait for all figures and stop the processes
+        """
+        try:
+            for future in self.futures:
+                future.result()
+        finally:
+            self.futures = []
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of the results of each animal for incremental re-analysis
+
+The results of an animal ({column name: value}, see analyze_animal) are saved as json file named by the hash of
+all the inputs of the analysis: the content of the Bonsai csv file, the calibration coordinates, the frame rate,
+the starting time, the session length, the time bin and the analysis mode. When a new animal is added to the
+excel file, only the animals whose inputs changed are analyzed again, the others are read from the cache.
+
+The cache directory is bounded in size: when it grows over max_bytes, the least recently used results are removed.
+"""
+
+import hashlib
+import json
+import os
+
+# Change this when the analysis changes, so that the old results are not reused
+CACHE_VERSION = 2
+
+# Default directory and size of the cache
+CACHE_DIRECTORY = 'result_cache'
+CACHE_SIZE = 64*1024*1024
+
+def file_hash(file_path, block_size=1<<20):
+    """
+    Return the sha1 of the content of a file
+    """
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def analysis_key(test, bonsai_csv, coords, frame_rate, time, total_exp_time_min, timebin_in_sec, analysis_way=None, timestamps=False):
+    """
+    Return the key of the results of an animal: the sha1 of all the inputs of its analysis
+    """
+    inputs = {'version': CACHE_VERSION,
+              'test': test,
+              'bonsai_csv': file_hash(bonsai_csv),
+              'coords': [[float(x), float(y)] for x, y in coords],
+              'frame_rate': float(frame_rate),
+              'starting_time': float(time),
+              'session': total_exp_time_min,
+              'timebin': timebin_in_sec,
+              'analysis_way': analysis_way}
+
+    # Results with the timestamp index of the frames (see timestamps.py)
+    if timestamps:
+        inputs['timestamps'] = True
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+class ResultCache(object):
+    """
+    Directory of json files with the results of the animals, keyed by analysis_key
+    """
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, '%s.json'%(key))
+
+    def get(self, key):
+        """
+        Return the cached results of the key or None
+        """
+        file_path = self.path(key)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # Mark the results as recently used for the eviction
+        os.utime(file_path)
+        self.hits += 1
+        return results
+
+    def put(self, key, results):
+        """
+        Save the results of the key and remove the least recently used results if the cache is too large
+        """
+        temp_file = '%s.%s.tmp'%(self.path(key), os.getpid())
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({column: float(value) for column, value in results.items()}, f)
+        os.replace(temp_file, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used results until the cache is smaller than max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for mtime, size, file_path in entries)
+        for mtime, size, file_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(file_path)
+            total -= size
+
+    def report(self):
+        """
+        Print the number of cache hits and misses
+        """
+        print('Result cache: %s hits (reused), %s misses (analyzed)'%(self.hits, self.misses))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar accumulation of the results of all animals and a single write of the excel file
+
+The results of each animal ({column name: value}, see analyze_animal) are appended to three compact columns
+(animal index, column index, value). At the end, the wide table (one row per animal, one column per metric) is
+built by one vectorized pivot, merged into the dataframe of the excel file and the workbook is written once.
+
+The same records can also be exported as long/tidy table for statistics:
+
+    Animal no | Metric | Region | Period | Value
+    835       | Time   | OA     | 0s_60s | 12.3
+"""
+
+import re
+from array import array
+import numpy as np
+import pandas as pd
+
+# Column names are Metric_Region_Period, e.g. Time_OA_left_0s_60s or Speed_Total_05min
+COLUMN_PATTERN = re.compile(r'^([A-Za-z]+)_(.+)_(\d+s_\d+s|\d+min)$')
+
+class ResultBuilder(object):
+    """
+    Collect the results of the animals as columnar records (animal index, column index, value)
+    """
+    def __init__(self, columns=()):
+        self.animals = []
+        self.animal_index = {}
+        self.columns = []
+        self.column_index = {}
+        for column in columns:
+            self.column_id(column)
+        self.animal_ids = array('q')
+        self.column_ids = array('q')
+        self.values = array('d')
+
+    def column_id(self, column):
+        """
+        Return the index of a column, new columns are added at the end
+        """
+        if column not in self.column_index:
+            self.column_index[column] = len(self.columns)
+            self.columns.append(column)
+        return self.column_index[column]
+
+    def add(self, animal, results):
+        """
+        Append the results ({column name: value}) of an animal
+        """
+        if animal not in self.animal_index:
+            self.animal_index[animal] = len(self.animals)
+            self.animals.append(animal)
+        animal_id = self.animal_index[animal]
+        for column, value in results.items():
+            self.animal_ids.append(animal_id)
+            self.column_ids.append(self.column_id(column))
+            self.values.append(value)
+
+    def to_wide(self, fill_value=0):
+        """
+        Return the results as wide table (one row per animal, one column per metric) by one vectorized pivot
+        """
+        table = np.full((len(self.animals), len(self.columns)), fill_value, dtype=np.float64)
+        table[np.frombuffer(self.animal_ids, dtype=np.int64), np.frombuffer(self.column_ids, dtype=np.int64)] = np.frombuffer(self.values, dtype=np.float64)
+        return pd.DataFrame(table, index=pd.Index(self.animals, name='Animal no'), columns=self.columns)
+
+    def to_long(self):
+        """
+        Return the results as long/tidy table with the columns Animal no, Metric, Region, Period and Value
+        """
+        parts = [COLUMN_PATTERN.match(column) for column in self.columns]
+        parts = np.array([match.groups() if match else (column, '', '') for match, column in zip(parts, self.columns)], dtype=object).reshape(-1, 3)
+        column_ids = np.frombuffer(self.column_ids, dtype=np.int64)
+        return pd.DataFrame({'Animal no': np.array(self.animals, dtype=object)[np.frombuffer(self.animal_ids, dtype=np.int64)],
+                             'Metric': parts[column_ids, 0],
+                             'Region': parts[column_ids, 1],
+                             'Period': parts[column_ids, 2],
+                             'Value': np.frombuffer(self.values, dtype=np.float64)})
+
+    def merge(self, df, fill_value=0):
+        """
+        Return the dataframe of the excel file with the results of the animals in its columns (the order of animals of df is kept)
+        """
+        wide = self.to_wide(fill_value).reindex(df.index, fill_value=fill_value)
+        df = df.drop(columns=[column for column in self.columns if column in df.columns])
+        return pd.concat([df, wide], axis=1)
+
+def write_excel(df, excel_file):
+    """
+    Write the dataframe to the excel file at once
+    """
+    with pd.ExcelWriter(excel_file, engine='xlsxwriter') as df_write:
+        df.to_excel(df_write, sheet_name = 'Sheet1')
+
+def write_parquet(builder, parquet_file):
+    """
+    Write the long/tidy table of the results to a Parquet file (requires pyarrow or fastparquet)
+    """
+    builder.to_long().to_parquet(parquet_file, index=False)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-mapped store of the trajectories of a cohort
+
+The positions (mouseX, mouseY) of all animals are saved as one float32 array (frames x 2) in a .npy file, and an
+index (json) gives for each animal its offset and length in the array, its frame rate, its starting time and frame
+and the version of its bonsai file:
+
+    EPM_cohort.npy    float32 (frames x 2), the animals one after the other
+    EPM_cohort.json   {"columns": [...], "n_frame": ..., "data_key": [...], "animals": {"F835": {"offset", "length", "frame_rate", "time", "start_frame", "bonsai", "key"}}}
+
+The array is opened memory-mapped, so an animal or a time window is a slice of the file without copying or parsing,
+and the worker processes which open the same store share the pages of the file. The store is written by build_store
+(batch_analysis.py --store) and written again when a bonsai file, a frame rate or a starting time changed. The array
+is replaced first and the index last, with the key (size, modification time) of the array, so a store whose writing
+was interrupted is not opened with the offsets of another array. In a notebook:
+
+    store = CohortStore('EPM_cohort')
+    xy = store.track('F835')                   # all frames of F835 (frames x 2)
+    xy = store.window('F835', 0, 300)          # 0 - 300 s after the starting time
+    bonsai_file = store.bonsai_file('F835')    # DataFrame like load_bonsai, on the same pages
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from .bonsai_io import TRACK_COLUMNS, file_key
+from .aggregation import frame_index
+from .cohort import CohortTracks, load_cohort
+
+def store_path(test, directory=''):
+    """
+    Return the path of the store of a test (EPM or OFT) without extension
+    """
+    return os.path.join(directory, '%s_cohort'%(test))
+
+class CohortStore(object):
+    """
+    Trajectories of the cohort opened memory-mapped from path.npy with the index path.json
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('data_key') != file_key(path + '.npy').tolist():
+            raise ValueError('%s.npy does not belong to its index %s.json, please build the store again'%(path, path))
+        self.columns = index['columns']
+        self.index = index['animals']
+        self.xy = np.load(path + '.npy', mmap_mode='r')
+        if self.xy.shape[0] != index['n_frame']:
+            raise ValueError('%s.npy has %d frames, but its index %d'%(path, self.xy.shape[0], index['n_frame']))
+
+    @property
+    def animals(self):
+        return list(self.index)
+
+    def __contains__(self, anim_id):
+        return anim_id in self.index
+
+    def frame_rate(self, anim_id):
+        return self.index[anim_id]['frame_rate']
+
+    def track(self, anim_id, a=0, b=None):
+        """
+        Return the positions (frames x 2) of frame a to b (clipped to the track) of the animal, a view of the file
+        """
+        info = self.index[anim_id]
+        a, b, _ = slice(a, b).indices(info['length'])
+        return self.xy[info['offset']+a:info['offset']+max(a, b)]
+
+    def window(self, anim_id, start, end):
+        """
+        Return the positions of the animal from start to end (in second) after its starting time, a view of the file
+        """
+        info = self.index[anim_id]
+        return self.track(anim_id, frame_index(info['frame_rate'], info['time'] + start), frame_index(info['frame_rate'], info['time'] + end))
+
+    def bonsai_file(self, anim_id):
+        """
+        Return the positions of the animal as DataFrame with the columns of the bonsai file (like load_bonsai), without copy
+        """
+        xy = self.track(anim_id)
+        return pd.DataFrame({column: xy[:, j] for j, column in enumerate(self.columns)}, copy=False)
+
+    def cohort(self, anim_ids):
+        """
+        Return the CohortTracks of the animals (see cohort.py), a view of the file if they follow each other in the store
+        """
+        offsets = [self.index[anim_id]['offset'] for anim_id in anim_ids]
+        lengths = [self.index[anim_id]['length'] for anim_id in anim_ids]
+        bounds = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        if all(offsets[k] + lengths[k] == offsets[k+1] for k in range(len(offsets)-1)):
+            xy = self.xy[offsets[0]:offsets[0]+bounds[-1]] if offsets else self.xy[:0]
+        else:
+            xy = np.concatenate([self.track(anim_id) for anim_id in anim_ids])
+        return CohortTracks(xy, bounds)
+
+    def is_current(self, anim_id, bonsai_csv, frame_rate, time):
+        """
+        Return True if the animal is stored from this version of its bonsai file with this frame rate and starting time
+        """
+        info = self.index.get(anim_id)
+        return (info is not None and info['bonsai'] == bonsai_csv and info['key'] == file_key(bonsai_csv).tolist()
+                and info['frame_rate'] == frame_rate and info['time'] == time)
+
+def build_store(path, animals, columns=TRACK_COLUMNS):
+    """
+    Write the store of the animals, a list of (animal id, bonsai file, frame rate, starting time in second), and return
+    it opened. The store is kept if it holds the same animals from the same bonsai files.
+    """
+    animals = [(anim_id, bonsai_csv, float(frame_rate), int(time)) for anim_id, bonsai_csv, frame_rate, time in animals]
+    if os.path.exists(path + '.npy') and os.path.exists(path + '.json'):
+        try:
+            store = CohortStore(path)
+            if store.animals == [animal[0] for animal in animals] and store.columns == list(columns) and all(store.is_current(*animal) for animal in animals):
+                return store
+        except (OSError, ValueError, KeyError):
+            pass
+
+    # Concatenate the bonsai files (from their sidecars if up to date), replace the array and then its index
+    cohort = load_cohort([bonsai_csv for anim_id, bonsai_csv, frame_rate, time in animals], columns)
+    index = {}
+    for k, (anim_id, bonsai_csv, frame_rate, time) in enumerate(animals):
+        index[anim_id] = {'offset': int(cohort.offsets[k]), 'length': int(cohort.lengths[k]), 'frame_rate': frame_rate,
+                          'time': time, 'start_frame': frame_index(frame_rate, time), 'bonsai': bonsai_csv, 'key': file_key(bonsai_csv).tolist()}
+    with open(path + '.npy.tmp', 'wb') as f:
+        np.save(f, cohort.xy)
+    os.replace(path + '.npy.tmp', path + '.npy')
+    with open(path + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'columns': list(columns), 'n_frame': int(cohort.offsets[-1]), 'data_key': file_key(path + '.npy').tolist(), 'animals': index}, f, indent=1)
+    os.replace(path + '.json.tmp', path + '.json')
+    return CohortStore(path)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming analysis of long Bonsai recordings in chunks with constant memory
+
+The Bonsai csv file is read in chunks of fixed size by a generator. Each chunk is classified into zones and the
+step distances are computed, carrying the last position of the previous chunk over the chunk boundary. Instead of
+the cumulative sums of every frame (ZoneCumsum), only the cumulative sums at the edges of the requested windows are
+kept, so memory does not grow with the length of the recording.
+
+StreamingZoneSums answers frames(a, b) and distance(a, b) exactly like ZoneCumsum (same clipping, same last two
+frames without step, same NaN handling), for the windows given in advance. The zone labels are also run-length
+encoded chunk by chunk, so the zone events (entries, latencies, bouts) of any window are known at the end too. The
+runs are the only part which grows with the recording: one run per change of zone (about 9 bytes each), not per frame.
+
+The positions of the trajectories to draw are collected while the chunks go past (see WindowSampler). A window keeps
+at most TRAJECTORY_POINTS positions (every n-th frame of a longer window), so drawing does not read the file again
+and does not grow with the length of the session either.
+"""
+
+import numpy as np
+import pandas as pd
+from .bonsai_io import TRACK_COLUMNS
+from .events import RunBuilder
+
+# Number of frames per chunk (about 1 hour at 30 fps)
+CHUNK_SIZE = 100000
+
+# Maximum number of positions of a trajectory drawn while streaming (every frame of windows up to about 55 minutes at 30 fps)
+TRAJECTORY_POINTS = 100000
+
+def iter_bonsai_chunks(file_path, chunk_size=CHUNK_SIZE, columns=TRACK_COLUMNS):
+    """
+    Read a Bonsai csv file in chunks of chunk_size frames and yield the columns of each chunk as float64 arrays
+    """
+    reader = pd.read_csv(file_path, sep=r'\s+', engine='c', encoding='cp949', usecols=list(columns),
+                         dtype={column: np.float32 for column in columns}, chunksize=chunk_size)
+    with reader:
+        for chunk in reader:
+            yield [chunk[column].to_numpy(dtype=np.float64) for column in columns]
+
+def read_bonsai_window(file_path, a, b, columns=TRACK_COLUMNS):
+    """
+    Read only the frames a .. b-1 of a Bonsai csv file (e.g. to draw the trajectory of a window)
+    """
+    return pd.read_csv(file_path, sep=r'\s+', engine='c', encoding='cp949', usecols=list(columns),
+                       dtype={column: np.float32 for column in columns}, skiprows=range(1, a+1), nrows=max(b-a, 0))[list(columns)]
+
+class WindowSampler(object):
+    """
+    Positions of the frames a .. b-1 collected from the chunks, every stride-th frame so that at most max_points are kept
+    """
+    def __init__(self, a, b, max_points=TRAJECTORY_POINTS):
+        self.a = max(int(a), 0)
+        self.b = max(int(b), self.a)
+        self.stride = max(-(-(self.b - self.a)//max_points), 1)
+        self.x = []
+        self.y = []
+
+    def feed(self, s, x, y):
+        """
+        Keep the positions of the chunk (frames s .. s+len(x)-1) in the window which fall on the stride
+        """
+        first = max(self.a, s)
+        last = min(self.b, s + len(x))
+        if first >= last:
+            return
+        first += (self.a - first) % self.stride
+        self.x.append(np.asarray(x[first-s:last-s:self.stride], dtype=np.float32))
+        self.y.append(np.asarray(y[first-s:last-s:self.stride], dtype=np.float32))
+
+    def positions(self, columns=TRACK_COLUMNS):
+        """
+        Return the kept positions as DataFrame with the columns of the bonsai file
+        """
+        x = np.concatenate(self.x) if self.x else np.zeros(0, dtype=np.float32)
+        y = np.concatenate(self.y) if self.y else np.zeros(0, dtype=np.float32)
+        return pd.DataFrame({columns[0]: x, columns[1]: y})
+
+class StreamingZoneSums(object):
+    """
+    Cumulative frame counts and distances per zone (columns: zones, OUTSIDE, total) at the edges of the windows.
+    windows: list of (a, b) in frames which will be asked after the stream is finished
+    classify: function (x, y) -> zone labels of the frames (see classify_frames)
+    p: size of pixel in centimeter
+    carry_outside: frames outside of all zones continue the previous zone in the zone events (see events.py)
+    draw_windows: list of (a, b) in frames whose positions are kept to draw their trajectories (see WindowSampler)
+    """
+    def __init__(self, windows, classify, p, n_zone, carry_outside=False, draw_windows=()):
+        self.classify = classify
+        self.p = p
+        self.n_zone = n_zone
+        self.n_column = n_zone + 2
+
+        # Cumulative frames are needed at a and b, cumulative distances at a and b-2 (see ZoneCumsum)
+        self.frame_edges = np.unique([edge for a, b in windows for edge in (max(int(a), 0), max(int(b), 0))]).astype(np.int64)
+        self.dist_edges = np.unique([edge for a, b in windows for edge in (max(int(a), 0), max(int(a), int(b)-2, 0))]).astype(np.int64)
+        self.frame_at = {0: np.zeros(self.n_column)}
+        self.dist_at = {0: np.zeros(self.n_column)}
+
+        self.n_frame = 0
+        self.frame_sum = np.zeros(self.n_column)
+        self.dist_sum = np.zeros(self.n_column)
+        self.last_position = None
+        self.last_column = None
+        self.last_step = np.zeros(self.n_column)
+        self.finished = False
+        self.runs = RunBuilder(carry_outside)
+        self.samplers = [WindowSampler(a, b) for a, b in draw_windows]
+
+    def columns_of(self, zone_labels):
+        """
+        Return the column (zone, OUTSIDE) of each zone label
+        """
+        return np.where(zone_labels < self.n_zone, zone_labels, self.n_zone).astype(np.intp)
+
+    def feed(self, x, y):
+        """
+        Add the next chunk of positions (frames n_frame .. n_frame+len(x)-1)
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        m = len(x)
+        if m == 0:
+            return
+        s = self.n_frame
+        for sampler in self.samplers:
+            sampler.feed(s, x, y)
+        zone_labels = self.classify(x, y)
+        self.runs.add(zone_labels, x, y)
+        columns = self.columns_of(zone_labels)
+
+        # Cumulative frames at the edges c in (s, s+m]
+        for c in self.frame_edges[(self.frame_edges > s) & (self.frame_edges <= s+m)]:
+            self.frame_at[int(c)] = self.frame_sum + self.count(columns[:c-s])
+        self.frame_sum = self.frame_sum + self.count(columns)
+
+        # Steps k0 .. s+m-2, the first step starts at the last frame of the previous chunk
+        if self.last_position is not None:
+            x = np.concatenate([[self.last_position[0]], x])
+            y = np.concatenate([[self.last_position[1]], y])
+            step_columns = np.concatenate([[self.last_column], columns[:-1]])
+            k0 = s - 1
+        else:
+            step_columns = columns[:-1]
+            k0 = s
+        step = np.nan_to_num(np.hypot(np.diff(x)*self.p, np.diff(y)*self.p), nan=0.0)
+
+        # Cumulative distances at the edges c in (k0, k0+len(step)]
+        for c in self.dist_edges[(self.dist_edges > k0) & (self.dist_edges <= k0+len(step))]:
+            self.dist_at[int(c)] = self.dist_sum + self.sum_steps(step[:c-k0], step_columns[:c-k0])
+        self.dist_sum = self.dist_sum + self.sum_steps(step, step_columns)
+        if len(step) > 0:
+            self.last_step = self.sum_steps(step[-1:], step_columns[-1:])
+
+        self.n_frame = s + m
+        self.last_position = (x[-1], y[-1])
+        self.last_column = columns[-1]
+
+    def count(self, columns):
+        counts = np.zeros(self.n_column)
+        counts[:self.n_zone+1] = np.bincount(columns, minlength=self.n_zone+1)
+        counts[-1] = len(columns)
+        return counts
+
+    def sum_steps(self, step, step_columns):
+        sums = np.zeros(self.n_column)
+        sums[:self.n_zone+1] = np.bincount(step_columns, weights=step, minlength=self.n_zone+1)
+        sums[-1] = step.sum()
+        return sums
+
+    def finish(self):
+        """
+        Close the stream: add the cumulative sums at the end of the recording for the windows which are clipped
+        """
+        n = self.n_frame
+        self.frame_at[n] = self.frame_sum
+        self.dist_at[n] = self.dist_sum
+        if n >= 1:
+            self.dist_at[n-1] = self.dist_sum
+        if n >= 2:
+            self.dist_at[n-2] = self.dist_sum - self.last_step
+        self.finished = True
+
+    def clip(self, a, b):
+        a = min(max(int(a), 0), self.n_frame)
+        b = min(max(int(b), a), self.n_frame)
+        return a, b, max(a, b-2)
+
+    def frames(self, a, b):
+        """
+        Return the number of frames per column (zones, OUTSIDE, total) in the window [a, b)
+        """
+        a, b, e = self.clip(a, b)
+        return self.frame_at[b] - self.frame_at[a]
+
+    def distance(self, a, b):
+        """
+        Return the distance travelled per column (zones, OUTSIDE, total) in the window [a, b)
+        """
+        a, b, e = self.clip(a, b)
+        return self.dist_at[e] - self.dist_at[a]
+
+    def seconds(self, a, b, frame_rate):
+        """
+        Return the time spent (s) per column (zones, OUTSIDE, total) in the window [a, b)
+        """
+        return self.frames(a, b) / frame_rate
+
+    def zone_events(self):
+        """
+        Return the ZoneEvents of the frames streamed so far (see events.py)
+        """
+        return self.runs.events()
+
+    def trajectory(self, k):
+        """
+        Return the positions kept of the k-th window of draw_windows as DataFrame (like the rows of the bonsai file)
+        """
+        return self.samplers[k].positions()
+
+def stream_zone_sums(file_path, windows, classify, p, n_zone, chunk_size=CHUNK_SIZE, carry_outside=False, draw_windows=()):
+    """
+    Stream a Bonsai csv file in chunks and return the StreamingZoneSums of the windows (and the positions of draw_windows)
+    """
+    zone_sums = StreamingZoneSums(windows, classify, p, n_zone, carry_outside, draw_windows)
+    for x, y in iter_bonsai_chunks(file_path, chunk_size):
+        zone_sums.feed(x, y)
+    zone_sums.finish()
+    return zone_sums
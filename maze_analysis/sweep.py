@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweep of the time bins, the OFT center sizes and the OFT arena sizes in one pass per animal
+
+A sensitivity analysis (time bins of 30, 60, 120 and 300 s, small and large centers other than 10% and 50% of OFT,
+arena sizes other than 60cm x 60cm) does not need a new analysis per setting:
+
+    - The centers of OFT are the clicked arena scaled about its center point by the fraction (see resize_center), so
+      they are nested. The gauge of a frame is the smallest fraction whose center contains it (the arena is convex), so
+      the frames are classified into all centers at once: zone k holds the frames inside center k but not center k-1.
+      The time and distance in center k are the sums of zones 0 .. k, the border the sums of the other columns.
+    - The cumulative sums of the zones (see aggregation.py) give all windows of all time bins by one difference.
+    - The distances are proportional to the size of pixel, so other arena sizes only scale the distances and speeds.
+
+So each trajectory is loaded and classified once. The result is one long/tidy table with one row per value:
+
+    Animal no | Timebin | Center fraction | Arena (cm2) | Metric | Region | Period | Value
+    835       | 60      | 0.1             | 3600        | Time   | center | 0s_60s | 12.3
+
+EPM has no center fraction or arena size (NaN), its regions are the arms, OA, CA and the center.
+"""
+
+import numpy as np
+import pandas as pd
+from .zones import OUTSIDE, rasterize_ROI, classify_frames
+from .aggregation import step_distance, ZoneCumsum, calculate_speed, frame_index
+from .mazes import EPM_MAZE, OFT_AREA, line_intersection, oft_pixel_size
+
+# Default parameters of the sweep
+SWEEP_TIMEBINS = (30, 60, 120, 300)
+SWEEP_CENTERS = (0.1, 0.5)
+
+# Regions of EPM in the sweep (zone labels: 0, 1 open arms, 2, 3 closed arms, 4 center)
+EPM_SWEEP_REGIONS = EPM_MAZE.regions + [('OA', [0, 1]), ('CA', [2, 3])]
+
+SWEEP_COLUMNS = ['Animal no', 'Timebin', 'Center fraction', 'Arena (cm2)', 'Metric', 'Region', 'Period', 'Value']
+
+def center_gauge(coords, x, y):
+    """
+    Return for each position the smallest fraction of the OFT corners (scaled about their center point, see
+    resize_center) which contains it: <= 1 inside OFT, NaN if the mouse was not detected
+    """
+    center = np.array(line_intersection(coords))
+    vertices = np.asarray(coords[:4], dtype=np.float64) - center
+    edges = np.roll(vertices, -1, axis=0) - vertices
+
+    # Normal of each edge pointing away from the center, and the distance of the edge from the center
+    normals = np.stack([edges[:, 1], -edges[:, 0]], axis=1)
+    offsets = np.sum(normals*vertices, axis=1)
+    normals[offsets < 0] *= -1
+    offsets = np.abs(offsets)
+
+    positions = np.stack([np.asarray(x, dtype=np.float64) - center[0], np.asarray(y, dtype=np.float64) - center[1]], axis=1)
+    return np.max(positions @ normals.T / offsets, axis=1)
+
+def gauge_labels(gauge, fractions):
+    """
+    Return the zone label of each frame for the nested centers of the sorted fractions: k if the frame is in center
+    k but not in center k-1, OUTSIDE if it is outside of the largest center (or not detected)
+    """
+    labels = np.searchsorted(np.asarray(fractions, dtype=np.float64), gauge, side='left')
+    labels[np.isnan(gauge) | (labels == len(fractions))] = OUTSIDE
+    return labels.astype(np.uint8)
+
+def sweep_windows(frame_rate, time, total_exp_time_min, timebins):
+    """
+    Return the time bin, the period name and the window (a, b) in frames of each time bin of each bin size
+    """
+    windows = []
+    for timebin_in_sec in timebins:
+        for i in range(int(total_exp_time_min*60/timebin_in_sec)):
+            start = timebin_in_sec*i
+            end = timebin_in_sec*(i+1)
+            windows.append((timebin_in_sec, '%ss_%ss'%(start, end), frame_index(frame_rate, time + start), frame_index(frame_rate, time + end)))
+    return windows
+
+def region_metrics(frames, dist, frame_rate, regions):
+    """
+    Return [(metric, region, values of the windows)] of the time spent, distance travelled and speed of each region
+    (name, columns) and in total, from the frames and distances of the windows (windows x columns, see ZoneCumsum.windows)
+    """
+    metrics = []
+    for name, columns in list(regions) + [('Total', [-1])]:
+        seconds = frames[:, columns].sum(axis=1)/frame_rate
+        distance = dist[:, columns].sum(axis=1)
+        metrics += [('Time', name, seconds), ('Dist', name, distance), ('Speed', name, calculate_speed(distance, seconds))]
+    return metrics
+
+def sweep_table(animal, windows, metrics, center=np.nan, arena=np.nan, scale=1.0):
+    """
+    Return the long/tidy table of the metrics of the windows with the parameters, the distances and speeds multiplied by scale
+    """
+    timebins = np.array([window[0] for window in windows])
+    periods = np.array([window[1] for window in windows], dtype=object)
+    parts = []
+    for metric, region, values in metrics:
+        parts.append(pd.DataFrame({'Animal no': animal, 'Timebin': timebins, 'Center fraction': center, 'Arena (cm2)': arena,
+                                   'Metric': metric, 'Region': region, 'Period': periods,
+                                   'Value': values*scale if metric != 'Time' else values}, columns=SWEEP_COLUMNS))
+    return pd.concat(parts, ignore_index=True)
+
+def sweep_animal(test, animal, coords, bonsai_file, frame_rate, time, total_exp_time_min, timebins, centers=SWEEP_CENTERS, arenas=(OFT_AREA,), width=None, height=None):
+    """
+    Return the long/tidy table of the time spent, distance travelled and speed of one animal for all time bins (s),
+    and for OFT all center fractions and arena sizes (cm2), from one classification of its positions (see above).
+    width and height of the video are needed for EPM.
+    """
+    x = bonsai_file['mouseX'].to_numpy()
+    y = bonsai_file['mouseY'].to_numpy()
+    windows = sweep_windows(frame_rate, time, total_exp_time_min, timebins)
+    starts = [window[2] for window in windows]
+    ends = [window[3] for window in windows]
+
+    if test == 'EPM':
+        coords_list = EPM_MAZE.rois(coords)
+        zone_labels = classify_frames(rasterize_ROI(coords_list, width, height), coords_list, x, y)
+        zone_cumsum = ZoneCumsum(zone_labels, step_distance(x, y, EPM_MAZE.pixel_size(coords)), EPM_MAZE.n_zone)
+        frames, dist = zone_cumsum.windows(starts, ends)
+        regions = [(name, [EPM_MAZE.n_zone if label == OUTSIDE else label for label in labels]) for name, labels in EPM_SWEEP_REGIONS]
+        return sweep_table(animal, windows, region_metrics(frames, dist, frame_rate, regions))
+
+    # All centers in one classification, the distances at the default arena size
+    centers = sorted(set(centers))
+    n_zone = len(centers)
+    zone_cumsum = ZoneCumsum(gauge_labels(center_gauge(coords, x, y), centers), step_distance(x, y, oft_pixel_size(coords)), n_zone)
+    frames, dist = zone_cumsum.windows(starts, ends)
+    tables = []
+    for k, center in enumerate(centers):
+        metrics = region_metrics(frames, dist, frame_rate, [('center', list(range(k+1))), ('border', list(range(k+1, n_zone+1)))])
+        for arena in arenas:
+            tables.append(sweep_table(animal, windows, metrics, center, arena, oft_pixel_size(coords, arena)/oft_pixel_size(coords)))
+    return pd.concat(tables, ignore_index=True)
+
+def save_sweep(table, file_path):
+    """
+    Save the table of the sweep as Parquet file (.parquet, requires pyarrow or fastparquet) or csv file
+    """
+    if file_path.endswith('.parquet'):
+        table.to_parquet(file_path, index=False)
+    else:
+        table.to_csv(file_path, index=False)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Timestamp index of the frames for time bins robust to dropped frames
+
+By default, the frame at a time is int(frame_rate*time) with the frame rate of the video, so a dropped frame shifts
+all later time bins. The timestamp index gives the time of each frame (in seconds from the first frame) instead:
+
+    - from the timestamp column of the Bonsai csv file (Timestamp), in seconds or as date and time
+      (e.g. 2021-06-15T10:23:45.1234567+09:00), or
+    - from the presentation timestamps of the frames of the video (slower, the whole video is read once).
+
+The frame at a time is found by binary search in the sorted timestamps, and each frame lasts until the next frame
+(the last frame: the median interval), so the time spent in a zone is the sum of the real intervals of its frames.
+The timestamps are cached in the binary sidecar of the bonsai file (see bonsai_io.py).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from .bonsai_io import read_bonsai_header, load_sidecar_array, save_sidecar_array
+
+# Column of the timestamps in the Bonsai csv file
+TIMESTAMP_COLUMN = 'Timestamp'
+
+class TimestampIndex(object):
+    """
+    Sorted time (in seconds from the first frame) of each frame
+    """
+    def __init__(self, seconds):
+        seconds = np.asarray(seconds, dtype=np.float64)
+        seconds = seconds - seconds[0] if len(seconds) else seconds
+
+        # Timestamps which go back (e.g. clock correction) are kept at the previous time
+        self.seconds = np.maximum.accumulate(seconds) if len(seconds) else seconds
+        self.n_frame = len(seconds)
+        intervals = np.diff(self.seconds)
+        last = np.median(intervals) if len(intervals) else 0.0
+        self.edges = np.append(self.seconds, self.seconds[-1] + last if len(seconds) else 0.0)
+
+    def frame_at(self, seconds):
+        """
+        Return the frame shown at the time (in seconds, scalar or array): the last frame whose timestamp is not after
+        it, 0 before the first frame and the number of frames after the end of the recording (like int(frame_rate*time))
+        """
+        frame = np.searchsorted(self.edges, seconds, side='right') - 1
+        frame = np.clip(frame, 0, self.n_frame)
+        return int(frame) if np.ndim(frame) == 0 else frame.astype(np.int64)
+
+    def durations(self):
+        """
+        Return the duration (in seconds) of each frame until the next frame
+        """
+        return np.diff(self.edges)
+
+    def dropped_frames(self, frame_rate):
+        """
+        Return the number of frames missing between the timestamps at the nominal frame rate
+        """
+        missing = np.rint(np.diff(self.seconds)*frame_rate) - 1
+        return int(missing[missing > 0].sum())
+
+def parse_timestamps(values):
+    """
+    Return the seconds from the first value of timestamps given as numbers (seconds) or as date and time strings
+    """
+    values = pd.Series(values)
+    numbers = pd.to_numeric(values, errors='coerce')
+    if numbers.notna().all():
+        seconds = numbers.to_numpy(dtype=np.float64)
+    else:
+        dates = pd.to_datetime(values, utc=True, format='ISO8601')
+        seconds = (dates - dates.iloc[0]).dt.total_seconds().to_numpy(dtype=np.float64)
+    return seconds - seconds[0] if len(seconds) else seconds
+
+def read_bonsai_timestamps(file_path, column=TIMESTAMP_COLUMN):
+    """
+    Read the timestamp column of a Bonsai csv file and return the seconds from the first frame
+    """
+    values = pd.read_csv(file_path, sep=r'\s+', engine='c', encoding='cp949', usecols=[column], dtype={column: str})[column]
+    return parse_timestamps(values)
+
+def read_video_timestamps(video_file):
+    """
+    Return the presentation timestamp (in seconds from the first frame) of each frame of a video file
+    """
+    import cv2 as cv
+    vid_cap = cv.VideoCapture(video_file)
+    seconds = []
+    try:
+        while vid_cap.grab():
+            seconds.append(vid_cap.get(cv.CAP_PROP_POS_MSEC)/1000)
+    finally:
+        vid_cap.release()
+    if not seconds:
+        raise ValueError('No frame can be read from %s'%(video_file))
+    return parse_timestamps(seconds)
+
+def load_timestamps(bonsai_csv, video_file=None, column=TIMESTAMP_COLUMN, cache=True):
+    """
+    Return the TimestampIndex of a bonsai file: from its timestamp column, or from the frames of the video if it has
+    no timestamp column. The seconds are cached in the sidecar of the bonsai file as long as it is not changed.
+    """
+    name = '__timestamps__'
+    seconds = load_sidecar_array(bonsai_csv, name) if cache else None
+    if seconds is None:
+        if column in read_bonsai_header(bonsai_csv):
+            seconds = read_bonsai_timestamps(bonsai_csv, column)
+        elif video_file is not None and os.path.exists(video_file):
+            seconds = read_video_timestamps(video_file)
+        else:
+            raise ValueError('%s has no column %s and no video to read the timestamps from'%(bonsai_csv, column))
+        if cache:
+            save_sidecar_array(bonsai_csv, name, seconds)
+    return TimestampIndex(seconds)
+
+def frame_durations(timestamps, n_frame, bonsai_csv=''):
+    """
+    Return the duration (s) of each frame from the TimestampIndex, which must have one timestamp per frame of the bonsai file
+    """
+    if timestamps.n_frame != n_frame:
+        raise ValueError('%d timestamps for the %d frames of %s'%(timestamps.n_frame, n_frame, bonsai_csv))
+    return timestamps.durations()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Tracking of the mouse in the video without Bonsai
+
+The background is the median of frames sampled over the whole video (the mouse moves, the maze does not). Each frame
+is compared with the background inside the clicked maze, and the centroid, area and ellipse of the largest blob are
+written in the same columns as the Bonsai csv file (mouseX, mouseY, ...). Frames without blob are NaN.
+Several arenas in one video (e.g. four OFT boxes) are tracked in the same pass, each in its own bounding box.
+
+The frames are decoded by a producer thread into a bounded queue, while the main thread segments them, so decoding
+and segmentation run at the same time (opencv releases the GIL).
+"""
+
+import threading
+import queue
+import numpy as np
+import cv2 as cv
+
+# Columns of the tracking file, like the Bonsai csv file
+TRACKING_COLUMNS = ('mouseX', 'mouseY', 'mouseArea', 'mouseMajorAxisLength', 'mouseMinorAxisLength', 'mouseAngle')
+
+# Number of frames sampled for the median background
+BACKGROUND_FRAMES = 25
+
+# Minimum difference of gray value from the background and minimum area (in pixels) of the mouse
+THRESHOLD = 30
+MIN_AREA = 20
+
+# Number of decoded frames waiting for the segmentation
+QUEUE_SIZE = 64
+
+# Margin around the clicked maze (in pixels)
+MARGIN = 10
+
+def arena_bbox(coords, width, height, margin=MARGIN):
+    """
+    Return the bounding box (x0, y0, x1, y1) of the clicked coordinates plus margin, clipped to the frame
+    """
+    coords = np.asarray(coords, dtype=float)
+    x0 = max(int(np.floor(coords[:, 0].min())) - margin, 0)
+    y0 = max(int(np.floor(coords[:, 1].min())) - margin, 0)
+    x1 = min(int(np.ceil(coords[:, 0].max())) + margin + 1, int(width))
+    y1 = min(int(np.ceil(coords[:, 1].max())) + margin + 1, int(height))
+    return x0, y0, x1, y1
+
+def to_gray(frame, bbox):
+    """
+    Crop a frame to the bounding box and convert it to gray
+    """
+    x0, y0, x1, y1 = bbox
+    frame = frame[y0:y1, x0:x1]
+    if frame.ndim == 3:
+        frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    return frame
+
+def median_background(video_file, bbox, n_frames=BACKGROUND_FRAMES):
+    """
+    Return the median of n_frames frames sampled evenly over the video (cropped, gray)
+    """
+    vid_cap = cv.VideoCapture(video_file)
+    n_total = int(vid_cap.get(cv.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for i in np.linspace(0, max(n_total-1, 0), n_frames).astype(int):
+        vid_cap.set(cv.CAP_PROP_POS_FRAMES, int(i))
+        success, frame = vid_cap.read()
+        if success:
+            frames.append(to_gray(frame, bbox))
+    vid_cap.release()
+    if not frames:
+        raise ValueError('No frame can be read from %s'%(video_file))
+    return np.median(np.stack(frames), axis=0).astype(np.uint8)
+
+def decode_frames(video_file, bbox, frames, stop):
+    """
+    Producer thread: decode the frames of the video, crop them and put them into the bounded queue (None at the end)
+    """
+    vid_cap = cv.VideoCapture(video_file)
+    try:
+        while not stop.is_set():
+            success, frame = vid_cap.read()
+            if not success:
+                break
+            frames.put(to_gray(frame, bbox))
+    finally:
+        vid_cap.release()
+        frames.put(None)
+
+def segment_frame(gray, background, threshold=THRESHOLD, min_area=MIN_AREA, kernel=None, mask=None):
+    """
+    Return (x, y, area, major axis length, minor axis length, angle) of the largest blob different from the background
+    in the cropped frame (only inside the mask), or NaN if there is no blob. The ellipse has the same second moments as the blob, the angle is
+    in radians.
+    """
+    diff = cv.absdiff(gray, background)
+    if mask is not None:
+        diff = cv.bitwise_and(diff, mask)
+    _, mask = cv.threshold(diff, threshold, 255, cv.THRESH_BINARY)
+    if kernel is not None:
+        mask = cv.morphologyEx(mask, cv.MORPH_OPEN, kernel)
+    contours, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return (np.nan,)*len(TRACKING_COLUMNS)
+    contour = max(contours, key=cv.contourArea)
+    moments = cv.moments(contour)
+    area = moments['m00']
+    if area < min_area:
+        return (np.nan,)*len(TRACKING_COLUMNS)
+
+    # Ellipse from the normalized central moments
+    x = moments['m10'] / area
+    y = moments['m01'] / area
+    mu20 = moments['mu20'] / area
+    mu02 = moments['mu02'] / area
+    mu11 = moments['mu11'] / area
+    common = np.sqrt(4*mu11**2 + (mu20 - mu02)**2)
+    major = 2*np.sqrt(2*(mu20 + mu02 + common))
+    minor = 2*np.sqrt(max(2*(mu20 + mu02 - common), 0))
+    angle = 0.5*np.arctan2(2*mu11, mu20 - mu02)
+    return (x, y, area, major, minor, angle)
+
+def arena_mask(coords, bbox, margin=MARGIN):
+    """
+    Return the mask (255 inside) of the clicked maze plus margin in the bounding box, so that the mouse of a
+    neighbouring arena in the bounding box is ignored
+    """
+    x0, y0, x1, y1 = bbox
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    polygon = np.round(np.asarray(coords, dtype=float) - [x0, y0]).astype(np.int32)
+    cv.fillPoly(mask, [polygon], 255)
+    if margin > 0:
+        mask = cv.dilate(mask, cv.getStructuringElement(cv.MORPH_ELLIPSE, (2*margin+1, 2*margin+1)))
+    return mask
+
+def track_arenas(video_file, arena_coords, width, height, threshold=THRESHOLD, min_area=MIN_AREA, queue_size=QUEUE_SIZE):
+    """
+    Track one mouse in each arena of the video (arena_coords: clicked coordinates of each arena) in one pass over the
+    video and return an array of TRACKING_COLUMNS per frame for each arena (positions in pixels of the whole frame)
+    """
+    # Only the bounding box of all arenas is decoded into the queue, each arena is segmented in its own box
+    bboxes = [arena_bbox(coords, width, height) for coords in arena_coords]
+    bbox = (min(b[0] for b in bboxes), min(b[1] for b in bboxes), max(b[2] for b in bboxes), max(b[3] for b in bboxes))
+    background = median_background(video_file, bbox)
+    arenas = []
+    for coords, (x0, y0, x1, y1) in zip(arena_coords, bboxes):
+        crop = (slice(y0 - bbox[1], y1 - bbox[1]), slice(x0 - bbox[0], x1 - bbox[0]))
+        arenas.append((crop, background[crop], arena_mask(coords, (x0, y0, x1, y1))))
+    kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (3, 3))
+
+    frames = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    producer = threading.Thread(target=decode_frames, args=(video_file, bbox, frames, stop), daemon=True)
+    producer.start()
+    rows = [[] for _ in arenas]
+    try:
+        while True:
+            gray = frames.get()
+            if gray is None:
+                break
+            for k, (crop, arena_background, mask) in enumerate(arenas):
+                rows[k].append(segment_frame(gray[crop], arena_background, threshold, min_area, kernel, mask))
+    finally:
+        # Let the producer finish if the segmentation failed
+        stop.set()
+        while producer.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+    tracks = []
+    for arena_rows, (x0, y0, x1, y1) in zip(rows, bboxes):
+        track = np.array(arena_rows, dtype=np.float64).reshape(-1, len(TRACKING_COLUMNS))
+        track[:, 0] += x0
+        track[:, 1] += y0
+        tracks.append(track)
+    return tracks
+
+def track_video(video_file, coords, width, height, threshold=THRESHOLD, min_area=MIN_AREA, queue_size=QUEUE_SIZE):
+    """
+    Track the mouse in the video inside the clicked maze and return an array of TRACKING_COLUMNS per frame
+    (positions in pixels of the whole frame)
+    """
+    return track_arenas(video_file, [coords], width, height, threshold, min_area, queue_size)[0]
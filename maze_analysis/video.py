@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+First frame of the videos and the clicked corners of the mazes
+
+opencv is imported when a video is read or its first frame pops up, so the analysis of calibrated videos from the
+cache and the command line tools start without it.
+"""
+
+def read_video(video_file):
+    """
+    Read the first frame, the frame rate, the width and the height of a video file by opencv package
+    """
+    import cv2 as cv
+    vid_cap=cv.VideoCapture(video_file)
+    success, image = vid_cap.read()
+    frame_rate = vid_cap.get(cv.CAP_PROP_FPS)
+    height = vid_cap.get(cv.CAP_PROP_FRAME_HEIGHT)
+    width = vid_cap.get(cv.CAP_PROP_FRAME_WIDTH)
+    vid_cap.release()
+
+    img = None
+    if success == 1:
+        img = image
+    return img, frame_rate, width, height
+
+def click_coords(anim_id, img):
+    """
+    Pop the first image of video file up and return the coordinates of the mouse clicks (left mouse click)
+    """
+    import cv2 as cv
+    coords = []
+
+    def onclick(event, x, y, flag, image):
+        if event == cv.EVENT_LBUTTONUP:
+            coords.append((x,y))
+
+    cv.namedWindow('Image_%s'%(anim_id), cv.WINDOW_NORMAL)
+    cv.imshow('Image_%s'%(anim_id), img)
+
+    # Save coordinates of the mouse clicks in coords
+    cv.setMouseCallback('Image_%s'%(anim_id), onclick, img)
+
+    # wait for Esc or q key and then exit
+    while True:
+        key = cv.waitKey(1) & 0xFF
+        if key == 27 or key == ord("q"):
+            cv.destroyAllWindows()
+            break
+    return coords
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Zone classification of mouse positions by a precomputed ROI label raster
+
+Instead of calling Path.contains_point for every frame and every ROI, the ROIs are rasterized once into
+a label image (height x width) at the resolution of the video. The zone of each frame is then found by
+one vectorized lookup of the pixel where the mouse is.
+
+Tie-break for pixels on ROI edges:
+    A pixel which lies completely inside one ROI gets the index of this ROI (position in the list of ROIs).
+    When several ROIs cover the same pixel (nested or overlapping ROIs), the ROI which comes FIRST in the
+    list wins. This is the same precedence as the if/elif chain used for the distance.
+    A pixel which is crossed by an ROI edge (or contains an ROI corner) gets the label EDGE. Frames in EDGE
+    pixels are not approximated: they are classified exactly by Path.contains_points with the same precedence.
+    Since only the frames close to the edges are tested, the exact test costs a small fraction of the old loop.
+    Pixels which are not inside any ROI and NaN positions (mouse not detected by Bonsai) get the label OUTSIDE.
+"""
+
+import numpy as np
+
+# Label of the pixels (and frames) which are not inside any ROI
+OUTSIDE = 255
+# Label of the pixels which are crossed by the edge of a ROI (only in the label raster, never in zone labels)
+EDGE = 254
+
+def rasterize_ROI(coords_list, width, height, x_0=0, y_0=0):
+    """
+    Rasterize the list of ROIs (matplotlib Path) into a label image of the video size and return it.
+    The value of each pixel is the index of the ROI in coords_list, EDGE or OUTSIDE (see the tie-break above).
+    With x_0 and y_0, the label image only covers the pixels x_0 .. x_0+width-1 and y_0 .. y_0+height-1 of the video.
+    """
+    width = int(width)
+    height = int(height)
+    x_0 = int(x_0)
+    y_0 = int(y_0)
+    if len(coords_list) >= EDGE:
+        raise Exception('Only %s ROIs can be rasterized in one label image.'%(EDGE))
+
+    # Label the corners of all pixels (pixel (row, col) spans col-0.5 .. col+0.5 and row-0.5 .. row+0.5)
+    corner_labels = np.full((height+1, width+1), OUTSIDE, dtype=np.uint8)
+
+    # Paint the ROIs in reverse order, so that the first ROI wins on shared pixels
+    for i in reversed(range(len(coords_list))):
+        # Only test the pixel corners in the bounding box of the ROI
+        extents = coords_list[i].get_extents()
+        j_0 = min(max(int(np.floor(extents.x0 + 0.5)) - x_0, 0), width+1)
+        j_1 = min(max(int(np.ceil(extents.x1 + 0.5)) + 1 - x_0, 0), width+1)
+        k_0 = min(max(int(np.floor(extents.y0 + 0.5)) - y_0, 0), height+1)
+        k_1 = min(max(int(np.ceil(extents.y1 + 0.5)) + 1 - y_0, 0), height+1)
+        if j_0 == j_1 or k_0 == k_1:
+            continue
+        xx, yy = np.meshgrid(np.arange(j_0, j_1) + x_0 - 0.5, np.arange(k_0, k_1) + y_0 - 0.5)
+        inside = coords_list[i].contains_points(np.column_stack([xx.ravel(), yy.ravel()]))
+        corner_labels[k_0:k_1, j_0:j_1][inside.reshape(xx.shape)] = i
+
+    # A pixel keeps its label only when its 4 corners have the same label
+    label_raster = corner_labels[:-1, :-1].copy()
+    mixed = ((corner_labels[:-1, :-1] != corner_labels[1:, :-1]) | (corner_labels[:-1, :-1] != corner_labels[:-1, 1:]) |
+             (corner_labels[:-1, :-1] != corner_labels[1:, 1:]))
+    label_raster[mixed] = EDGE
+
+    # The corners of the ROIs can poke into a pixel without separating its corners
+    for roi in coords_list:
+        for x, y in roi.vertices:
+            col_0, col_1 = max(int(np.ceil(x - 0.5)) - x_0, 0), min(int(np.floor(x + 0.5)) - x_0, width-1)
+            row_0, row_1 = max(int(np.ceil(y - 0.5)) - y_0, 0), min(int(np.floor(y + 0.5)) - y_0, height-1)
+            if col_0 <= col_1 and row_0 <= row_1:
+                label_raster[row_0:row_1+1, col_0:col_1+1] = EDGE
+    return label_raster
+
+def classify_frames(label_raster, coords_list, x, y):
+    """
+    Look up the zone label of each frame from its position (mouseX, mouseY) and return the labels as uint8 array.
+    Frames in EDGE pixels and outside of the video frame are classified exactly by the ROIs in coords_list.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    height, width = label_raster.shape
+    zone_labels = np.full(x.shape, OUTSIDE, dtype=np.uint8)
+
+    col = np.rint(x)
+    row = np.rint(y)
+    in_frame = (col >= 0) & (col < width) & (row >= 0) & (row < height)
+    zone_labels[in_frame] = label_raster[row[in_frame].astype(np.intp), col[in_frame].astype(np.intp)]
+
+    # Exact test for the frames on the edges of ROIs (NaN positions stay OUTSIDE)
+    unresolved = (zone_labels == EDGE) | (~in_frame & np.isfinite(x) & np.isfinite(y))
+    zone_labels[unresolved] = OUTSIDE
+    index = np.flatnonzero(unresolved)
+    for i in range(len(coords_list)):
+        if len(index) == 0:
+            break
+        inside = coords_list[i].contains_points(np.column_stack([x[index], y[index]]))
+        zone_labels[index[inside]] = i
+        index = index[~inside]
+    return zone_labels
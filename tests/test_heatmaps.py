@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Orientation of the normalized arena of the heatmaps
+"""
+
+from maze_analysis.heatmaps import arena_points, perspective_transform, normalize_positions
+
+# Clicked corners of a plus maze (image coordinates, y down): closed arm up, open arm left, closed arm down, open arm right
+EPM_COORDS = [(200, 0), (200, 200), (0, 200), (0, 220), (200, 220), (200, 420),
+              (220, 420), (220, 220), (420, 220), (420, 200), (220, 200), (220, 0)]
+
+# Corners of an open field, clockwise from the top left
+OFT_COORDS = [(0, 0), (400, 0), (400, 400), (0, 400)]
+
+def normalize(test, coords, x, y):
+    u, v = normalize_positions(perspective_transform(*arena_points(test, coords)), [x], [y])
+    return u[0], v[0]
+
+def test_epm_left_arm_stays_left():
+    u, v = normalize('EPM', EPM_COORDS, 50, 210)
+    assert u < 0.5
+    assert abs(v - 0.5) < 1e-9
+
+def test_epm_right_arm_stays_right():
+    u, v = normalize('EPM', EPM_COORDS, 370, 210)
+    assert u > 0.5
+
+def test_epm_up_arm_stays_up():
+    u, v = normalize('EPM', EPM_COORDS, 210, 50)
+    assert v < 0.5
+    assert abs(u - 0.5) < 1e-9
+
+def test_oft_keeps_orientation():
+    u, v = normalize('OFT', OFT_COORDS, 100, 300)
+    assert u < 0.5 and v > 0.5
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+The optimized sums give the numbers of the in-memory path on a short synthetic track: the prefix sums (ZoneCumsum) the
+numbers of the reference loops, the streaming sums and the cohort sums the numbers of ZoneCumsum
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The benchmarks import their modules by name from their directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from run_benchmarks import Maze, check_track
+from synthetic import MOTIONS, WIDTH, HEIGHT, track_file
+from maze_analysis import rasterize_ROI, classify_frames, step_distance, ZoneCumsum, load_bonsai, stream_zone_sums
+from maze_analysis.cohort import cohort_sums
+
+# Number of frames of the synthetic tracks
+N_FRAME = 3000
+
+# Windows clipped at the start and at the end of the track, and a window of one frame
+EXTRA_WINDOWS = [(-5, 3), (100, 101), (N_FRAME-5, N_FRAME+100), (0, N_FRAME)]
+
+# Regions and states of the zone events (EPM: open arms, closed arms, center, OFT: centers and no zone)
+REGIONS = [[0, 1], [2, 3], [4]]
+
+def in_memory(maze, bonsai_csv):
+    """
+    Return the ZoneCumsum and the ZoneEvents of the track loaded in memory
+    """
+    bonsai_file = load_bonsai(bonsai_csv, cache=False).astype(np.float64)
+    zone_labels = maze.labels(bonsai_file)
+    zone_cumsum = ZoneCumsum(zone_labels, step_distance(bonsai_file['mouseX'], bonsai_file['mouseY'], maze.p), len(maze.rois))
+    return zone_cumsum, maze.events(zone_labels, bonsai_file)
+
+@pytest.mark.parametrize('test', ['EPM', 'OFT'])
+@pytest.mark.parametrize('motion', MOTIONS)
+def test_prefix_sums_match_reference_loops(tmp_path, test, motion):
+    check = check_track(test, motion, N_FRAME, str(tmp_path))
+    assert check['ok'], check
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 1000])
+@pytest.mark.parametrize('test', ['EPM', 'OFT'])
+def test_streaming_matches_in_memory(tmp_path, test, chunk_size):
+    maze = Maze(test, N_FRAME)
+    bonsai_csv = track_file(str(tmp_path), test, 'random', N_FRAME)
+    zone_cumsum, events = in_memory(maze, bonsai_csv)
+
+    raster = rasterize_ROI(maze.rois, WIDTH, HEIGHT)
+    windows = maze.windows + EXTRA_WINDOWS
+    zone_sums = stream_zone_sums(bonsai_csv, windows, lambda x, y: classify_frames(raster, maze.rois, x, y), maze.p,
+                                 len(maze.rois), chunk_size, carry_outside=test == 'EPM', draw_windows=windows)
+    streamed = zone_sums.zone_events()
+    bonsai_file = load_bonsai(bonsai_csv, cache=False)
+
+    for k, (a, b) in enumerate(windows):
+        assert np.array_equal(zone_sums.frames(a, b), zone_cumsum.frames(a, b))
+        assert np.allclose(zone_sums.distance(a, b), zone_cumsum.distance(a, b), rtol=1e-12, atol=1e-9)
+        for labels in REGIONS:
+            assert streamed.entries(labels, a, b) == events.entries(labels, a, b)
+            assert streamed.bouts(labels, a, b) == events.bouts(labels, a, b)
+            assert np.array_equal(streamed.latency(labels, a, b, maze.frame_rate), events.latency(labels, a, b, maze.frame_rate), equal_nan=True)
+        assert np.array_equal(streamed.transitions(REGIONS, a, b), events.transitions(REGIONS, a, b))
+
+        # The short windows keep every frame to draw
+        positions = bonsai_file.iloc[max(a, 0):max(b, 0)]
+        trajectory = zone_sums.trajectory(k)
+        assert np.array_equal(trajectory['mouseX'].to_numpy(), positions['mouseX'].to_numpy(), equal_nan=True)
+        assert np.array_equal(trajectory['mouseY'].to_numpy(), positions['mouseY'].to_numpy(), equal_nan=True)
+
+def test_cohort_matches_each_animal(tmp_path):
+    # Animals with tracks of different lengths
+    lengths = [N_FRAME, N_FRAME - 700, N_FRAME + 400]
+    mazes = [Maze('EPM', n_frame) for n_frame in lengths]
+    bonsai_csvs = [track_file(str(tmp_path), 'EPM', MOTIONS[k % len(MOTIONS)], n_frame, seed=k) for k, n_frame in enumerate(lengths)]
+    animals = [in_memory(maze, bonsai_csv) for maze, bonsai_csv in zip(mazes, bonsai_csvs)]
+
+    # Window k of every animal: starts a and ends b with one value per animal
+    windows = [(np.array(a), np.array(b)) for a, b in (zip(*edges) for edges in zip(*[maze.windows for maze in mazes]))]
+    sums, events = cohort_sums(bonsai_csvs, [maze.rois for maze in mazes], [maze.p for maze in mazes], len(mazes[0].rois),
+                               windows, carry_outside=True)
+
+    for a, b in windows:
+        frames = sums.frames(a, b)
+        distance = sums.distance(a, b)
+        entries = events.entries(REGIONS[0], a, b)
+        for k, (zone_cumsum, animal_events) in enumerate(animals):
+            assert np.array_equal(frames[:, k], zone_cumsum.frames(a[k], b[k]))
+            assert np.allclose(distance[:, k], zone_cumsum.distance(a[k], b[k]), rtol=1e-12, atol=1e-9)
+            assert entries[k] == animal_events.entries(REGIONS[0], a[k], b[k])